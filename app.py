@@ -1,30 +1,361 @@
-import mysql.connector
-import configparser
-from flask import Flask, render_template, flash, redirect, url_for, request
-from flask_mysqldb import MySQL
-from validate_email_address import validate_email
-from wtforms import Form, validators, StringField, FloatField, IntegerField, DateField, SelectField
-from datetime import datetime
+import functools
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from flask import (Flask, Response, render_template, stream_template, stream_with_context, flash, redirect, url_for,
+                   request, jsonify, make_response, session, get_flashed_messages)
+from markupsafe import Markup
+import click
+from wtforms import Form, validators, StringField, FloatField, IntegerField, DateField, SelectField, BooleanField
 import MySQLdb
-import urllib.parse
-import requests
-
+import MySQLdb.cursors
+from importer import BookImporter, FRAPPE_LIBRARY_URL
+from frappe_client import TokenBucket, ResponseCache, CONNECT_TIMEOUT, READ_TIMEOUT, RETRIES, CACHE_TTL
+from jobs import JobQueue, JobStore, STALE_AFTER
+from cache import LRUCache, TableVersions, make_cache
+from bulk_load import BulkLoader, ErrorFile, read_records
+from export import export_table, export_filename, EXPORT_TABLES, EXPORT_FORMATS
+from fees import compute_fees, fee_summary, member_fees
+from rollups import member_stats, library_stats, rebuild_rollups
+from archive import archive_transactions, COLUMNS as TRANSACTION_COLUMNS
+from circulation import (issue_book, return_book, loan_charge, place_hold, cancel_hold, expire_holds,
+                         active_holds, CirculationError, BookUnavailable)
+from db import Database
+from migrate import load_migrations, current_version, upgrade, downgrade, stamp, MigrationError
+from instrumentation import Instrumentation, setup_logging, log, PROMETHEUS_CONTENT_TYPE
+from search import SearchIndex, FIELDS as SEARCH_FIELDS
+from catalog import CatalogSnapshot
+from settings import load_config
+from validation import EmailChecker
+
+# Importing this module only defines the app; create_app() configures it from
+# config.ini or the environment (see settings.py) and sets up the extensions.
+# Entry points: wsgi.py (gunicorn, `flask` CLI), asgi.py, `python app.py`.
+# Nothing connects to the database before the first request, so a server can
+# import the app once and fork its workers from it.
 app = Flask(__name__)
 
-# Loading configuration 
-config = configparser.ConfigParser()
-config.read('config.ini')
+mysql = Database()
+
+# Schema migrations (migrations/, `flask db ...`). Requests are refused with
+# 503 until the database is at the latest version; schema_check = warn only
+# logs, off skips the check.
+MIGRATIONS = load_migrations()
+schema_current = False
+
+# Request/query metrics, structured logs and sampled profiling of slow requests
+instrumentation = Instrumentation()
+
+# Background jobs (imports, loads, fee passes), kept in the jobs table so
+# that any process can report their progress
+jobs = JobQueue()
+jobs.store = JobStore(mysql.session, mysql.connect)
+
+# FrappeClient options shared by all imports of this process: timeouts,
+# retries, the [import] rate limit and the on-disk response cache. Set up by
+# create_app().
+import_client_options = {}
+
+# Full-text search index, built from the books table on first use, kept
+# current by this process's write routes and reloaded in the background
+# when the books table version changes (another process wrote, see
+# changed()) or after [search] max_age seconds.
+search_index = SearchIndex()
+
+# Compact in-process copy of the books listing columns (catalog.py), used
+# for the id-sorted listing and availability checks when [catalog] snapshot
+# is set. Loaded on first use, kept current by this process's write routes
+# and reloaded in the background like search_index, after [catalog] max_age
+# seconds.
+catalog = CatalogSnapshot()
+
+# Caches for the book/member lookup API. Entries are keyed by a lookup
+# version that the write routes bump (clear_lookups()), so with a shared
+# [cache] redis_url every worker drops its entries at once; otherwise other
+# workers' entries expire within a minute.
+lookup_caches = {
+    'books': LRUCache(maxsize=2048, ttl=60),
+    'members': LRUCache(maxsize=2048, ttl=60),
+}
+
+# Member email checks (validation.py); MX verification is off unless
+# [members] verify_mx is set
+email_checker = EmailChecker()
+
+# Read-through cache for book and member records (detail pages), shared
+# through Redis when [cache] redis_url is set. Write routes invalidate the
+# records they change. Set up by create_app().
+record_cache = None
+
+# Page caching. Write routes bump the version of the tables they change
+# (changed()); the listing and detail pages send ETags built from those
+# versions and answer a matching If-None-Match with 304 without rendering,
+# and the listing tables are rendered once per version into fragment_cache.
+# Both live in Redis when [cache] redis_url is set, otherwise per process,
+# where another worker's writes show up after [cache] ttl. [cache] pages =
+# false turns this off. Set up by create_app().
+table_versions = None
+fragment_cache = None
+
+
+def create_app(config_file=None):
+    global record_cache, table_versions, fragment_cache, import_client_options
+    if 'library' in app.extensions:
+        return app
+    config = load_config(config_file)
+    app.extensions['library'] = config
+
+    # MySQL Config
+    app.config['MYSQL_HOST'] = config['database']['host']
+    app.config['MYSQL_USER'] = config['database']['user']
+    app.config['MYSQL_PASSWORD'] = config['database']['password']
+    app.config['MYSQL_PORT'] = config.getint('database', 'port')
+    app.config['MYSQL_DB'] = config['database']['db']
+    app.config['MYSQL_CURSORCLASS'] = 'DictCursor'
+    # Enough for every request thread of a worker ([server] threads), every
+    # job worker and the search index and catalog reloads at once
+    app.config['MYSQL_POOL_SIZE'] = config.getint('database', 'pool_size', fallback=(
+        config.getint('server', 'threads', fallback=4) + config.getint('jobs', 'workers', fallback=2) + 2))
+    app.config['MYSQL_POOL_TIMEOUT'] = config.getfloat('database', 'pool_timeout', fallback=10)
+    app.config['MYSQL_POOL_RECYCLE'] = config.getint('database', 'pool_recycle', fallback=3600)
+    app.config['MYSQL_ASYNC_POOL_SIZE'] = config.getint('database', 'async_pool_size', fallback=20)
+    app.config['SCHEMA_CHECK'] = config.get('database', 'schema_check', fallback='strict')
+    app.secret_key = config['app']['secret_key']
+
+    # Book import (frappe-library API)
+    app.config['IMPORT_BASE_URL'] = config.get('import', 'base_url', fallback=FRAPPE_LIBRARY_URL)
+    app.config['IMPORT_WORKERS'] = config.getint('import', 'workers', fallback=4)
+    cache_ttl = config.getint('import', 'cache_ttl', fallback=CACHE_TTL)
+    import_client_options = {
+        'connect_timeout': config.getfloat('import', 'connect_timeout', fallback=CONNECT_TIMEOUT),
+        'read_timeout': config.getfloat('import', 'read_timeout', fallback=READ_TIMEOUT),
+        'retries': config.getint('import', 'retries', fallback=RETRIES),
+        # Requests per second (0: no limit) and burst size
+        'limiter': TokenBucket(config.getfloat('import', 'rate', fallback=0),
+                               burst=config.getint('import', 'burst', fallback=app.config['IMPORT_WORKERS'])),
+        'cache': ResponseCache(config.get('import', 'cache_dir',
+                                          fallback=os.path.join(tempfile.gettempdir(), 'library-import-cache')),
+                               ttl=cache_ttl) if cache_ttl > 0 else None,
+    }
+
+    # Loan period after which an open loan counts as overdue
+    app.config['LOAN_DAYS'] = config.getint('fees', 'loan_days', fallback=14)
+
+    # Days a member has to pick up a book set aside for their hold
+    app.config['HOLD_PICKUP_DAYS'] = config.getint('holds', 'pickup_days', fallback=3)
+
+    # Returned loans older than this move to transactions_archive (`flask archive-transactions`)
+    app.config['ARCHIVE_AFTER_DAYS'] = config.getint('archive', 'after_days', fallback=365)
+    app.config['ARCHIVE_BATCH_SIZE'] = config.getint('archive', 'batch_size', fallback=1000)
+    app.config['ARCHIVE_PAUSE'] = config.getfloat('archive', 'pause', fallback=0.5)
+
+    app.config['CATALOG_SNAPSHOT'] = config.getboolean('catalog', 'snapshot', fallback=False)
+    catalog.max_age = config.getint('catalog', 'max_age', fallback=300) or None
+    search_index.max_age = config.getint('search', 'max_age', fallback=300) or None
+
+    app.config['METRICS_SLOW_REQUEST'] = config.getfloat('metrics', 'slow_request_ms', fallback=500) / 1000
+    app.config['METRICS_SLOW_QUERY'] = config.getfloat('metrics', 'slow_query_ms', fallback=100) / 1000
+    app.config['METRICS_N_PLUS_ONE_THRESHOLD'] = config.getint('metrics', 'n_plus_one_threshold', fallback=10)
+    app.config['METRICS_PROFILE_RATE'] = config.getfloat('metrics', 'profile_rate', fallback=0.0)
+    app.config['METRICS_PROFILE_DIR'] = config.get('metrics', 'profile_dir', fallback=None)
+
+    setup_logging(config.get('metrics', 'log_level', fallback='INFO'))
+    mysql.init_app(app)
+    instrumentation.init_app(app, mysql)
+    jobs.workers = config.getint('jobs', 'workers', fallback=2)
+    jobs.store.stale_after = config.getint('jobs', 'stale_after', fallback=STALE_AFTER)
+    email_checker.verify_mx = config.getboolean('members', 'verify_mx', fallback=False)
+    email_checker.domains.ttl = config.getint('members', 'mx_cache_ttl', fallback=email_checker.domains.ttl)
+    redis_url = config.get('cache', 'redis_url', fallback=None)
+    cache_ttl = config.getint('cache', 'ttl', fallback=300)
+    record_cache = make_cache(redis_url, maxsize=config.getint('cache', 'maxsize', fallback=10000), ttl=cache_ttl)
+    app.config['PAGE_CACHE'] = config.getboolean('cache', 'pages', fallback=True)
+    app.config['PAGE_VERSION'] = page_version()
+    # Shared versions only change when something writes; per-process ones
+    # expire so that other workers' writes show up
+    table_versions = TableVersions(make_cache(redis_url, maxsize=64, ttl=None if redis_url else cache_ttl,
+                                              prefix='library-version:'))
+    fragment_cache = make_cache(redis_url, maxsize=config.getint('cache', 'fragments', fallback=256), ttl=cache_ttl,
+                                prefix='library-fragment:')
+    return app
+
+
+def page_version():
+    # Changes with the templates and this module, so that a deploy does not
+    # match ETags or fragments rendered by the previous code
+    digest = hashlib.sha1()
+    for path in [__file__] + sorted(glob.glob(os.path.join(app.root_path, app.template_folder, '*.html'))):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def load_search_index():
+    # Rows are streamed through an unbuffered cursor so a reload does not
+    # hold the whole books table in memory next to the index it builds
+    version = table_versions.get('books')
+    with mysql.cursor(MySQLdb.cursors.SSCursor) as cursor:
+        search_index.load_from_cursor(cursor, version)
+
+
+def reload_search_index():
+    # Runs on its own thread, outside of any request. Book lookups cached
+    # before another process's write go with the old index.
+    try:
+        with app.app_context():
+            load_search_index()
+        lookup_caches['books'].clear()
+    except Exception:
+        search_index.invalidate()
+        log.exception('search_index_reload_failed')
+
+
+def get_search_index():
+    if not search_index.loaded:
+        search_index.load_once(load_search_index)
+    elif search_index.stale(table_versions.get('books')) and search_index.start_refresh():
+        threading.Thread(target=reload_search_index, name='search-reload', daemon=True).start()
+    return search_index
+
+
+def load_catalog():
+    # Streamed like load_search_index(); the snapshot keeps a fraction of
+    # what the rows would take
+    version = table_versions.get('books')
+    with mysql.cursor(MySQLdb.cursors.SSCursor) as cursor:
+        catalog.load_from_cursor(cursor, version)
 
-# MySQL Config
-app.config['MYSQL_HOST'] = config['database']['host']
-app.config['MYSQL_USER'] = config['database']['user']
-app.config['MYSQL_PASSWORD'] = config['database']['password']
-app.config['MYSQL_PORT'] = config.getint('database', 'port')
-app.config['MYSQL_DB'] = config['database']['db']
-app.config['MYSQL_CURSORCLASS'] = 'DictCursor'
-app.secret_key = config['app']['secret_key']
 
-mysql = MySQL(app)
+def reload_catalog():
+    # Runs on its own thread, outside of any request
+    try:
+        with app.app_context():
+            load_catalog()
+    except Exception:
+        catalog.invalidate()
+        log.exception('catalog_reload_failed')
+
+
+def get_catalog():
+    if not catalog.loaded:
+        catalog.load_once(load_catalog)
+    elif catalog.stale(table_versions.get('books')) and catalog.start_refresh():
+        threading.Thread(target=reload_catalog, name='catalog-reload', daemon=True).start()
+    return catalog
+
+
+def refresh_catalog(*ids):
+    # Re-reads books changed by a write route into the snapshot; ids that no
+    # longer exist are dropped
+    if not catalog.loaded:
+        return
+    ids = [int(id) for id in ids if str(id).isdigit()]
+    if not ids:
+        return
+    with mysql.cursor() as cursor:
+        cursor.execute(*books_by_ids_query(ids, BOOK_COLUMNS))
+        books = cursor.fetchall()
+    for book in books:
+        catalog.put(book)
+    for id in set(ids) - {book['id'] for book in books}:
+        catalog.remove(id)
+
+
+def record_key(table, id):
+    id = str(id)
+    return f"{table}:{int(id) if id.isdigit() else id}"
+
+
+def get_record(table, id):
+    key = record_key(table, id)
+    record = record_cache.get(key)
+    if record is None:
+        with mysql.cursor() as cursor:
+            cursor.execute(f"SELECT * FROM {table} WHERE id=%s", [id])
+            record = cursor.fetchone()
+        if record is not None:
+            record_cache.set(key, record)
+    return record
+
+
+def invalidate_record(table, *ids):
+    for id in ids:
+        record_cache.delete(record_key(table, id))
+
+
+def changed(*tables):
+    # New ETags and fragments for the pages showing `tables`. The search
+    # index and catalog snapshot of this process already have its own writes,
+    # so they move to the new books version; other processes see it change
+    # and reload theirs.
+    previous = table_versions.get('books') if 'books' in tables else None
+    versions = table_versions.bump(*tables)
+    if 'books' in tables:
+        search_index.follow(previous, versions['books'])
+        catalog.follow(previous, versions['books'])
+
+
+def clear_lookups(table):
+    # Drops this process's lookup entries for `table` and, through the
+    # shared versions, every other worker's
+    lookup_caches[table].clear()
+    table_versions.bump(f'{table}-lookup')
+
+
+def cached_fragment(key, tables, render):
+    # render()'s result, kept until one of `tables` changes
+    if not app.config['PAGE_CACHE']:
+        return render()
+    key = f"{app.config['PAGE_VERSION']}:{key}:{table_versions.key(tables)}"
+    value = fragment_cache.get(key)
+    if value is None:
+        value = render()
+        fragment_cache.set(key, value)
+    return value
+
+
+def conditional(*tables):
+    # ETag for a page that only shows `tables`; a request that already has
+    # the current version gets 304 without running the view. Pages carrying
+    # flash messages are never cached.
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not app.config['PAGE_CACHE'] or '_flashes' in session:
+                return view(*args, **kwargs)
+            etag = hashlib.sha1(f"{app.config['PAGE_VERSION']}:{request.full_path}:"
+                                f"{table_versions.key(tables)}".encode()).hexdigest()
+            if etag in request.if_none_match:
+                response = app.response_class(status=304)
+                response.set_etag(etag)
+                return response
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not get_flashed_messages():
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+@app.before_request
+def check_schema_version():
+    global schema_current
+    if schema_current or app.config['SCHEMA_CHECK'] == 'off' or request.endpoint in ('static', 'metrics'):
+        return None
+    version = current_version(mysql.connection)
+    latest = MIGRATIONS[-1].version
+    if version == latest:
+        schema_current = True
+        return None
+    log.error('schema_out_of_date', extra={'fields': {'version': version, 'latest': latest}})
+    if app.config['SCHEMA_CHECK'] == 'warn':
+        schema_current = True
+        return None
+    return f"Database schema is at version {version}, this app needs {latest}. Run `flask db upgrade`.", 503
 
 
 # Home
@@ -32,23 +363,120 @@ mysql = MySQL(app)
 def index():
     return render_template('home.html')
 
+# Books listing
+# Pages are fetched with keyset (seek) pagination: every page is a single
+# index range scan that starts right after the last row of the previous
+# page, so page 1000 costs the same as page 1. Sorting by title/author
+# relies on the (title, id) and (author, id) indexes (migrations/0002).
+BOOK_COLUMNS = "id,title,author,total_quantity,available_quantity"
+BOOK_SORT_KEYS = ('id', 'title', 'author')
+BOOKS_PER_PAGE = 50
+BOOKS_MAX_PER_PAGE = 500
+BOOKS_STREAM_CHUNK = 1000
+
+
+def fetch_books_page(cursor, sort='id', after=None, key=None, before=False, limit=BOOKS_PER_PAGE):
+    # `after` is the id of the boundary row and `key` its value in the sort
+    # column; with before=True the page ending at that row is returned.
+    op, order = ('<', 'DESC') if before else ('>', 'ASC')
+    params = []
+    where = ''
+    if after is not None:
+        if sort == 'id':
+            where = f"WHERE id {op} %s"
+            params = [after]
+        else:
+            where = f"WHERE {sort} {op} %s OR ({sort} = %s AND id {op} %s)"
+            params = [key, key, after]
+
+    if sort == 'id':
+        order_by = f"id {order}"
+    else:
+        order_by = f"{sort} {order}, id {order}"
+
+    cursor.execute(f"SELECT {BOOK_COLUMNS} FROM books {where} ORDER BY {order_by} LIMIT %s",
+                   params + [limit])
+    rows = list(cursor.fetchall())
+    if before:
+        rows.reverse()
+    return rows
+
+
+def books_page(sort='id', after=None, key=None, before=False, limit=BOOKS_PER_PAGE):
+    # fetch_books_page, served from the catalog snapshot when it is enabled
+    if sort == 'id' and app.config['CATALOG_SNAPSHOT']:
+        if before:
+            return get_catalog().page(before=after, limit=limit)
+        return get_catalog().page(after=after, limit=limit)
+    with mysql.cursor() as cursor:
+        return fetch_books_page(cursor, sort, after, key, before, limit)
+
+
+def iter_books(sort='id', chunk=BOOKS_STREAM_CHUNK):
+    # Walks the whole catalog one keyset chunk at a time so that only
+    # `chunk` rows are held in memory while the response is streamed.
+    after = key = None
+    while True:
+        rows = books_page(sort, after, key, limit=chunk)
+        yield from rows
+        if len(rows) < chunk:
+            break
+        after, key = rows[-1]['id'], rows[-1][sort]
+
+
 # Books
 @app.route('/books')
+@conditional('books')
 def books():
-    with mysql.connection.cursor() as cursor:
-        cursor.execute("SELECT id,title,author,total_quantity,available_quantity FROM books")
-        books = cursor.fetchall()
-    
-    if books:
-        return render_template('books.html', books=books)
+    sort = request.args.get('sort', 'id')
+    if sort not in BOOK_SORT_KEYS:
+        sort = 'id'
+
+    # Streaming mode renders the full catalog in chunks
+    if request.args.get('stream'):
+        return app.response_class(stream_template('books.html', books=iter_books(sort), sort=sort))
+
+    per_page = request.args.get('per_page', BOOKS_PER_PAGE, type=int)
+    per_page = max(1, min(per_page, BOOKS_MAX_PER_PAGE))
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    key = request.args.get('key')
+
+    def render_rows():
+        # One extra row tells us whether there is another page
+        if before is not None:
+            books = books_page(sort, before, key, before=True, limit=per_page + 1)
+            has_prev = len(books) > per_page
+            books = books[-per_page:]
+            has_next = True
+        else:
+            books = books_page(sort, after, key, limit=per_page + 1)
+            has_next = len(books) > per_page
+            books = books[:per_page]
+            has_prev = after is not None
+
+        if not books:
+            return None, None
+        first, last = books[0], books[-1]
+        pagination = {
+            'sort': sort,
+            'per_page': per_page,
+            'prev': {'before': first['id'], 'key': first[sort]} if has_prev else None,
+            'next': {'after': last['id'], 'key': last[sort]} if has_next else None,
+        }
+        return render_template('books_rows.html', books=books), pagination
+
+    rows, pagination = cached_fragment(f"books:{sort}:{after}:{before}:{key}:{per_page}", ('books',), render_rows)
+    if rows:
+        return render_template('books.html', rows=Markup(rows), sort=sort, pagination=pagination)
     else:
         return render_template('books.html', warning='No Books Found')
-    cur.close()
 
 # Define Add-Book-Form
 class AddBook(Form):
     id = StringField(
-        'Book ID', [validators.Length(min=1, max=11)])
+        'Book ID', [validators.Length(min=1, max=11),
+                    validators.Regexp(r'^\d+$', message='Book ID must be a number')])
     title = StringField(
         'Title', [validators.Length(min=2, max=255)])
     author = StringField(
@@ -80,33 +508,36 @@ class AddBook(Form):
 def book_add():
     form = AddBook(request.form)
     if request.method == 'POST' and form.validate():
-        cur = mysql.connection.cursor()
-
-        result = cur.execute(
-            "SELECT id FROM books WHERE id=%s", [form.id.data])
-        book = cur.fetchone()
-        if(book):
-            error = 'Book with that ID already exists'
-            return render_template('book_add.html', form=form, error=error)
-        cur.execute("INSERT INTO books (id,title,author,average_rating,isbn,isbn13,language_code,num_pages,ratings_count,text_reviews_count,publication_date,publisher,total_quantity,available_quantity) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", [
-            form.id.data,
-            form.title.data,
-            form.author.data,
-            form.average_rating.data,
-            form.isbn.data,
-            form.isbn13.data,
-            form.language_code.data,
-            form.num_pages.data,
-            form.ratings_count.data,
-            form.text_reviews_count.data,
-            form.publication_date.data,
-            form.publisher.data,
-            form.total_quantity.data,
-            form.total_quantity.data
-        ])
-
-        mysql.connection.commit()
-        cur.close()
+        with mysql.cursor() as cursor:
+            result = cursor.execute(
+                "SELECT id FROM books WHERE id=%s", [form.id.data])
+            book = cursor.fetchone()
+            if(book):
+                error = 'Book with that ID already exists'
+                return render_template('book_add.html', form=form, error=error)
+            cursor.execute("INSERT INTO books (id,title,author,average_rating,isbn,isbn13,language_code,num_pages,ratings_count,text_reviews_count,publication_date,publisher,total_quantity,available_quantity) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", [
+                form.id.data,
+                form.title.data,
+                form.author.data,
+                form.average_rating.data,
+                form.isbn.data,
+                form.isbn13.data,
+                form.language_code.data,
+                form.num_pages.data,
+                form.ratings_count.data,
+                form.text_reviews_count.data,
+                form.publication_date.data,
+                form.publisher.data,
+                form.total_quantity.data,
+                form.total_quantity.data
+            ])
+
+            mysql.connection.commit()
+
+        search_index.add(form.data)
+        clear_lookups('books')
+        refresh_catalog(form.id.data)
+        changed('books')
 
         flash("New Book Added", "success")
 
@@ -129,93 +560,170 @@ class ImportBooks(Form):
     
 
 
+def import_progress(job):
+    def progress(result):
+        job.update(imported=result.imported,
+                   duplicate=result.duplicates,
+                   failed=result.failed,
+                   pages=result.pages_fetched)
+    return progress
+
+
+def run_import_job(job, no_of_books, title, author):
+    # Runs on a job worker thread, outside of any request
+    with app.app_context():
+        importer = BookImporter(mysql.connection, base_url=app.config['IMPORT_BASE_URL'],
+                                workers=app.config['IMPORT_WORKERS'], client_options=import_client_options)
+        result = importer.run(no_of_books, title, author, quantity=no_of_books, progress=import_progress(job))
+    return finish_import(result, no_of_books)
+
+
+def finish_import(result, no_of_books):
+    for book in result.imported_books:
+        search_index.add(book)
+    if result.raced:
+        search_index.expire()
+    clear_lookups('books')
+    catalog.invalidate()
+    changed('books')
+
+    msg = f"{result.imported}/{no_of_books} books have been imported."
+    if result.error:
+        msg += f" The import stopped early: {result.error}."
+    elif result.imported != no_of_books:
+        if result.duplicates:
+            msg += f" {result.duplicates} books were found with already existing IDs."
+        elif not result.rejected:
+            msg += f" {no_of_books - result.imported} matching books were not found."
+    if result.rejected:
+        first = result.rejected[0]
+        msg += f" {result.failed} records were rejected (first: book {first['id']}: {first['errors']})."
+        log.warning('import_records_rejected', extra={'fields': {'rejected': result.failed,
+                                                                 'records': result.rejected}})
+    return msg
+
+
+# The job book_import submits; asgi.py swaps in its asyncio importer
+import_runner = run_import_job
+
+
 # Import Books 
+# The import runs as a background job; the request returns immediately and
+# the job page polls its progress.
 @app.route('/book_import', methods=['GET', 'POST'])
 def book_import():
     form = ImportBooks(request.form)
 
     if request.method == 'POST' and form.validate():
-        cur = mysql.connection.cursor()
+        job = jobs.submit('import', import_runner,
+                          form.no_of_books.data, form.title.data, form.author.data,
+                          description=f"Import {form.no_of_books.data} books",
+                          counters={'requested': form.no_of_books.data,
+                                    'imported': 0, 'duplicate': 0, 'failed': 0, 'pages': 0})
 
-        no_of_books_imported = 0
-        repeated_book_ids = []
+        flash("Import started", "success")
 
-        # Defining base URL 
-        base_url = 'https://frappe.io/api/method/frappe-library?'
+        return redirect(url_for('job_details', job_id=job.id))
 
-        # parameters for the API request
-        parameters = {
-            'page': 1,
-            'title': form.title.data,
-            'author': form.author.data,
-        }
+    return render_template('book_import.html', form=form)
 
-        while no_of_books_imported < form.no_of_books.data:
-            r = requests.get(base_url + urllib.parse.urlencode(parameters))
-            res = r.json()
-
-            # Break if message is empty
-            if not res.get('message'):
-                break
-
-            for book in res['message']:
-                result = cur.execute("SELECT id FROM books WHERE id=%s", [book['bookID']])
-                book_found = cur.fetchone()
-                if not book_found:
-                    num_pages = book.get('num_pages')
-                    publication_date_str = book.get('publication_date', '')  # Assuming it's a string
-
-                    try:
-                        if publication_date_str:
-                            date_obj = datetime.strptime(publication_date_str, '%m/%d/%Y')
-                            formatted_date = date_obj.strftime('%Y-%m-%d')
-                        else:
-                            formatted_date = None  
-                        
-                        # SQL Query 
-                        cur.execute("INSERT INTO books (id, title, author, average_rating, isbn, isbn13, language_code, num_pages, ratings_count, text_reviews_count, publication_date, publisher, total_quantity, available_quantity) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", [
-                            book['bookID'],
-                            book['title'],
-                            book['authors'],
-                            book['average_rating'],
-                            book['isbn'],
-                            book['isbn13'],
-                            book['language_code'],
-                            num_pages,
-                            book['ratings_count'],
-                            book['text_reviews_count'],
-                            formatted_date,  
-                            book['publisher'],
-                            form.no_of_books.data,
-                            form.no_of_books.data
-                        ])
-                        no_of_books_imported += 1
-                        if no_of_books_imported == form.no_of_books.data:
-                            break
-                    except ValueError:
-                        formatted_date = None
-                else:
-                    repeated_book_ids.append(book['bookID'])
-
-            parameters['page'] += 1 
-
-        mysql.connection.commit()
-        cur.close()
 
-        # Flash Message
-        msg = f"{no_of_books_imported}/{form.no_of_books.data} books have been imported."
-        msgType = 'success'
-        if no_of_books_imported != form.no_of_books.data:
-            msgType = 'warning'
-            if repeated_book_ids:
-                msg += f" {len(repeated_book_ids)} books were found with already existing IDs."
-            else:
-                msg += f" {form.no_of_books.data - no_of_books_imported} matching books were not found."
-        flash(msg, msgType)
+# Background Jobs
+@app.route('/jobs/<string:job_id>')
+def job_details(job_id):
+    job = jobs.status(job_id)
+    if job is None:
+        return render_template('job.html', warning='This Job Does Not Exist')
+    return render_template('job.html', job=job)
 
-        return redirect(url_for('books'))
 
-    return render_template('book_import.html', form=form)
+@app.route('/api/jobs/<string:job_id>')
+def api_job(job_id):
+    job = jobs.status(job_id)
+    if job is None:
+        return jsonify(error='Job not found'), 404
+    return jsonify(job)
+
+def run_load_job(job, path):
+    # Runs on a job worker thread; removes the uploaded file when done
+    def progress(result):
+        job.update(read=result.read, loaded=result.loaded, rejected=result.rejected)
+
+    def loaded(books):
+        for book in books:
+            search_index.add(book)
+
+    try:
+        with app.app_context():
+            result = BulkLoader(mysql.connection, AddBook).run(read_records(path), progress=progress, loaded=loaded)
+    finally:
+        os.remove(path)
+
+    clear_lookups('books')
+    catalog.invalidate()
+    changed('books')
+
+    msg = f"{result.loaded}/{result.read} books have been loaded."
+    if result.errors:
+        first = result.errors[0]
+        msg += f" {result.rejected} rows were rejected (first: row {first['row']}: {first['errors']})."
+    return msg
+
+
+# Load Books From File
+# Uploads a CSV/NDJSON/JSON catalog file and loads it as a background job.
+# For very large files use `flask load-books FILE` instead.
+@app.route('/book_load', methods=['GET', 'POST'])
+def book_load():
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        extension = os.path.splitext(upload.filename)[1].lower() if upload else ''
+        if extension not in ('.csv', '.json', '.jsonl', '.ndjson'):
+            error = 'Please choose a .csv, .json or .ndjson file'
+            return render_template('book_load.html', error=error)
+
+        fd, path = tempfile.mkstemp(suffix=extension)
+        with os.fdopen(fd, 'wb') as f:
+            upload.save(f)
+
+        job = jobs.submit('load', run_load_job, path, description=f"Load books from {upload.filename}",
+                          counters={'read': 0, 'loaded': 0, 'rejected': 0})
+        flash("Load started", "success")
+        return redirect(url_for('job_details', job_id=job.id))
+
+    return render_template('book_load.html')
+
+
+@app.cli.command('load-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', type=int, default=1000, show_default=True)
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False), help='Write rejected rows to this CSV file.')
+@click.option('--dry-run', is_flag=True, help='Validate only, do not insert.')
+def load_books_command(path, batch_size, errors_path, dry_run):
+    """Load books from a CSV, NDJSON or JSON file.
+
+    Bumps the books version, so running web processes reload their search
+    index and catalog snapshot: on their next read with a shared [cache]
+    redis_url, otherwise within [search] / [catalog] max_age.
+    """
+    start = time.monotonic()
+    loader = BulkLoader(mysql.connection, AddBook, batch_size=batch_size, dry_run=dry_run)
+    error_file = ErrorFile(errors_path) if errors_path else None
+    try:
+        result = loader.run(read_records(path), errors=error_file)
+    finally:
+        if error_file:
+            error_file.close()
+    elapsed = time.monotonic() - start
+    if not dry_run:
+        changed('books')
+
+    verb = 'validated' if dry_run else 'loaded'
+    print(f"{result.loaded}/{result.read} books {verb} in {elapsed:.1f}s "
+          f"({result.read / max(elapsed, 1e-9) * 60:.0f} rows/min), {result.rejected} rejected")
+    if result.rejected and errors_path:
+        print(f"Rejected rows written to {errors_path}")
+
 
 # Define Search-Form
 class SearchBook(Form):
@@ -223,52 +731,92 @@ class SearchBook(Form):
     author = StringField('Author', [validators.Length(min=1, max=255)])
 
 
+SEARCH_RESULTS_PER_PAGE = 50
+SEARCH_API_MAX_PER_PAGE = 100
+
+
+def books_by_ids_query(ids, columns='*'):
+    placeholders = ", ".join(["%s"] * len(ids))
+    return f"SELECT {columns} FROM books WHERE id IN ({placeholders})", list(ids)
+
+
+def in_id_order(ids, books):
+    books_by_id = {book['id']: book for book in books}
+    return [books_by_id[book_id] for book_id in ids if book_id in books_by_id]
+
+
+def fetch_books_by_ids(cursor, ids, columns='*'):
+    # Fetches the given books keeping the order of `ids`
+    if not ids:
+        return []
+    cursor.execute(*books_by_ids_query(ids, columns))
+    return in_id_order(ids, cursor.fetchall())
+
+
 # Search
 @app.route('/book_search', methods=['GET', 'POST'])
 def book_search():
     form = SearchBook(request.form)
 
     if request.method == 'POST' and form.validate():
-        cur = mysql.connection.cursor()
-        title = '%'+form.title.data+'%'
-        author = '%'+form.author.data+'%'
-        result = cur.execute(
-            "SELECT * FROM books WHERE title LIKE %s OR author LIKE %s", [title, author])
-        books = cur.fetchall()
-        cur.close()
+        total, ranked = get_search_index().search_any([
+            (form.title.data, ('title',)),
+            (form.author.data, ('author',)),
+        ], limit=SEARCH_RESULTS_PER_PAGE)
+
+        with mysql.cursor() as cursor:
+            books = fetch_books_by_ids(cursor, [book_id for book_id, _ in ranked])
 
         # Flash Message
-        if result <= 0:
+        if not books:
             msg = 'No Results Found'
             return render_template('book_search.html', form=form, warning=msg)
 
-        flash("Results Found", "success")
+        flash(f"{total} Results Found", "success")
         
         return render_template('book_search.html', form=form, books=books)
 
     return render_template('book_search.html', form=form)
+
+
+# Search API
+# /api/books/search?q=<query>[&field=title&field=author][&page=1&per_page=20]
+@app.route('/api/books/search')
+def api_book_search():
+    query = request.args.get('q', '')
+    fields = [field for field in request.args.getlist('field') if field in SEARCH_FIELDS] or None
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = request.args.get('per_page', 20, type=int)
+    per_page = max(1, min(per_page, SEARCH_API_MAX_PER_PAGE))
+
+    total, ranked = get_search_index().search(
+        query, fields, offset=(page - 1) * per_page, limit=per_page)
+    scores = dict(ranked)
+
+    with mysql.cursor() as cursor:
+        books = fetch_books_by_ids(cursor, list(scores), BOOK_COLUMNS)
+
+    return jsonify(query=query, page=page, per_page=per_page, total=total,
+                   results=[dict(book, score=round(scores[book['id']], 4)) for book in books])
         
 
 # Book deatils
 @app.route('/book/<string:id>')
+@conditional('books')
 def viewbook(id):
-    with mysql.connection.cursor() as cursor:
-        cursor.execute("SELECT * FROM books WHERE id=%s", [id])
-        book = cursor.fetchone()
+    book = get_record('books', id)
 
     if book:
         return render_template('book_details.html', book=book)
     else:
         return render_template('book_details.html', warning='This Book Does Not Exist')
 
-    cur.close()
-
 # Edit Book Route
 @app.route('/book_edit/<string:id>', methods=['GET', 'POST'])
 def edit_book(id):
     form = AddBook(request.form)
 
-    with mysql.connection.cursor() as cursor:
+    with mysql.cursor() as cursor:
         result = cursor.execute("SELECT * FROM books WHERE id=%s", [id])
         book = cursor.fetchone()
 
@@ -305,6 +853,13 @@ def edit_book(id):
 
             mysql.connection.commit()
 
+            search_index.remove(id)
+            search_index.add(form.data)
+            clear_lookups('books')
+            invalidate_record('books', id, form.id.data)
+            refresh_catalog(id, form.id.data)
+            changed('books')
+
             flash("Book Updated", "success")
 
             return redirect(url_for('books'))
@@ -316,14 +871,21 @@ def edit_book(id):
 @app.route('/delete_book/<string:id>', methods=['POST'])
 def delete_book(id):
     try:
-        with mysql.connection.cursor() as cur:
+        with mysql.cursor() as cur:
             cur.execute("DELETE FROM books WHERE id=%s", [id])
 
             mysql.connection.commit()
 
+        search_index.remove(id)
+        clear_lookups('books')
+        invalidate_record('books', id)
+        if id.isdigit():
+            catalog.remove(id)
+        changed('books')
+
         flash("Book Deleted", "success")
     except (MySQLdb.Error, MySQLdb.Warning) as e:
-        print(e)
+        log.exception('db_error')
 
         flash("Book could not be deleted", "danger")
         flash(str(e), "danger")
@@ -335,20 +897,24 @@ def delete_book(id):
 
 # Members Route
 @app.route('/members')
+@conditional('members')
 def members():
-    try:
-        with mysql.connection.cursor() as cursor:
-            result = cursor.execute("SELECT * FROM members")
+    def render_rows():
+        with mysql.cursor() as cursor:
+            cursor.execute("SELECT * FROM members")
             members = cursor.fetchall()
+        return render_template('members_rows.html', members=members) if members else ''
 
-            if result > 0:
-                return render_template('members.html', members=members)
-            else:
-                return render_template('members.html', warning='No Members Found')
+    try:
+        rows = cached_fragment('members', ('members',), render_rows)
+        if rows:
+            return render_template('members.html', rows=Markup(rows))
+        else:
+            return render_template('members.html', warning='No Members Found')
     except (MySQLdb.Error, MySQLdb.Warning) as e:
         
         # Handle database errors
-        print(e)
+        log.exception('db_error')
         flash("Error: Could not fetch members", "danger")
 
     return redirect(url_for('members'))
@@ -358,29 +924,35 @@ def members():
 @app.route('/member_details/<string:id>')
 def member_details(id):
     try:
-        with mysql.connection.cursor() as cursor:
+        member = get_record('members', id)
 
-            result = cursor.execute("SELECT * FROM members WHERE id=%s", [id])
-            member = cursor.fetchone()
-
-            
-            if result > 0:
-                return render_template('member_details.html', member=member)
-            else:
-                msg = 'This Member Does Not Exist'
-                return render_template('member_details.html', warning=msg)
+        if member:
+            stats, top_books = member_stats(mysql.connection, member['id'])
+            holds = active_holds(mysql.connection, member_id=member['id'])
+            return render_template('member_details.html', member=member, stats=stats, top_books=top_books,
+                                   holds=holds)
+        else:
+            msg = 'This Member Does Not Exist'
+            return render_template('member_details.html', warning=msg)
     except (MySQLdb.Error, MySQLdb.Warning) as e:
         
-        print(e)
+        log.exception('db_error')
         flash("Error: Could not fetch member details", "danger")
 
     return redirect(url_for('members')) 
 
 
+# Shared by adding and editing a member
+def member_email(form, field):
+    error = email_checker.check(field.data)
+    if error:
+        raise validators.ValidationError(error)
+
+
 # Define Add-Member-Form
 class AddMember(Form):
     name = StringField('Name', [validators.Length(min=1, max=50)])
-    email = StringField('Email', [validators.length(min=6, max=50)])
+    email = StringField('Email', [validators.length(min=6, max=50), member_email])
     ph_no= StringField('Phone Number',[validators.Length(min=10 ,max=10)] )
 
 # Add Member Route
@@ -394,17 +966,16 @@ def member_add():
             email = form.email.data
             ph_no = form.ph_no.data
 
-            if not validate_email(email):
-                flash("Invalid email address", "danger")
-                return render_template('member_add.html', form=form)
-
-            with mysql.connection.cursor() as cursor:
+            with mysql.cursor() as cursor:
                 # SQL Query
                 cursor.execute(
                     "INSERT INTO members (name, email, ph_no) VALUES (%s, %s, %s)", (name, email, ph_no))
 
                 mysql.connection.commit()
 
+            clear_lookups('members')
+            changed('members')
+
             flash("New Member Added", "success")
 
             return redirect(url_for('members'))
@@ -412,7 +983,7 @@ def member_add():
         return render_template('member_add.html', form=form)
 
     except (MySQLdb.Error, MySQLdb.Warning) as e:
-        print(e)
+        log.exception('db_error')
         flash("Error: Could not add member", "danger")
 
     return redirect(url_for('members'))
@@ -421,8 +992,6 @@ def member_add():
 @app.route('/member_edit/<string:id>', methods=['GET', 'POST'])
 def member_edit(id):
     try:
-        cur = mysql.connection.cursor()
-
         if request.method == 'POST':
             form = AddMember(request.form)
 
@@ -432,12 +1001,15 @@ def member_edit(id):
                 ph_no = form.ph_no.data
 
                 # SQL Query 
-                cur.execute(
-                    "UPDATE members SET name=%s, email=%s, ph_no=%s WHERE id=%s", (name, email, ph_no, id))
+                with mysql.cursor() as cursor:
+                    cursor.execute(
+                        "UPDATE members SET name=%s, email=%s, ph_no=%s WHERE id=%s", (name, email, ph_no, id))
 
-                
-                mysql.connection.commit()
-                cur.close()
+                    mysql.connection.commit()
+
+                clear_lookups('members')
+                invalidate_record('members', id)
+                changed('members')
 
                 flash("Member Updated", "success")
 
@@ -446,14 +1018,17 @@ def member_edit(id):
                 flash("Form validation failed. Please check your inputs.", "danger")
 
         #  SQL Query 
-        cur.execute("SELECT name, email, ph_no FROM members WHERE id=%s", [id])
-        member = cur.fetchone()
+        with mysql.cursor() as cursor:
+            cursor.execute("SELECT name, email, ph_no FROM members WHERE id=%s", [id])
+            member = cursor.fetchone()
 
         if member:
-            form = AddMember(request.form)
-            form.name.data = member['name']
-            form.email.data = member['email']
-            form.ph_no.data = member['ph_no']
+            # A rejected edit is shown again with its errors
+            if request.method != 'POST':
+                form = AddMember(request.form)
+                form.name.data = member['name']
+                form.email.data = member['email']
+                form.ph_no.data = member['ph_no']
         else:
             flash("Member not found", "danger")
             return redirect(url_for('members'))
@@ -461,7 +1036,7 @@ def member_edit(id):
         return render_template('member_edit.html', form=form, member=member)
 
     except (MySQLdb.Error, MySQLdb.Warning) as e:
-        print(e)
+        log.exception('db_error')
         flash("Error: Could not edit member", "danger")
 
     return redirect(url_for('members'))
@@ -470,15 +1045,19 @@ def member_edit(id):
 @app.route('/delete_member/<string:id>', methods=['POST'])
 def delete_member(id):
     try:
-        with mysql.connection.cursor() as cursor:
+        with mysql.cursor() as cursor:
             cursor.execute("DELETE FROM members WHERE id=%s", [id])
 
             mysql.connection.commit()
 
+        clear_lookups('members')
+        invalidate_record('members', id)
+        changed('members')
+
         flash("Member Deleted", "success")
 
     except (MySQLdb.Error, MySQLdb.Warning) as e:
-        print(e)
+        log.exception('db_error')
         flash("Error: Member could not be deleted", "danger")
         flash(str(e), "danger")
         return redirect(url_for('members'))
@@ -486,39 +1065,215 @@ def delete_member(id):
     return redirect(url_for('members'))
 
 
+# Define Transactions-Filter-Form
+class TransactionFilter(Form):
+    status = SelectField('Status', choices=[('', 'All'), ('open', 'Open loans'), ('returned', 'Returned')],
+                         default='')
+    member_id = IntegerField('Member ID', [validators.Optional()])
+    book_id = IntegerField('Book ID', [validators.Optional()])
+    borrowed_from = DateField('Borrowed From', [validators.Optional()])
+    borrowed_to = DateField('Borrowed To', [validators.Optional()])
+    history = BooleanField('Include archived')
+
+
+# Transactions listing
+# Newest first, keyset-paginated on id. Each filter is backed by one of the
+# transactions indexes (migrations/0003) so a page never scans the
+# history. Returned loans older than [archive] after_days live in
+# transactions_archive (archive.py); with the history filter a page is the
+# newest rows of both tables, each read with the same filters and limit.
+TRANSACTIONS_PER_PAGE = 50
+
+
+def fetch_transactions_page(cursor, filters, after=None, before=None, limit=TRANSACTIONS_PER_PAGE):
+    where = []
+    params = []
+    if filters.get('status') == 'open':
+        where.append("returned_on IS NULL")
+    elif filters.get('status') == 'returned':
+        where.append("returned_on IS NOT NULL")
+    if filters.get('member_id') is not None:
+        where.append("member_id = %s")
+        params.append(filters['member_id'])
+    if filters.get('book_id') is not None:
+        where.append("book_id = %s")
+        params.append(filters['book_id'])
+    if filters.get('borrowed_from'):
+        where.append("borrowed_on >= %s")
+        params.append(filters['borrowed_from'])
+    if filters.get('borrowed_to'):
+        where.append("borrowed_on < %s + INTERVAL 1 DAY")
+        params.append(filters['borrowed_to'])
+
+    order = 'DESC'
+    if before is not None:
+        where.append("id > %s")
+        params.append(before)
+        order = 'ASC'
+    elif after is not None:
+        where.append("id < %s")
+        params.append(after)
+
+    tables = ['transactions']
+    if filters.get('history') and filters.get('status') != 'open':
+        tables.append('transactions_archive')
+
+    selects = []
+    args = []
+    for table in tables:
+        sql = f"SELECT {TRANSACTION_COLUMNS} FROM {table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        selects.append(sql + f" ORDER BY id {order} LIMIT %s")
+        args += params + [limit]
+    if len(selects) == 1:
+        cursor.execute(selects[0], args)
+    else:
+        sql = " UNION ALL ".join(f"SELECT * FROM ({select}) AS {table}" for select, table in zip(selects, tables))
+        cursor.execute(sql + f" ORDER BY id {order} LIMIT %s", args + [limit])
+    rows = list(cursor.fetchall())
+    if before is not None:
+        rows.reverse()
+    return rows
+
+
 # Transactions 
 @app.route('/transactions')
+@conditional('transactions')
 def transactions():
-    try:
-        cur = mysql.connection.cursor()
-
-        # SQL Query
-        result = cur.execute("SELECT * FROM transactions")
-        transactions = cur.fetchall()
-
-        cur.close()
-
-        for transaction in transactions:
-            for key, value in transaction.items():
-                if value is None:
-                    transaction[key] = "-"
+    form = TransactionFilter(request.args)
+    filters = {}
+    if form.validate():
+        filters = {key: value for key, value in form.data.items() if value not in (None, '', False)}
+
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+
+    def render_rows():
+        with mysql.cursor() as cursor:
+            # One extra row tells us whether there is another page
+            transactions = fetch_transactions_page(cursor, filters, after, before,
+                                                   limit=TRANSACTIONS_PER_PAGE + 1)
+        if before is not None:
+            has_prev = len(transactions) > TRANSACTIONS_PER_PAGE
+            transactions = transactions[-TRANSACTIONS_PER_PAGE:]
+            has_next = True
+        else:
+            has_next = len(transactions) > TRANSACTIONS_PER_PAGE
+            transactions = transactions[:TRANSACTIONS_PER_PAGE]
+            has_prev = after is not None
+
+        if not transactions:
+            return None, None
+        args = {key: str(value) for key, value in filters.items()}
+        pagination = {
+            'prev': dict(args, before=transactions[0]['id']) if has_prev else None,
+            'next': dict(args, after=transactions[-1]['id']) if has_next else None,
+        }
+        return render_template('transactions_rows.html', transactions=transactions), pagination
 
-        if result > 0:
-            return render_template('transactions.html', transactions=transactions)
+    try:
+        filter_key = ':'.join(f"{key}={value}" for key, value in sorted(filters.items()))
+        rows, pagination = cached_fragment(f"transactions:{filter_key}:{after}:{before}", ('transactions',),
+                                           render_rows)
+        if rows:
+            return render_template('transactions.html', form=form, rows=Markup(rows), pagination=pagination)
         else:
             msg = 'No Transactions Found'
-            return render_template('transactions.html', warning=msg)
+            return render_template('transactions.html', form=form, warning=msg)
     except (MySQLdb.Error, MySQLdb.Warning) as e:
-        print(e)
+        log.exception('db_error')
         flash("Error: Could not fetch transactions", "danger")
 
     return redirect(url_for('transactions'))
 
 
+# Shows empty database values as "-"
+@app.template_filter('dash')
+def dash(value):
+    return '-' if value is None else value
+
+
+# Lookup API
+# Prefix search used by the issue form to pick a book or a member without
+# loading either table. Title/name prefixes use the idx_books_title_id and
+# idx_members_name_id indexes, a numeric query is also tried as an id.
+LOOKUP_LIMIT = 10
+
+
+def like_prefix(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def lookup_queries(table, label, q):
+    # (query, args) pairs whose rows, deduplicated, are the lookup results
+    queries = []
+    if q.isdigit():
+        queries.append((f"SELECT id, {label} AS label FROM {table} WHERE id=%s", [q]))
+    if q:
+        queries.append((
+            f"SELECT id, {label} AS label FROM {table} WHERE {label} LIKE %s ORDER BY {label}, id LIMIT %s",
+            [like_prefix(q), LOOKUP_LIMIT]))
+    return queries
+
+
+def lookup(table, label, q):
+    q = q.strip()
+    cache_key = f"{table_versions.get(f'{table}-lookup')}:{q.lower()}"
+    results = lookup_caches[table].get(cache_key)
+    if results is not None:
+        return results
+
+    results = []
+    with mysql.cursor() as cursor:
+        for query, args in lookup_queries(table, label, q):
+            cursor.execute(query, args)
+            results.extend(row for row in cursor.fetchall() if row not in results)
+
+    results = results[:LOOKUP_LIMIT]
+    lookup_caches[table].set(cache_key, results)
+    return results
+
+
+@app.route('/api/books/lookup')
+def api_book_lookup():
+    return jsonify(results=lookup('books', 'title', request.args.get('q', '')))
+
+
+@app.route('/api/members/lookup')
+def api_member_lookup():
+    return jsonify(results=lookup('members', 'name', request.args.get('q', '')))
+
+
+# Copies of a book on the shelf, for the issue form. Served from the catalog
+# snapshot when it is enabled, so it may trail other processes' loans by up
+# to [catalog] max_age; issuing still checks availability in its transaction.
+@app.route('/api/books/<int:book_id>/availability')
+def api_book_availability(book_id):
+    if app.config['CATALOG_SNAPSHOT']:
+        availability = get_catalog().availability(book_id)
+        source = 'snapshot'
+    else:
+        with mysql.cursor() as cursor:
+            cursor.execute("SELECT total_quantity, available_quantity FROM books WHERE id=%s", [book_id])
+            book = cursor.fetchone()
+        availability = (book['total_quantity'], book['available_quantity']) if book else None
+        source = 'database'
+    if availability is None:
+        return jsonify(error='Book not found'), 404
+    total, available = availability
+    return jsonify(id=book_id, total_quantity=total, available_quantity=available, source=source)
+
+
+@app.route('/api/catalog/stats')
+def api_catalog_stats():
+    return jsonify(dict(catalog.stats(), enabled=app.config['CATALOG_SNAPSHOT']))
+
+
 # Define Issue-Book-Form
 class IssueBook(Form):
-    book_id = SelectField('Book ID', choices=[])
-    member_id = SelectField('Member ID', choices=[])
+    book_id = IntegerField('Book ID', [validators.InputRequired()])
+    member_id = IntegerField('Member ID', [validators.InputRequired()])
     per_day_fee = FloatField('Per Day Renting Fee', [
                              validators.NumberRange(min=1)])
 
@@ -527,63 +1282,103 @@ class IssueBook(Form):
 # Issue Book Route
 @app.route('/book_issue', methods=['GET', 'POST'])
 def book_issue():
+    form = IssueBook(request.form)
     try:
-        form = IssueBook(request.form)
-        cur = mysql.connection.cursor()
+        if request.method == 'POST' and form.validate():
+            issue_book(mysql.connection, form.book_id.data, form.member_id.data, form.per_day_fee.data)
+            invalidate_record('books', form.book_id.data)
+            refresh_catalog(form.book_id.data)
+            changed('books', 'transactions')
 
-        book_ids_list = []
-        member_ids_list = []
+            flash("Book Issued", "success")
 
-        cur.execute("SELECT id, title FROM books")
-        books = cur.fetchall()
-        for book in books:
-            t = (book['id'], book['title'])
-            book_ids_list.append(t)
+            return redirect(url_for('transactions'))
 
-        cur.execute("SELECT id, name FROM members")
-        members = cur.fetchall()
-        for member in members:
-            t = (member['id'], member['name'])
-            member_ids_list.append(t)
+    except BookUnavailable as e:
+        # Offer a hold instead
+        return render_template('book_issue.html', form=form, error=str(e), hold=True)
 
-        form.book_id.choices = book_ids_list
-        form.member_id.choices = member_ids_list
+    except CirculationError as e:
+        return render_template('book_issue.html', form=form, error=str(e))
 
-        if request.method == 'POST' and form.validate():
+    except (MySQLdb.Error, MySQLdb.Warning) as e:
+        log.exception('db_error')
+        flash("Error: Could not issue the book", "danger")
 
-            cur.execute("SELECT available_quantity FROM books WHERE id=%s", [
-                form.book_id.data])
-            result = cur.fetchone()
-            available_quantity = result['available_quantity']
+    return render_template('book_issue.html', form=form)
 
-            if available_quantity < 1:
-                error = 'No copies of this book are available to be rented'
-                return render_template('book_issue.html', form=form, error=error)
 
-            # SQL Query 
-            cur.execute("INSERT INTO transactions (book_id, member_id, per_day_fee) VALUES (%s, %s, %s)", [
-                form.book_id.data,
-                form.member_id.data,
-                form.per_day_fee.data,
-            ])
+# Holds
+# A copy returned while a book has holds is set aside for the oldest one
+# (see circulation.py); the holds page lists those copies and the queue.
+HOLDS_PER_PAGE = 200
 
-            cur.execute(
-                "UPDATE books SET available_quantity=available_quantity-1 WHERE id=%s", [form.book_id.data])
 
-            mysql.connection.commit()
+def flash_hold_ready(hold, book_id):
+    log.info('hold_ready', extra={'fields': {'hold_id': hold['id'], 'member_id': hold['member_id'],
+                                             'book_id': book_id}})
+    flash(f"Set the copy aside for hold {hold['id']} (member {hold['member_id']})", "info")
 
-            flash("Book Issued", "success")
 
-            return redirect(url_for('transactions'))
+class PlaceHold(Form):
+    book_id = IntegerField('Book ID', [validators.InputRequired()])
+    member_id = IntegerField('Member ID', [validators.InputRequired()])
 
+
+@app.route('/holds')
+def holds():
+    try:
+        holds = active_holds(mysql.connection, limit=HOLDS_PER_PAGE)
     except (MySQLdb.Error, MySQLdb.Warning) as e:
-        print(e)
-        flash("Error: Could not issue the book", "danger")
+        log.exception('db_error')
+        flash("Error: Could not fetch holds", "danger")
+        return redirect(url_for('index'))
+    return render_template('holds.html', holds=holds, pickup_days=app.config['HOLD_PICKUP_DAYS'])
+
+
+@app.route('/hold_add', methods=['POST'])
+def hold_add():
+    form = PlaceHold(request.form)
+    if not form.validate():
+        flash("Form validation failed. Please check your inputs.", "danger")
+        return redirect(url_for('book_issue'))
+    try:
+        hold_id, position = place_hold(mysql.connection, form.book_id.data, form.member_id.data)
+        flash(f"Hold placed, number {position} in the queue", "success")
+        return redirect(url_for('holds'))
+    except CirculationError as e:
+        flash(str(e), "danger")
+    except (MySQLdb.Error, MySQLdb.Warning) as e:
+        log.exception('db_error')
+        flash("Error: Could not place the hold", "danger")
+    return redirect(url_for('book_issue'))
 
-    finally:
-        if 'cur' in locals() or 'cur' in globals():
-            cur.close()
-    return render_template('book_issue.html', form=form)
+
+@app.route('/holds/<int:hold_id>/cancel', methods=['POST'])
+def hold_cancel(hold_id):
+    try:
+        hold = cancel_hold(mysql.connection, hold_id)
+        invalidate_record('books', hold['book_id'])
+        refresh_catalog(hold['book_id'])
+        changed('books')
+        flash("Hold Cancelled", "success")
+        if hold['next_hold']:
+            flash_hold_ready(hold['next_hold'], hold['book_id'])
+    except CirculationError as e:
+        flash(str(e), "danger")
+    except (MySQLdb.Error, MySQLdb.Warning) as e:
+        log.exception('db_error')
+        flash("Error: Could not cancel the hold", "danger")
+    return redirect(url_for('holds'))
+
+
+@app.cli.command('expire-holds')
+def expire_holds_command():
+    """Release copies set aside for holds not picked up in time."""
+    expired = expire_holds(mysql.connection, app.config['HOLD_PICKUP_DAYS'])
+    if expired:
+        changed('books')
+    print(f"{expired} holds expired")
 
 # Define Issue-Book-Form
 class ReturnBook(Form):
@@ -594,54 +1389,36 @@ class ReturnBook(Form):
 @app.route('/book_return/<string:transaction_id>', methods=['GET', 'POST'])
 def book_return(transaction_id):
     try:
-        cur = mysql.connection.cursor()
-        cur.execute("SELECT * FROM transactions WHERE id=%s", [transaction_id])
-        transaction = cur.fetchone()
+        with mysql.cursor() as cursor:
+            cursor.execute("SELECT * FROM transactions WHERE id=%s", [transaction_id])
+            transaction = cursor.fetchone()
+
+        if not transaction:
+            flash("This Transaction Does Not Exist", "danger")
+            return redirect(url_for('transactions'))
+        if transaction['returned_on'] is not None:
+            flash("This book has already been returned", "warning")
+            return redirect(url_for('transactions'))
 
         # Calc Total Charge
-        date = datetime.now()
-        difference = date - transaction['borrowed_on']
-        difference = difference.days
-        total_charge = difference * transaction['per_day_fee']
+        difference, total_charge = loan_charge(transaction)
 
         form = ReturnBook(request.form)
 
         if request.method == 'POST':
             if form.validate():
-                # Calc debt 
-                transaction_debt = total_charge - form.amount_paid.data
-
-                # Check outstanding_debt + transaction_debt exceeds Rs.500
-                cur.execute("SELECT outstanding_debt, amount_spent FROM members WHERE id=%s", [
-                    transaction['member_id']])
-                result = cur.fetchone()
-                outstanding_debt = result['outstanding_debt'] or 0
-                amount_spent = result['amount_spent'] or 0
-
-                if (outstanding_debt + transaction_debt >= 500):
-                    error = 'Outstanding Debt Cannot Exceed Rs.500'
-                    return render_template('book_return.html', form=form, error=error)
-
-                cur.execute("UPDATE transactions SET returned_on=%s, total_charge=%s, amount_paid=%s WHERE id=%s", [
-                    date,
-                    total_charge,
-                    form.amount_paid.data,
-                    transaction_id
-                ])
-
-                cur.execute("UPDATE members SET outstanding_debt=%s, amount_spent=%s WHERE id=%s", [
-                    outstanding_debt + transaction_debt,
-                    amount_spent + form.amount_paid.data,
-                    transaction['member_id']
-                ])
-
-                cur.execute(
-                    "UPDATE books SET available_quantity=available_quantity+1 WHERE id=%s", [transaction['book_id']])
-
-
-                mysql.connection.commit()
+                try:
+                    returned = return_book(mysql.connection, transaction_id, form.amount_paid.data)
+                    invalidate_record('books', transaction['book_id'])
+                    invalidate_record('members', transaction['member_id'])
+                    refresh_catalog(transaction['book_id'])
+                    changed('books', 'members', 'transactions')
+                except CirculationError as e:
+                    return render_template('book_return.html', total_charge=total_charge, difference=difference, transaction=transaction, form=form, error=str(e))
 
                 flash("Book Returned", "success")
+                if returned['hold']:
+                    flash_hold_ready(returned['hold'], transaction['book_id'])
 
                 return redirect(url_for('transactions'))
             else:
@@ -650,15 +1427,250 @@ def book_return(transaction_id):
         return render_template('book_return.html', total_charge=total_charge, difference=difference, transaction=transaction, form=form)
 
     except (MySQLdb.Error, MySQLdb.Warning) as e:
-        print(e)
+        log.exception('db_error')
         flash("Error: Could not return the book", "danger")
 
-    finally:
-        if 'cur' in locals() or 'cur' in globals():
-            cur.close()
+    return redirect(url_for('transactions'))
+
+
+# Accrued Fees
+# Summary of the loan_fees table, rebuilt nightly with `flask compute-fees`
+# or on demand as a background job.
+@app.route('/fees')
+def fees():
+    try:
+        totals, members = fee_summary(mysql.connection)
+    except (MySQLdb.Error, MySQLdb.Warning) as e:
+        log.exception('db_error')
+        flash("Error: Could not fetch fees", "danger")
+        return redirect(url_for('index'))
+    return render_template('fees.html', totals=totals, members=members,
+                           loan_days=app.config['LOAN_DAYS'])
+
+
+def run_fees_job(job):
+    def progress(done, total):
+        job.update(done=done, total=total)
+
+    with app.app_context():
+        loans = compute_fees(mysql.connection, loan_days=app.config['LOAN_DAYS'], progress=progress)
+    return f"Fees computed for {loans} open loans."
+
+
+@app.route('/fees/compute', methods=['POST'])
+def fees_compute():
+    job = jobs.submit('fees', run_fees_job, description="Compute accrued fees",
+                      counters={'done': 0, 'total': 0})
+    flash("Fee computation started", "success")
+    return redirect(url_for('job_details', job_id=job.id))
+
+
+@app.route('/api/fees')
+def api_fees():
+    totals, members = fee_summary(mysql.connection, limit=request.args.get('limit', 100, type=int))
+    return jsonify(totals=totals, members=members)
+
+
+@app.route('/api/fees/<int:member_id>')
+def api_member_fees(member_id):
+    return jsonify(member_id=member_id, loans=member_fees(mysql.connection, member_id))
+
+
+@app.cli.command('compute-fees')
+def compute_fees_command():
+    """Recompute the accrued fees of all open loans."""
+    start = time.monotonic()
+    loans = compute_fees(mysql.connection, loan_days=app.config['LOAN_DAYS'])
+    print(f"Fees computed for {loans} open loans in {time.monotonic() - start:.1f}s")
+
+
+# Export
+# /export/<table>.<format>[?gzip=1] streams a full dump of books, members or
+# transactions as CSV or NDJSON.
+@app.route('/export/<string:table>.<string:fmt>')
+def export(table, fmt):
+    if table not in EXPORT_TABLES or fmt not in EXPORT_FORMATS:
+        return jsonify(error='Unknown export'), 404
+    compress = bool(request.args.get('gzip'))
+
+    headers = {'Content-Disposition': f'attachment; filename="{export_filename(table, fmt, compress)}"'}
+    mimetype = 'application/gzip' if compress else EXPORT_FORMATS[fmt]
+    body = stream_with_context(export_table(mysql.connection, table, fmt, compress))
+    return app.response_class(body, mimetype=mimetype, headers=headers)
+
+
+@app.cli.command('export')
+@click.argument('table', type=click.Choice(EXPORT_TABLES))
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='csv')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='Output file (default: <table>.<format>).')
+def export_command(table, fmt, compress, output):
+    """Stream a full dump of TABLE to a file."""
+    output = output or export_filename(table, fmt, compress)
+    size = 0
+    with open(output, 'wb') as f:
+        for chunk in export_table(mysql.connection, table, fmt, compress):
+            f.write(chunk)
+            size += len(chunk)
+    print(f"Exported {table} to {output} ({size} bytes)")
+
+
+# Cache statistics
+def cache_stats():
+    stats = {'records': record_cache.stats(), 'email_domains': email_checker.domains.stats()}
+    for table, cache in lookup_caches.items():
+        stats[f'lookup_{table}'] = cache.stats()
+    if import_client_options.get('cache'):
+        stats['import_pages'] = import_client_options['cache'].stats()
+    return stats
+
+
+@app.route('/api/cache/stats')
+def api_cache_stats():
+    return jsonify(cache_stats())
+
+
+# Dashboard
+# Library-wide borrowing statistics, read from the rollup tables that
+# issue/return keep up to date (rollups.py).
+@app.route('/dashboard')
+def dashboard():
+    try:
+        totals, months, top_books = library_stats(mysql.connection)
+    except (MySQLdb.Error, MySQLdb.Warning) as e:
+        log.exception('db_error')
+        flash("Error: Could not fetch statistics", "danger")
+        return redirect(url_for('index'))
+    return render_template('dashboard.html', totals=totals, months=months, top_books=top_books)
+
+
+@app.route('/api/dashboard')
+def api_dashboard():
+    totals, months, top_books = library_stats(mysql.connection,
+                                              months=request.args.get('months', 12, type=int),
+                                              top=request.args.get('top', 10, type=int))
+    return jsonify(totals=totals, months=months, top_books=top_books)
+
+
+@app.route('/api/members/<int:member_id>/stats')
+def api_member_stats(member_id):
+    stats, top_books = member_stats(mysql.connection, member_id, top=request.args.get('top', 10, type=int))
+    return jsonify(member_id=member_id, stats=stats, top_books=top_books)
+
+
+@app.cli.command('archive-transactions')
+@click.option('--after-days', type=int, help='Archive loans returned more than this many days ago '
+                                             '(default: [archive] after_days).')
+@click.option('--batch-size', type=int, help='Transactions moved per batch (default: [archive] batch_size).')
+@click.option('--pause', type=float, help='Seconds between batches (default: [archive] pause).')
+@click.option('--max-batches', type=int, help='Stop after this many batches.')
+def archive_transactions_command(after_days, batch_size, pause, max_batches):
+    """Move old returned transactions to transactions_archive."""
+    start = time.monotonic()
+
+    def progress(result):
+        print(f"  {result.archived} transactions archived", end='\r')
+
+    result = archive_transactions(
+        mysql.connection,
+        after_days=app.config['ARCHIVE_AFTER_DAYS'] if after_days is None else after_days,
+        batch_size=batch_size or app.config['ARCHIVE_BATCH_SIZE'],
+        pause=app.config['ARCHIVE_PAUSE'] if pause is None else pause,
+        max_batches=max_batches, progress=progress)
+    if result.archived:
+        changed('transactions')
+    print(f"{result.archived} transactions returned before {result.cutoff:%Y-%m-%d} archived "
+          f"in {result.batches} batches ({time.monotonic() - start:.1f}s)")
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute the borrowing rollups from the transactions table."""
+    start = time.monotonic()
+    rebuild_rollups(mysql.connection)
+    print(f"Borrowing statistics rebuilt in {time.monotonic() - start:.1f}s")
+
+
+# Schema migrations
+@app.cli.group('db')
+def db_command():
+    """Apply, roll back and inspect schema migrations."""
+
+
+@db_command.command('status')
+def db_status_command():
+    version = current_version(mysql.connection)
+    for migration in MIGRATIONS:
+        print(f"{'applied' if migration.version <= version else 'pending':<8} {migration}")
+    print(f"Schema version {version} of {MIGRATIONS[-1].version}")
+
+
+@db_command.command('upgrade')
+@click.option('--to', 'target', type=int, help='Version to upgrade to (default: latest).')
+def db_upgrade_command(target):
+    try:
+        for migration in upgrade(mysql.connection, MIGRATIONS, target):
+            print(f"Applied {migration}")
+    except MigrationError as e:
+        raise click.ClickException(str(e))
+    print(f"Schema version {current_version(mysql.connection)}")
+
+
+@db_command.command('downgrade')
+@click.option('--to', 'target', type=int, help='Version to roll back to (default: the previous one).')
+def db_downgrade_command(target):
+    if target is None:
+        target = max(current_version(mysql.connection) - 1, 0)
+    try:
+        for migration in downgrade(mysql.connection, MIGRATIONS, target):
+            print(f"Rolled back {migration}")
+    except MigrationError as e:
+        raise click.ClickException(str(e))
+    print(f"Schema version {current_version(mysql.connection)}")
+
+
+@db_command.command('stamp')
+@click.argument('version', type=int)
+def db_stamp_command(version):
+    """Mark migrations up to VERSION as applied without running them."""
+    stamp(mysql.connection, MIGRATIONS, version)
+    print(f"Schema version {current_version(mysql.connection)}")
+
+
+# Metrics (Prometheus text format)
+instrumentation.registry.collector(
+    'library_cache_hits_total', 'Cache hits.', ('cache',),
+    lambda: {(name,): stats['hits'] for name, stats in cache_stats().items()}, type='counter')
+instrumentation.registry.collector(
+    'library_cache_misses_total', 'Cache misses.', ('cache',),
+    lambda: {(name,): stats['misses'] for name, stats in cache_stats().items()}, type='counter')
+instrumentation.registry.collector(
+    'library_catalog_books', 'Books in the in-process catalog snapshot.', (),
+    lambda: {(): len(catalog)})
+instrumentation.registry.collector(
+    'library_catalog_bytes', 'Memory held by the catalog snapshot.', (),
+    lambda: {(): catalog.memory_usage()['total']})
+instrumentation.registry.collector(
+    'library_db_pool_connections', 'Open pooled database connections.', (),
+    lambda: {(): mysql.pool.opened if mysql.pool else 0})
+
+
+def job_counts():
+    counts = {}
+    for job in jobs.list():
+        counts[(job.status,)] = counts.get((job.status,), 0) + 1
+    return counts
+
+
+instrumentation.registry.collector('library_jobs', 'Background jobs by status.', ('status',), job_counts)
+
 
+@app.route('/metrics')
+def metrics():
+    return Response(instrumentation.render(), content_type=PROMETHEUS_CONTENT_TYPE)
 
 
 if __name__ == '__main__':
+    create_app()
     app.secret_key = "secret"
     app.run(debug=True)
@@ -0,0 +1,69 @@
+import time
+from datetime import datetime, timedelta
+
+
+# Archival of returned loans.
+#
+# archive_transactions() moves transactions returned more than `after_days`
+# ago into transactions_archive, a batch at a time: the ids of one batch are
+# read from the (returned_on, id, ...) index, copied and deleted by primary
+# key in one short transaction, and the next batch waits `pause` seconds, so
+# the live table is never locked beyond the rows being moved and replicas
+# and concurrent circulation keep up. Open loans are never archived, so the
+# transactions table holds open loans and recent history only.
+#
+# Reads that want the full history (the /transactions history filter, the
+# rollup rebuild) use HISTORY_SQL, which unions both tables.
+
+AFTER_DAYS = 365
+BATCH_SIZE = 1000
+PAUSE = 0.5
+
+COLUMNS = "id, book_id, member_id, per_day_fee, borrowed_on, returned_on, total_charge, amount_paid"
+
+# Every transaction, live or archived, as one derived table
+HISTORY_SQL = (f"(SELECT {COLUMNS} FROM transactions "
+               f"UNION ALL SELECT {COLUMNS} FROM transactions_archive)")
+
+
+class ArchiveResult:
+    def __init__(self, cutoff):
+        self.cutoff = cutoff
+        self.archived = 0
+        self.batches = 0
+
+
+def archive_transactions(connection, after_days=AFTER_DAYS, batch_size=BATCH_SIZE, pause=PAUSE,
+                         max_batches=None, now=None, progress=None):
+    # progress(result) is called after every batch
+    now = now or datetime.now()
+    result = ArchiveResult(now - timedelta(days=after_days))
+    with connection.cursor() as cursor:
+        while max_batches is None or result.batches < max_batches:
+            cursor.execute(
+                "SELECT id FROM transactions WHERE returned_on < %s ORDER BY returned_on, id LIMIT %s",
+                [result.cutoff, batch_size])
+            ids = [row['id'] for row in cursor.fetchall()]
+            if not ids:
+                break
+
+            placeholders = ", ".join(["%s"] * len(ids))
+            try:
+                cursor.execute(
+                    f"INSERT INTO transactions_archive ({COLUMNS}, archived_on) "
+                    f"SELECT {COLUMNS}, %s FROM transactions WHERE id IN ({placeholders})", [now] + ids)
+                cursor.execute(f"DELETE FROM transactions WHERE id IN ({placeholders})", ids)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+
+            result.archived += len(ids)
+            result.batches += 1
+            if progress:
+                progress(result)
+            if len(ids) < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+    return result
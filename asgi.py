@@ -0,0 +1,226 @@
+import asyncio
+import json
+import logging
+import re
+import time
+import uuid
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+
+import app as library
+from db import AsyncDatabase
+from importer import AsyncBookImporter
+from instrumentation import log
+from jobs import JOB_SQL
+from migrate import current_version
+from search import FIELDS as SEARCH_FIELDS
+
+
+# Async (ASGI) serving mode.
+#
+#   pip install uvicorn a2wsgi aiomysql httpx
+#   uvicorn asgi:application --host 0.0.0.0 --port 8000
+#
+# The JSON endpoints that clients call per keystroke or poll (book and member
+# lookup, book search and job progress) are coroutines querying MySQL through
+# an aiomysql pool, so a waiting request costs an await instead of a thread and
+# one process can hold thousands of them. Book imports run on the event loop
+# with httpx and aiomysql. Every other route is the Flask app behind a2wsgi,
+# run on a pool of [asgi] wsgi_workers threads exactly as under WSGI;
+# `python app.py` and WSGI servers keep serving the app unchanged.
+#
+# Job progress is kept in the jobs table, so with several processes
+# (uvicorn --workers N) any of them can answer it. The schema version is checked once at
+# startup; with schema_check = strict the server refuses to start on an
+# out-of-date database.
+
+WSGI_WORKERS = 10
+
+
+def arg(query, name, default=''):
+    values = query.get(name)
+    return values[0] if values else default
+
+
+def int_arg(query, name, default):
+    try:
+        return int(arg(query, name, default))
+    except ValueError:
+        return default
+
+
+class LibraryASGI:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        config = flask_app.extensions['library']
+        self.wsgi = WSGIMiddleware(flask_app, workers=config.getint('asgi', 'wsgi_workers', fallback=WSGI_WORKERS))
+        self.db = AsyncDatabase(flask_app.config)
+        self.db.query_listeners.append(library.instrumentation.record_query)
+        # (path, Flask endpoint name for metrics, handler)
+        self.routes = [
+            (re.compile(r'/api/books/lookup'), 'api_book_lookup', self.book_lookup),
+            (re.compile(r'/api/members/lookup'), 'api_member_lookup', self.member_lookup),
+            (re.compile(r'/api/books/search'), 'api_book_search', self.book_search),
+            (re.compile(r'/api/jobs/(?P<job_id>[^/]+)'), 'api_job', self.job),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            for pattern, endpoint, handler in self.routes:
+                match = pattern.fullmatch(scope['path'])
+                if match:
+                    await self.dispatch(scope, send, endpoint, handler, match.groupdict())
+                    return
+        await self.wsgi(scope, receive, send)
+
+    # Startup and shutdown
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    log.exception('startup_failed')
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def schema_version(self):
+        with self.flask_app.app_context():
+            return current_version(library.mysql.connection)
+
+    async def startup(self):
+        schema_check = self.flask_app.config['SCHEMA_CHECK']
+        if schema_check != 'off':
+            version = await asyncio.to_thread(self.schema_version)
+            latest = library.MIGRATIONS[-1].version
+            if version != latest:
+                log.error('schema_out_of_date', extra={'fields': {'version': version, 'latest': latest}})
+                if schema_check == 'strict':
+                    raise RuntimeError(f"Database schema is at version {version}, this app needs {latest}. "
+                                       "Run `flask db upgrade`.")
+        await self.db.open()
+        library.jobs.loop = asyncio.get_running_loop()
+        library.import_runner = self.run_import_job
+
+    async def shutdown(self):
+        library.import_runner = library.run_import_job
+        library.jobs.loop = None
+        await self.db.close()
+
+    # Requests
+
+    async def dispatch(self, scope, send, endpoint, handler, params):
+        start = time.perf_counter()
+        headers = dict(scope['headers'])
+        request_id = headers.get(b'x-request-id', b'').decode('latin-1') or uuid.uuid4().hex
+        fields = {'request_id': request_id, 'method': 'GET', 'path': scope['path'], 'endpoint': endpoint}
+        try:
+            status, body = await handler(parse_qs(scope['query_string'].decode('latin-1')), **params)
+        except Exception:
+            log.exception('request_failed', extra={'fields': fields})
+            status, body = 500, {'error': 'Internal Server Error'}
+
+        payload = json.dumps(body, default=str).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(payload)).encode()),
+                (b'x-request-id', request_id.encode('latin-1')),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+
+        duration = time.perf_counter() - start
+        instrumentation = library.instrumentation
+        instrumentation.requests.inc('GET', endpoint, str(status))
+        instrumentation.request_latency.observe(duration, 'GET', endpoint)
+        slow = duration >= instrumentation.slow_request
+        log.log(logging.WARNING if slow else logging.INFO, 'slow_request' if slow else 'request',
+                extra={'fields': dict(fields, status=status, duration_ms=round(duration * 1000, 2))})
+
+    async def lookup(self, table, label, q):
+        # app.lookup on the async pool, sharing its cache
+        q = q.strip()
+        cache_key = q.lower()
+        results = library.lookup_caches[table].get(cache_key)
+        if results is not None:
+            return results
+
+        results = []
+        async with self.db.cursor() as cursor:
+            for query, args in library.lookup_queries(table, label, q):
+                await cursor.execute(query, args)
+                results.extend(row for row in await cursor.fetchall() if row not in results)
+
+        results = results[:library.LOOKUP_LIMIT]
+        library.lookup_caches[table].set(cache_key, results)
+        return results
+
+    async def book_lookup(self, query):
+        return 200, {'results': await self.lookup('books', 'title', arg(query, 'q'))}
+
+    async def member_lookup(self, query):
+        return 200, {'results': await self.lookup('members', 'name', arg(query, 'q'))}
+
+    def search_index(self):
+        # Checking the books version may be a Redis round trip, and loading
+        # the index reads the books table, so this runs on a thread
+        with self.flask_app.app_context():
+            return library.get_search_index()
+
+    async def book_search(self, query):
+        q = arg(query, 'q')
+        fields = [field for field in query.get('field', []) if field in SEARCH_FIELDS] or None
+        page = max(1, int_arg(query, 'page', 1))
+        per_page = max(1, min(int_arg(query, 'per_page', 20), library.SEARCH_API_MAX_PER_PAGE))
+
+        index = await asyncio.to_thread(self.search_index)
+        total, ranked = index.search(
+            q, fields, offset=(page - 1) * per_page, limit=per_page)
+        scores = dict(ranked)
+
+        books = []
+        if scores:
+            async with self.db.cursor() as cursor:
+                await cursor.execute(*library.books_by_ids_query(list(scores), library.BOOK_COLUMNS))
+                books = library.in_id_order(list(scores), await cursor.fetchall())
+
+        return 200, {'query': q, 'page': page, 'per_page': per_page, 'total': total,
+                     'results': [dict(book, score=round(scores[book['id']], 4)) for book in books]}
+
+    async def job(self, query, job_id):
+        job = library.jobs.get(job_id)
+        if job is not None:
+            return 200, job.to_dict()
+        async with self.db.cursor() as cursor:
+            await cursor.execute(JOB_SQL, [job_id])
+            row = await cursor.fetchone()
+        if row is None:
+            return 404, {'error': 'Job not found'}
+        return 200, library.jobs.store.to_dict(row)
+
+    # Jobs
+
+    async def run_import_job(self, job, no_of_books, title, author):
+        importer = AsyncBookImporter(self.db, base_url=self.flask_app.config['IMPORT_BASE_URL'],
+                                     workers=self.flask_app.config['IMPORT_WORKERS'],
+                                     client_options=library.import_client_options)
+        result = await importer.run(no_of_books, title, author, quantity=no_of_books,
+                                    progress=library.import_progress(job))
+        return library.finish_import(result, no_of_books)
+
+
+application = LibraryASGI(library.create_app())
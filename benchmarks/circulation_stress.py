@@ -0,0 +1,225 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+
+import MySQLdb
+import MySQLdb.cursors
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from circulation import issue_book, return_book, CirculationError
+from settings import load_config
+
+
+# Concurrency stress benchmark for the issue/return paths.
+#
+# Creates a few scarce books and a set of members, then lets many threads
+# issue and return them at random against the database from config.ini.
+# Threads pick loans to return from a shared pool, so several of them race
+# to return the same loan. At the end it checks that no copy was oversold, no
+# debt update was lost and the borrowing rollups agree with the loans, prints
+# throughput and latencies, and removes the fixture rows (monthly_stats keep
+# the stress loans; `flask rebuild-stats` recounts them):
+#
+#   python benchmarks/circulation_stress.py --threads 32 --duration 20
+
+FIRST_BOOK_ID = 900000000
+
+
+def connect(config):
+    return MySQLdb.connect(
+        host=config['database']['host'],
+        user=config['database']['user'],
+        passwd=config['database']['password'],
+        port=config.getint('database', 'port'),
+        db=config['database']['db'],
+        cursorclass=MySQLdb.cursors.DictCursor,
+    )
+
+
+def setup(connection, books, copies, members):
+    book_ids = list(range(FIRST_BOOK_ID, FIRST_BOOK_ID + books))
+    member_ids = []
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO books (id, title, author, total_quantity, available_quantity) VALUES (%s, %s, %s, %s, %s)",
+            [(book_id, f'Stress book {book_id}', 'Stress', copies, copies) for book_id in book_ids])
+        for n in range(members):
+            cursor.execute("INSERT INTO members (name, email, ph_no) VALUES (%s, %s, %s)",
+                           (f'Stress member {n}', f'stress{n}@example.com', '0000000000'))
+            member_ids.append(cursor.lastrowid)
+    connection.commit()
+    return book_ids, member_ids
+
+
+def teardown(connection, book_ids, member_ids):
+    with connection.cursor() as cursor:
+        placeholders = ", ".join(["%s"] * len(book_ids))
+        cursor.execute(f"DELETE FROM transactions WHERE book_id IN ({placeholders})", book_ids)
+        cursor.execute(f"DELETE FROM book_stats WHERE book_id IN ({placeholders})", book_ids)
+        cursor.execute(f"DELETE FROM books WHERE id IN ({placeholders})", book_ids)
+        placeholders = ", ".join(["%s"] * len(member_ids))
+        cursor.execute(f"DELETE FROM member_book_stats WHERE member_id IN ({placeholders})", member_ids)
+        cursor.execute(f"DELETE FROM member_stats WHERE member_id IN ({placeholders})", member_ids)
+        cursor.execute(f"DELETE FROM members WHERE id IN ({placeholders})", member_ids)
+    connection.commit()
+
+
+def worker(config, book_ids, member_ids, open_loans, loans_lock, deadline, outcomes, latencies, lock):
+    connection = connect(config)
+    local_outcomes = Counter()
+    local_latencies = {'issue': [], 'return': []}
+    rng = random.Random()
+    try:
+        while time.monotonic() < deadline:
+            with loans_lock:
+                loan = rng.choice(open_loans) if open_loans and rng.random() < 0.5 else None
+
+            start = time.perf_counter()
+            try:
+                if loan is None:
+                    op = 'issue'
+                    transaction_id = issue_book(connection, rng.choice(book_ids), rng.choice(member_ids), 1)
+                    with loans_lock:
+                        open_loans.append(transaction_id)
+                else:
+                    op = 'return'
+                    return_book(connection, loan, rng.randint(0, 5))
+                    with loans_lock:
+                        if loan in open_loans:
+                            open_loans.remove(loan)
+                local_outcomes[f'{op}: ok'] += 1
+            except CirculationError as e:
+                local_outcomes[f'{op}: {type(e).__name__}'] += 1
+            except MySQLdb.Error as e:
+                local_outcomes[f'{op}: {type(e).__name__} {e.args[0] if e.args else ""}'] += 1
+            local_latencies[op].append(time.perf_counter() - start)
+    finally:
+        connection.close()
+
+    with lock:
+        outcomes.update(local_outcomes)
+        for op, values in local_latencies.items():
+            latencies[op].extend(values)
+
+
+def check(connection, book_ids, member_ids):
+    problems = []
+    with connection.cursor() as cursor:
+        placeholders = ", ".join(["%s"] * len(book_ids))
+        cursor.execute(
+            f"SELECT b.id, b.total_quantity, b.available_quantity, "
+            f"(SELECT COUNT(*) FROM transactions t WHERE t.book_id = b.id AND t.returned_on IS NULL) AS open_loans "
+            f"FROM books b WHERE b.id IN ({placeholders})", book_ids)
+        for book in cursor.fetchall():
+            if book['available_quantity'] < 0:
+                problems.append(f"book {book['id']}: available_quantity is {book['available_quantity']}")
+            if book['available_quantity'] != book['total_quantity'] - book['open_loans']:
+                problems.append(f"book {book['id']}: {book['available_quantity']} available but "
+                                f"{book['open_loans']} of {book['total_quantity']} copies on loan")
+
+        placeholders = ", ".join(["%s"] * len(member_ids))
+        cursor.execute(
+            f"SELECT m.id, COALESCE(m.outstanding_debt, 0) AS outstanding_debt, "
+            f"COALESCE(m.amount_spent, 0) AS amount_spent, "
+            f"COALESCE(SUM(t.total_charge - t.amount_paid), 0) AS expected_debt, "
+            f"COALESCE(SUM(t.amount_paid), 0) AS expected_spent "
+            f"FROM members m LEFT JOIN transactions t ON t.member_id = m.id AND t.returned_on IS NOT NULL "
+            f"WHERE m.id IN ({placeholders}) GROUP BY m.id", member_ids)
+        for member in cursor.fetchall():
+            if abs(member['outstanding_debt'] - member['expected_debt']) > 1e-6:
+                problems.append(f"member {member['id']}: debt {member['outstanding_debt']} != {member['expected_debt']}")
+            if abs(member['amount_spent'] - member['expected_spent']) > 1e-6:
+                problems.append(f"member {member['id']}: spent {member['amount_spent']} != {member['expected_spent']}")
+
+        cursor.execute(
+            f"SELECT s.member_id, s.active_loans, s.lifetime_borrows, "
+            f"(SELECT COUNT(*) FROM transactions t WHERE t.member_id = s.member_id AND t.returned_on IS NULL) AS open_loans, "
+            f"(SELECT COUNT(*) FROM transactions t WHERE t.member_id = s.member_id) AS loans "
+            f"FROM member_stats s WHERE s.member_id IN ({placeholders})", member_ids)
+        for stats in cursor.fetchall():
+            if (stats['active_loans'], stats['lifetime_borrows']) != (stats['open_loans'], stats['loans']):
+                problems.append(f"member {stats['member_id']}: rollup has {stats['active_loans']} active of "
+                                f"{stats['lifetime_borrows']} loans, transactions {stats['open_loans']} of {stats['loans']}")
+
+        placeholders = ", ".join(["%s"] * len(book_ids))
+        cursor.execute(
+            f"SELECT s.book_id, s.active_loans, "
+            f"(SELECT COUNT(*) FROM transactions t WHERE t.book_id = s.book_id AND t.returned_on IS NULL) AS open_loans "
+            f"FROM book_stats s WHERE s.book_id IN ({placeholders})", book_ids)
+        for stats in cursor.fetchall():
+            if stats['active_loans'] != stats['open_loans']:
+                problems.append(f"book {stats['book_id']}: rollup has {stats['active_loans']} active loans, "
+                                f"transactions {stats['open_loans']}")
+    return problems
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Issue/return concurrency stress benchmark')
+    parser.add_argument('--config', help='ini file (default: $LIBRARY_CONFIG or config.ini)')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds')
+    parser.add_argument('--books', type=int, default=5)
+    parser.add_argument('--copies', type=int, default=3)
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--keep', action='store_true', help='keep the fixture rows')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+
+    connection = connect(config)
+    book_ids, member_ids = setup(connection, args.books, args.copies, args.members)
+    try:
+        outcomes = Counter()
+        latencies = {'issue': [], 'return': []}
+        open_loans = []
+        loans_lock = threading.Lock()
+        lock = threading.Lock()
+        deadline = time.monotonic() + args.duration
+
+        threads = [threading.Thread(target=worker, args=(config, book_ids, member_ids, open_loans, loans_lock,
+                                                         deadline, outcomes, latencies, lock))
+                   for _ in range(args.threads)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+
+        total = sum(outcomes.values())
+        print(f"{total} operations in {elapsed:.1f}s with {args.threads} threads: {total / elapsed:.0f} ops/s")
+        for outcome, count in sorted(outcomes.items()):
+            print(f"  {outcome:<40} {count}")
+        for op, values in latencies.items():
+            if values:
+                print(f"  {op:<7} p50 {percentile(values, 0.5) * 1000:.1f}ms  p95 {percentile(values, 0.95) * 1000:.1f}ms"
+                      f"  p99 {percentile(values, 0.99) * 1000:.1f}ms  mean {statistics.mean(values) * 1000:.1f}ms")
+
+        problems = check(connection, book_ids, member_ids)
+        if problems:
+            print(f"FAILED: {len(problems)} consistency problems")
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+        print("OK: no oversold copies, no lost debt updates, rollups consistent")
+    finally:
+        if not args.keep:
+            teardown(connection, book_ids, member_ids)
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Local stand-in for https://frappe.io/api/method/frappe-library
+#
+# Serves a deterministic synthetic catalog in the same shape as the real API
+# (20 books per page, optional title/author substring filters) so imports can
+# be exercised without network access:
+#
+#   python benchmarks/fake_frappe.py --port 8001 --books 50000 --latency 0.05
+#
+# and then set `base_url = http://127.0.0.1:8001/api/method/frappe-library`
+# in the [import] section of config.ini.
+#
+# To exercise the import client's retries and rate limiting it can also fail
+# a fraction of requests with 503 (--error-rate), answer with a body that is
+# not JSON (--garbage-rate), stall for --stall seconds (--stall-rate), and
+# answer 429 with Retry-After above --rate-limit requests per second.
+
+PAGE_SIZE = 20
+API_PATH = '/api/method/frappe-library'
+
+WORDS = ['river', 'night', 'garden', 'empire', 'shadow', 'winter', 'letters', 'island',
+         'silver', 'machine', 'history', 'secret', 'ocean', 'stone', 'city', 'fire']
+AUTHORS = ['Ada Byron', 'Jane Austen', 'Leo Tolstoy', 'Toni Morrison', 'Haruki Murakami',
+           'Chinua Achebe', 'Ursula K. Le Guin', 'Gabriel Garcia Marquez']
+PUBLISHERS = ['Penguin', 'Vintage', 'Harper', 'Scholastic', 'Random House']
+
+
+def make_catalog(count, first_id=1, seed=0):
+    rng = random.Random(seed)
+    catalog = []
+    for n in range(count):
+        book_id = first_id + n
+        isbn13 = f"978{book_id:010d}"
+        catalog.append({
+            'bookID': str(book_id),
+            'title': ' '.join(rng.sample(WORDS, 3)).title(),
+            'authors': rng.choice(AUTHORS),
+            'average_rating': str(round(rng.uniform(1, 5), 2)),
+            'isbn': isbn13[3:],
+            'isbn13': isbn13,
+            'language_code': 'eng',
+            'num_pages': str(rng.randint(50, 900)),
+            'ratings_count': str(rng.randint(0, 100000)),
+            'text_reviews_count': str(rng.randint(0, 5000)),
+            'publication_date': f"{rng.randint(1, 12)}/{rng.randint(1, 28)}/{rng.randint(1950, 2023)}",
+            'publisher': rng.choice(PUBLISHERS),
+        })
+    return catalog
+
+
+class FrappeLibraryHandler(BaseHTTPRequestHandler):
+    catalog = []
+    latency = 0.0
+    error_rate = 0.0
+    garbage_rate = 0.0
+    stall_rate = 0.0
+    stall = 0.0
+    rate_limit = None
+    # Shared by all requests: request count, rate limit window, random faults
+    state = None
+
+    def fault(self):
+        # Returns the fault to inject into this request, if any
+        state = self.state
+        with state['lock']:
+            state['requests'] += 1
+            now = time.monotonic()
+            if self.rate_limit:
+                if now - state['window'] >= 1:
+                    state['window'], state['in_window'] = now, 0
+                state['in_window'] += 1
+                if state['in_window'] > self.rate_limit:
+                    return 'rate_limited'
+            draw = state['rng'].random()
+        for fault, rate in (('error', self.error_rate), ('garbage', self.garbage_rate), ('stall', self.stall_rate)):
+            if draw < rate:
+                return fault
+            draw -= rate
+        return None
+
+    def send_body(self, status, body, content_type='application/json', headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on a stalled request
+            pass
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != API_PATH:
+            self.send_error(404)
+            return
+        fault = self.fault()
+        if fault == 'rate_limited':
+            self.send_body(429, b'{"exc": "Too Many Requests"}', headers=[('Retry-After', '1')])
+            return
+        if fault == 'error':
+            self.send_body(503, b'<html>Service Unavailable</html>', content_type='text/html')
+            return
+        if fault == 'garbage':
+            self.send_body(200, b'<html>Bad Gateway</html>', content_type='text/html')
+            return
+        if fault == 'stall':
+            time.sleep(self.stall)
+        query = urllib.parse.parse_qs(url.query)
+        page = int(query.get('page', ['1'])[0] or 1)
+        title = query.get('title', [''])[0].lower()
+        author = query.get('author', [''])[0].lower()
+
+        books = self.catalog
+        if title or author:
+            books = [book for book in books
+                     if title in book['title'].lower() and author in book['authors'].lower()]
+        start = (page - 1) * PAGE_SIZE
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        self.send_body(200, json.dumps({'message': books[start:start + PAGE_SIZE]}).encode())
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(books=1000, latency=0.0, host='127.0.0.1', port=0, first_id=1, error_rate=0.0,
+                 garbage_rate=0.0, stall_rate=0.0, stall=0.0, rate_limit=None, seed=0):
+    # Starts the server on a background thread and returns (server, base_url);
+    # call server.shutdown() to stop it. server.RequestHandlerClass.state
+    # ['requests'] counts the requests served.
+    handler = type('Handler', (FrappeLibraryHandler,), {
+        'catalog': make_catalog(books, first_id),
+        'latency': latency,
+        'error_rate': error_rate,
+        'garbage_rate': garbage_rate,
+        'stall_rate': stall_rate,
+        'stall': stall,
+        'rate_limit': rate_limit,
+        'state': {'lock': threading.Lock(), 'rng': random.Random(seed), 'requests': 0,
+                  'window': time.monotonic(), 'in_window': 0},
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://{host}:{server.server_address[1]}{API_PATH}"
+    return server, base_url
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the frappe-library API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--first-id', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    parser.add_argument('--garbage-rate', type=float, default=0.0, help='fraction of requests answered with non-JSON')
+    parser.add_argument('--stall-rate', type=float, default=0.0, help='fraction of requests delayed by --stall')
+    parser.add_argument('--stall', type=float, default=60.0, help='seconds a stalled request waits')
+    parser.add_argument('--rate-limit', type=int, help='requests per second above which 429 is returned')
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.books, args.latency, args.host, args.port, args.first_id,
+                                    error_rate=args.error_rate, garbage_rate=args.garbage_rate,
+                                    stall_rate=args.stall_rate, stall=args.stall, rate_limit=args.rate_limit)
+    print(f"Serving {args.books} books on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
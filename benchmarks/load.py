@@ -0,0 +1,380 @@
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import requests
+
+from fake_frappe import start_server, WORDS, AUTHORS
+from seed import connect, table_counts
+from settings import load_config
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+# HTTP load driver for the library routes.
+#
+# Runs a weighted mix of scenarios (browsing /books, searching, issuing and
+# returning books, filtering /transactions and submitting imports) from
+# --concurrency threads for --duration seconds after a --warmup, then reports
+# throughput and p50/p95/p99 latency per scenario. Results are stored as JSON
+# in benchmarks/results/ and can be checked against an earlier run:
+#
+#   python benchmarks/seed.py --size 100k --reset
+#   python benchmarks/load.py --concurrency 16 --duration 60 --label v1.4
+#   python benchmarks/load.py --compare benchmarks/results/<baseline>.json
+#
+# Without --url the app is served in-process (threaded werkzeug server, same
+# interpreter as the driver) from config.ini, with imports pointed at a local
+# fake frappe API. For numbers that mean something before a deploy, run the
+# app the way it is deployed and pass --url; imports then need that app's
+# [import] base_url set to the fake API, started here on --frappe-port.
+#
+# Returns pick open loans from the database in config.ini, so the driver must
+# see the same database as the app. A thread that runs out of open loans
+# drops book_return from its mix and goes on with the other scenarios; the
+# summary says so. Issues and returns change the data: reseed between runs
+# that must be comparable.
+
+SCENARIOS = {
+    'books': 30,
+    'book_search': 20,
+    'transactions': 20,
+    'book_issue': 12,
+    'book_return': 12,
+    'book_import': 6,
+}
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+OPEN_LOANS_LIMIT = 100000
+IMPORT_FIRST_ID = 50000000
+IMPORT_CATALOG = 5000
+
+
+class State:
+    def __init__(self, books, members, open_loans):
+        self.books = books
+        self.members = members
+        self.open_loans = open_loans
+        self.lock = threading.Lock()
+
+    def take_loan(self):
+        with self.lock:
+            return self.open_loans.pop() if self.open_loans else None
+
+
+def id_range(cursor, table):
+    cursor.execute(f"SELECT MIN(id) AS low, MAX(id) AS high FROM {table}")
+    row = cursor.fetchone()
+    return row['low'] or 0, row['high'] or 0
+
+
+def load_state(config, seed):
+    connection = connect(config)
+    try:
+        with connection.cursor() as cursor:
+            books = id_range(cursor, 'books')
+            members = id_range(cursor, 'members')
+            cursor.execute("SELECT id FROM transactions WHERE returned_on IS NULL ORDER BY id LIMIT %s",
+                           [OPEN_LOANS_LIMIT])
+            open_loans = [row['id'] for row in cursor.fetchall()]
+        counts = table_counts(connection)
+    finally:
+        connection.close()
+    random.Random(seed).shuffle(open_loans)
+    return State(books, members, open_loans), counts
+
+
+# Scenarios: each makes one request and returns the response, or None when
+# it has nothing left to do. Form posts are not redirected, so only the route
+# itself is timed.
+
+def books(session, url, rng, state):
+    sort = rng.choice(('id', 'id', 'title', 'author'))
+    if sort == 'id' and rng.random() < 0.8:
+        return session.get(f"{url}/books", params={'after': rng.randint(*state.books)})
+    return session.get(f"{url}/books", params={'sort': sort})
+
+
+def book_search(session, url, rng, state):
+    return session.post(f"{url}/book_search", data={
+        'title': ' '.join(rng.sample(WORDS, rng.randint(1, 2))),
+        'author': rng.choice(AUTHORS).split()[-1],
+    })
+
+
+def transactions(session, url, rng, state):
+    params = rng.choice((
+        {},
+        {'status': 'open'},
+        {'member_id': rng.randint(*state.members)},
+        {'book_id': rng.randint(*state.books)},
+    ))
+    return session.get(f"{url}/transactions", params=params)
+
+
+def book_issue(session, url, rng, state):
+    return session.post(f"{url}/book_issue", data={
+        'book_id': rng.randint(*state.books),
+        'member_id': rng.randint(*state.members),
+        'per_day_fee': rng.randint(1, 5),
+    }, allow_redirects=False)
+
+
+def book_return(session, url, rng, state):
+    loan = state.take_loan()
+    if loan is None:
+        return None
+    return session.post(f"{url}/book_return/{loan}", data={'amount_paid': rng.randint(0, 50)},
+                        allow_redirects=False)
+
+
+def book_import(session, url, rng, state):
+    return session.post(f"{url}/book_import", data={'no_of_books': 20, 'title': rng.choice(WORDS)},
+                        allow_redirects=False)
+
+
+RUNNERS = {
+    'books': books,
+    'book_search': book_search,
+    'transactions': transactions,
+    'book_issue': book_issue,
+    'book_return': book_return,
+    'book_import': book_import,
+}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def worker(url, scenarios, weights, state, seed, warmup_until, deadline, samples, exhausted, lock):
+    # Scenarios that run out of work are added to `exhausted` and left out of
+    # this thread's mix; the thread stops when none are left
+    rng = random.Random(seed)
+    session = requests.Session()
+    mix = dict(zip(scenarios, weights))
+    local = []
+    while mix:
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        name = rng.choices(list(mix), list(mix.values()))[0]
+        start = time.perf_counter()
+        try:
+            response = RUNNERS[name](session, url, rng, state)
+            if response is None:
+                del mix[name]
+                with lock:
+                    exhausted[name] += 1
+                continue
+            outcome = response.status_code
+        except requests.RequestException as e:
+            outcome = type(e).__name__
+        if now >= warmup_until:
+            local.append((name, time.perf_counter() - start, outcome))
+    with lock:
+        samples.extend(local)
+
+
+def summarize(samples, elapsed):
+    by_scenario = {}
+    for name, seconds, outcome in samples:
+        by_scenario.setdefault(name, []).append((seconds, outcome))
+    by_scenario['all'] = [(seconds, outcome) for _, seconds, outcome in samples]
+
+    summary = {}
+    for name, entries in by_scenario.items():
+        latencies = [seconds for seconds, _ in entries]
+        outcomes = Counter(str(outcome) for _, outcome in entries)
+        errors = sum(count for outcome, count in outcomes.items() if not outcome.isdigit() or int(outcome) >= 500)
+        summary[name] = {
+            'requests': len(entries),
+            'errors': errors,
+            'outcomes': dict(outcomes),
+            'throughput': len(entries) / elapsed,
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'mean': statistics.mean(latencies) if latencies else 0.0,
+            'max': max(latencies, default=0.0),
+        }
+    return summary
+
+
+def print_summary(summary):
+    print(f"  {'scenario':<13} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, stats in sorted(summary.items(), key=lambda item: item[0] == 'all'):
+        print(f"  {name:<13} {stats['requests']:>8} {stats['errors']:>6} {stats['throughput']:>8.1f} "
+              f"{stats['p50'] * 1000:>8.1f} {stats['p95'] * 1000:>8.1f} {stats['p99'] * 1000:>8.1f}")
+
+
+def compare(summary, baseline, threshold):
+    # Returns the scenarios whose p95 grew or throughput fell by more than threshold
+    regressions = []
+    for name, stats in summary.items():
+        before = baseline['scenarios'].get(name)
+        if not before or not before['requests']:
+            continue
+        if stats['p95'] > before['p95'] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95'] * 1000:.1f}ms -> {stats['p95'] * 1000:.1f}ms")
+        if stats['throughput'] < before['throughput'] * (1 - threshold):
+            regressions.append(f"{name}: {before['throughput']:.1f} -> {stats['throughput']:.1f} req/s")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r} (choose from {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def serve_app(config_file=None, import_base_url=None):
+    # Serves app.py in-process on a free port and returns (server, url).
+    # Per-request access logs are turned off; warnings (slow requests, N+1
+    # queries) still show.
+    from werkzeug.serving import make_server
+
+    sys.path.insert(0, ROOT)
+    import app as library
+
+    library.create_app(config_file)
+    if import_base_url:
+        library.app.config['IMPORT_BASE_URL'] = import_base_url
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    logging.getLogger('library').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, library.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP load benchmark for the library routes')
+    parser.add_argument('--config', help='ini file (default: $LIBRARY_CONFIG or config.ini)')
+    parser.add_argument('--url', help='benchmark a running app instead of serving one in-process')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30.0, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=5.0, help='unmeasured seconds before the run')
+    parser.add_argument('--mix', type=parse_mix, default=dict(SCENARIOS),
+                        help='scenario weights, e.g. books=3,book_search=1 (default: all)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--frappe-port', type=int, default=0, help='port of the fake frappe API (default: any)')
+    parser.add_argument('--frappe-latency', type=float, default=0.0)
+    parser.add_argument('--label', default='', help='stored with the results and used in the file name')
+    parser.add_argument('--output', help=f'results file (default: {os.path.relpath(RESULTS_DIR)}/<time>-<label>.json)')
+    parser.add_argument('--compare', help='results file of a baseline run')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed p95/throughput change vs the baseline')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    state, counts = load_state(config, args.seed)
+    if not state.books[1] or not state.members[1]:
+        print("The database has no books or members; run benchmarks/seed.py first")
+        sys.exit(1)
+
+    frappe = server = None
+    if 'book_import' in args.mix:
+        frappe, import_base_url = start_server(IMPORT_CATALOG, args.frappe_latency, port=args.frappe_port,
+                                               first_id=IMPORT_FIRST_ID)
+        print(f"Fake frappe API on {import_base_url}")
+    url = args.url
+    if url is None:
+        server, url = serve_app(args.config, import_base_url if frappe else None)
+    url = url.rstrip('/')
+
+    scenarios = list(args.mix)
+    weights = [args.mix[name] for name in scenarios]
+    print(f"{args.concurrency} threads against {url}: {args.warmup:.0f}s warmup, {args.duration:.0f}s run "
+          f"({counts['books']} books, {counts['members']} members, {counts['transactions']} transactions)")
+
+    # One request per scenario first, so lazy start-up work (the search
+    # index) is not part of the warmup
+    session = requests.Session()
+    for name in scenarios:
+        if name not in ('book_issue', 'book_return', 'book_import'):
+            RUNNERS[name](session, url, random.Random(args.seed), state)
+
+    samples = []
+    exhausted = Counter()
+    lock = threading.Lock()
+    warmup_until = time.monotonic() + args.warmup
+    deadline = warmup_until + args.duration
+    threads = [threading.Thread(target=worker, args=(url, scenarios, weights, state, args.seed * 1000 + n,
+                                                     warmup_until, deadline, samples, exhausted, lock))
+               for n in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if server:
+        server.shutdown()
+    if frappe:
+        frappe.shutdown()
+
+    summary = summarize(samples, args.duration)
+    print_summary(summary)
+    for name, count in exhausted.items():
+        print(f"  {name} ran out of work in {count} of {args.concurrency} threads; they went on without it")
+
+    results = {
+        'label': args.label,
+        'started_on': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'url': args.url or 'in-process',
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'warmup': args.warmup,
+        'mix': args.mix,
+        'seed': args.seed,
+        'catalog': counts,
+        'scenarios': summary,
+        'exhausted': dict(exhausted),
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        name = datetime.now().strftime('%Y%m%d-%H%M%S') + (f"-{args.label}" if args.label else '')
+        output = os.path.join(RESULTS_DIR, f"{name}.json")
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('mix') != args.mix or baseline.get('catalog') != counts:
+            print(f"Note: {args.compare} used a different scenario mix or catalog")
+        regressions = compare(summary, baseline, args.threshold)
+        if regressions:
+            print(f"REGRESSED against {args.compare} (threshold {args.threshold:.0%}):")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"OK: within {args.threshold:.0%} of {args.compare}")
+
+
+if __name__ == '__main__':
+    main()
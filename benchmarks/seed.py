@@ -0,0 +1,193 @@
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import MySQLdb
+import MySQLdb.cursors
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_frappe import WORDS, AUTHORS, PUBLISHERS
+from rollups import rebuild_rollups
+from settings import load_config
+
+
+# Seeds a benchmark database with a synthetic library.
+#
+# Books, members and transactions are generated deterministically from
+# --seed, so two runs with the same size and seed produce the same data. Each
+# size has ten books per member and two transactions per book, ~10% of them
+# still open. available_quantity, outstanding_debt and amount_spent are kept
+# consistent with the generated loans, so circulation behaves as it would on
+# real data, and the borrowing rollups are rebuilt at the end. Use a
+# dedicated database (the one in config.ini):
+#
+#   python benchmarks/seed.py --size 100k --reset
+#
+# Run `flask db upgrade` before seeding so the tables and indexes exist.
+
+SIZES = {
+    '10k': 10000,
+    '100k': 100000,
+    '1m': 1000000,
+}
+MEMBERS_PER_BOOK = 0.1
+TRANSACTIONS_PER_BOOK = 2
+OPEN_LOAN_RATE = 0.1
+HISTORY_DAYS = 365
+BATCH_SIZE = 5000
+TABLES = ('holds', 'loan_fees', 'member_stats', 'book_stats', 'member_book_stats', 'monthly_stats',
+          'transactions_archive', 'transactions', 'members', 'books')
+
+BOOK_SQL = ("INSERT INTO books (id, title, author, average_rating, isbn, isbn13, language_code, num_pages, "
+            "ratings_count, text_reviews_count, publication_date, publisher, total_quantity, available_quantity) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)")
+MEMBER_SQL = ("INSERT INTO members (id, name, email, ph_no, outstanding_debt, amount_spent) "
+              "VALUES (%s, %s, %s, %s, %s, %s)")
+TRANSACTION_SQL = ("INSERT INTO transactions (id, book_id, member_id, per_day_fee, borrowed_on, returned_on, "
+                   "total_charge, amount_paid) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)")
+
+
+def connect(config):
+    return MySQLdb.connect(
+        host=config['database']['host'],
+        user=config['database']['user'],
+        passwd=config['database']['password'],
+        port=config.getint('database', 'port'),
+        db=config['database']['db'],
+        cursorclass=MySQLdb.cursors.DictCursor,
+    )
+
+
+def insert_batches(connection, sql, rows, label):
+    start = time.monotonic()
+    count = 0
+    batch = []
+    with connection.cursor() as cursor:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                cursor.executemany(sql, batch)
+                connection.commit()
+                count += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+            connection.commit()
+            count += len(batch)
+    print(f"  {label:<13} {count:>9} rows in {time.monotonic() - start:.1f}s")
+
+
+def iter_transactions(seed, books, members, copies, now):
+    # Yields transaction rows; open loans never exceed a book's copies
+    rng = random.Random(seed + 1)
+    on_loan = [0] * (books + 1)
+    for transaction_id in range(1, books * TRANSACTIONS_PER_BOOK + 1):
+        book_id = rng.randint(1, books)
+        member_id = rng.randint(1, members)
+        per_day_fee = rng.randint(1, 5)
+        borrowed_on = now - timedelta(days=rng.randint(0, HISTORY_DAYS), seconds=rng.randint(0, 86399))
+        if rng.random() < OPEN_LOAN_RATE and on_loan[book_id] < copies[book_id]:
+            on_loan[book_id] += 1
+            yield (transaction_id, book_id, member_id, per_day_fee, borrowed_on, None, None, None)
+            continue
+        returned_on = borrowed_on + timedelta(days=rng.randint(0, 30))
+        total_charge = (returned_on - borrowed_on).days * per_day_fee
+        amount_paid = rng.choice((total_charge, total_charge, rng.randint(0, total_charge)))
+        yield (transaction_id, book_id, member_id, per_day_fee, borrowed_on, returned_on,
+               total_charge, amount_paid)
+
+
+def seed_library(connection, books, seed=0):
+    rng = random.Random(seed)
+    members = max(1, int(books * MEMBERS_PER_BOOK))
+    now = datetime.now().replace(microsecond=0)
+    copies = [0] + [rng.randint(1, 5) for _ in range(books)]
+
+    # A first pass over the (regenerated, not stored) transactions gives the
+    # copies on loan and the member balances the other tables must agree with
+    on_loan = [0] * (books + 1)
+    accounts = [[0.0, 0.0] for _ in range(members + 1)]
+    transactions = 0
+    for _, book_id, member_id, _, _, returned_on, total_charge, amount_paid in \
+            iter_transactions(seed, books, members, copies, now):
+        transactions += 1
+        if returned_on is None:
+            on_loan[book_id] += 1
+        else:
+            accounts[member_id][0] += total_charge - amount_paid
+            accounts[member_id][1] += amount_paid
+
+    def book_rows():
+        for book_id in range(1, books + 1):
+            isbn13 = f"978{book_id:010d}"
+            yield (book_id, ' '.join(rng.sample(WORDS, 3)).title(), rng.choice(AUTHORS),
+                   round(rng.uniform(1, 5), 2), isbn13[3:], isbn13, 'eng', rng.randint(50, 900),
+                   rng.randint(0, 100000), rng.randint(0, 5000),
+                   now.date() - timedelta(days=rng.randint(0, 365 * 70)), rng.choice(PUBLISHERS),
+                   copies[book_id], copies[book_id] - on_loan[book_id])
+
+    def member_rows():
+        for member_id in range(1, members + 1):
+            debt, spent = accounts[member_id]
+            yield (member_id, f"Member {member_id}", f"member{member_id}@example.com",
+                   f"{9000000000 + member_id}", debt, spent)
+
+    insert_batches(connection, BOOK_SQL, book_rows(), 'books')
+    insert_batches(connection, MEMBER_SQL, member_rows(), 'members')
+    insert_batches(connection, TRANSACTION_SQL, iter_transactions(seed, books, members, copies, now),
+                   'transactions')
+
+    start = time.monotonic()
+    rebuild_rollups(connection)
+    print(f"  {'rollups':<13} {'':>9} rebuilt in {time.monotonic() - start:.1f}s")
+    return books, members, transactions
+
+
+def table_counts(connection):
+    counts = {}
+    with connection.cursor() as cursor:
+        for table in ('books', 'members', 'transactions'):
+            cursor.execute(f"SELECT COUNT(*) AS n FROM {table}")
+            counts[table] = cursor.fetchone()['n']
+    return counts
+
+
+def reset(connection):
+    with connection.cursor() as cursor:
+        for table in TABLES:
+            cursor.execute(f"DELETE FROM {table}")
+    connection.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed a benchmark database with a synthetic library')
+    parser.add_argument('--config', help='ini file (default: $LIBRARY_CONFIG or config.ini)')
+    parser.add_argument('--size', choices=sorted(SIZES), default='10k', help='number of books')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reset', action='store_true', help='delete all existing books, members and transactions')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    connection = connect(config)
+    try:
+        if args.reset:
+            reset(connection)
+        elif any(table_counts(connection).values()):
+            print("The database is not empty; seed a dedicated database or pass --reset")
+            sys.exit(1)
+
+        print(f"Seeding {args.size} catalog (seed {args.seed})")
+        start = time.monotonic()
+        books, members, transactions = seed_library(connection, SIZES[args.size], args.seed)
+        print(f"{books} books, {members} members, {transactions} transactions "
+              f"in {time.monotonic() - start:.1f}s")
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
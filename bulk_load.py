@@ -0,0 +1,192 @@
+import csv
+import json
+import os
+
+from werkzeug.datastructures import MultiDict
+
+from importer import INSERT_BOOK_SQL
+
+
+# Bulk loading of a local catalog file.
+#
+# Records are streamed from a CSV file (header row with the AddBook field
+# names), an NDJSON file (one object per line) or a JSON array, validated in
+# chunks with the same WTForms rules as the Add Book form, and written with
+# batched executemany(). Invalid rows and ids that already exist are
+# per-row errors instead of stopping the load. Memory does not grow with the
+# file: only the first MAX_ERRORS errors are kept in the result, every error
+# can be streamed to an ErrorFile, and loaded books are handed to a callback
+# chunk by chunk.
+
+BATCH_SIZE = 1000
+JSON_READ_SIZE = 64 * 1024
+MAX_ERRORS = 100
+
+BOOK_FIELDS = ('id', 'title', 'author', 'average_rating', 'isbn', 'isbn13', 'language_code', 'num_pages',
+               'ratings_count', 'text_reviews_count', 'publication_date', 'publisher', 'total_quantity')
+
+
+class LoadResult:
+    def __init__(self):
+        self.read = 0
+        self.loaded = 0
+        self.rejected = 0
+        # The first MAX_ERRORS rejected rows
+        self.errors = []
+
+    def reject(self, error):
+        self.rejected += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(error)
+
+
+def iter_json_array(f):
+    # Decodes the objects of a top-level JSON array one at a time
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if not started:
+            if not buffer and not eof:
+                data = f.read(JSON_READ_SIZE)
+                eof = not data
+                buffer += data
+                continue
+            if not buffer.startswith('['):
+                raise ValueError('Expected a JSON array')
+            buffer = buffer[1:]
+            started = True
+            continue
+        buffer = buffer.lstrip(', \t\r\n')
+        if buffer.startswith(']'):
+            return
+        try:
+            record, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            data = f.read(JSON_READ_SIZE)
+            eof = not data
+            buffer += data
+            continue
+        yield record
+        buffer = buffer[end:]
+
+
+def read_records(path):
+    # Yields (line or record number, record dict)
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='', encoding='utf-8') as f:
+        if extension == '.csv':
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+        elif extension in ('.jsonl', '.ndjson'):
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    yield number, json.loads(line)
+        elif extension == '.json':
+            for number, record in enumerate(iter_json_array(f), 1):
+                yield number, record
+        else:
+            raise ValueError(f'Unsupported file type: {extension}')
+
+
+class BulkLoader:
+    def __init__(self, connection, form_class, batch_size=BATCH_SIZE, dry_run=False):
+        self.connection = connection
+        self.form_class = form_class
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+
+    def validate(self, number, record):
+        # Returns (row, None) or (None, error)
+        formdata = MultiDict({key: '' if value is None else str(value) for key, value in record.items()})
+        form = self.form_class(formdata)
+        if not form.validate():
+            return None, {'row': number, 'id': record.get('id'), 'errors': form.errors}
+        try:
+            book_id = int(form.id.data)
+        except ValueError:
+            return None, {'row': number, 'id': record.get('id'), 'errors': {'id': ['Book ID must be a number']}}
+        row = [form.data[field] for field in BOOK_FIELDS]
+        row[0] = book_id
+        return row + [form.total_quantity.data], None
+
+    def load_chunk(self, cursor, chunk, seen, result, reject, loaded):
+        ids = [row[0] for _, row in chunk]
+        placeholders = ", ".join(["%s"] * len(ids))
+        cursor.execute(f"SELECT id FROM books WHERE id IN ({placeholders})", ids)
+        existing = {book['id'] for book in cursor.fetchall()}
+
+        rows = []
+        for number, row in chunk:
+            if row[0] in existing or row[0] in seen:
+                reject({'row': number, 'id': row[0], 'errors': {'id': ['Book with that ID already exists']}})
+                continue
+            seen.add(row[0])
+            rows.append(row)
+
+        if rows and not self.dry_run:
+            cursor.executemany(INSERT_BOOK_SQL, rows)
+            self.connection.commit()
+        result.loaded += len(rows)
+        if rows and loaded:
+            loaded([(row[0], row[1], row[2], row[11]) for row in rows])
+
+    def run(self, records, progress=None, errors=None, loaded=None):
+        # records yields (number, dict). progress(result) is called per
+        # chunk, errors(error) for every rejected row and loaded(books) with
+        # the (id, title, author, publisher) of every chunk written.
+        result = LoadResult()
+
+        def reject(error):
+            result.reject(error)
+            if errors:
+                errors(error)
+
+        seen = set()
+        chunk = []
+        with self.connection.cursor() as cursor:
+            for number, record in records:
+                result.read += 1
+                row, error = self.validate(number, record)
+                if error is not None:
+                    reject(error)
+                else:
+                    chunk.append((number, row))
+                if len(chunk) >= self.batch_size:
+                    self.load_chunk(cursor, chunk, seen, result, reject, loaded)
+                    chunk = []
+                    if progress:
+                        progress(result)
+            if chunk:
+                self.load_chunk(cursor, chunk, seen, result, reject, loaded)
+            if progress:
+                progress(result)
+        return result
+
+
+class ErrorFile:
+    # Writes rejected rows to a CSV file as they are found; pass it as
+    # BulkLoader.run(errors=...)
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(['row', 'id', 'field', 'error'])
+
+    def __call__(self, error):
+        for field, messages in error['errors'].items():
+            for message in messages:
+                self.writer.writerow([error['row'], error['id'], field, message])
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
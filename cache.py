@@ -0,0 +1,131 @@
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+# Caches with a per-entry time to live (ttl=None keeps entries until they are
+# evicted or deleted).
+#
+# LRUCache keeps entries in process memory and evicts the least recently used
+# one when full. RedisCache has the same interface on top of a Redis (or
+# Redis-compatible) server so several worker processes can share entries; the
+# `redis` package is only needed when it is used. Both count hits and misses.
+#
+# TableVersions keeps a version token per table in one of these caches for
+# ETags and cached page fragments. A shared one should not expire its
+# entries: every expiry is a new token, i.e. a version change nothing wrote,
+# and everything built on the old token is redone.
+
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, None if self.ttl is None else time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {'backend': 'memory', 'size': len(self._data), 'maxsize': self.maxsize,
+                'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache:
+    def __init__(self, url, ttl=60, prefix='library:'):
+        import redis
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key, default=None):
+        data = self._redis.get(self.prefix + str(key))
+        if data is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(data)
+
+    def set(self, key, value):
+        self._redis.set(self.prefix + str(key), pickle.dumps(value), ex=self.ttl)
+
+    def delete(self, key):
+        self._redis.delete(self.prefix + str(key))
+
+    def clear(self):
+        keys = list(self._redis.scan_iter(match=self.prefix + '*', count=1000))
+        if keys:
+            self._redis.delete(*keys)
+
+    def stats(self):
+        return {'backend': 'redis', 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
+
+
+class TableVersions:
+    # bump() gives a table a new random token rather than incrementing a
+    # counter, so it needs no atomic increment and a token lost to eviction or
+    # expiry is replaced by a fresh one: keys built from the tokens only ever
+    # miss, they never match a stale entry.
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get(self, table):
+        version = self.cache.get(table)
+        if version is None:
+            version = uuid.uuid4().hex[:16]
+            self.cache.set(table, version)
+        return version
+
+    def bump(self, *tables):
+        # Returns the new versions by table
+        versions = {}
+        for table in tables:
+            versions[table] = uuid.uuid4().hex[:16]
+            self.cache.set(table, versions[table])
+        return versions
+
+    def key(self, tables):
+        return '-'.join(self.get(table) for table in tables)
+
+
+def make_cache(redis_url=None, maxsize=1024, ttl=60, prefix='library:'):
+    if redis_url:
+        return RedisCache(redis_url, ttl=ttl, prefix=prefix)
+    return LRUCache(maxsize=maxsize, ttl=ttl)
@@ -0,0 +1,296 @@
+import bisect
+import sys
+import threading
+import time
+from array import array
+
+
+# Compact in-process snapshot of the catalog columns the listings and the
+# issue desk need: id, title, author, total and available quantity.
+#
+# Books are kept sorted by id in parallel typed arrays (4 bytes per number),
+# titles as UTF-8 in one bytearray addressed by offset and length, and
+# authors as indexes into a table of interned strings, so a book costs about
+# 22 bytes plus its title instead of a dict per row. A million books fit in
+# a few tens of MB; memory_usage() reports the actual footprint.
+#
+# The snapshot is loaded from the books table and then kept current by the
+# write paths of this process calling put()/remove(). Other processes' writes
+# are only picked up by a reload, so the snapshot is for reads that can be a
+# little stale (listings, availability hints); issuing a book still checks
+# availability in its own transaction. stale() tells when a reload is due:
+# the books table version the snapshot was loaded at has changed, or
+# `max_age` has passed.
+
+LOAD_CHUNK = 5000
+COLUMNS = ('id', 'title', 'author', 'total_quantity', 'available_quantity')
+
+
+class CatalogSnapshot:
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self.loaded = False
+        self.loaded_at = None
+        self.version = None
+        self._lock = threading.RLock()
+        self._refreshing = False
+        self._pending = None
+        self._set(self._empty())
+
+    @staticmethod
+    def _empty():
+        return {
+            'ids': array('i'),
+            'total': array('i'),
+            'available': array('i'),
+            'author': array('I'),
+            'title_start': array('I'),
+            'title_length': array('H'),
+            'titles': bytearray(),
+            'authors': [],
+            'author_ids': {},
+            'garbage': 0,
+        }
+
+    def _set(self, columns):
+        self._ids = columns['ids']
+        self._total = columns['total']
+        self._available = columns['available']
+        self._author = columns['author']
+        self._title_start = columns['title_start']
+        self._title_length = columns['title_length']
+        self._titles = columns['titles']
+        self._authors = columns['authors']
+        self._author_ids = columns['author_ids']
+        self._garbage = columns['garbage']
+
+    def __len__(self):
+        return len(self._ids)
+
+    # Loading
+
+    def load(self, rows, version=None):
+        # rows are (id, title, author, total, available) tuples or dicts with
+        # the COLUMNS keys, in ascending id order. Writes made while the rows
+        # are read are applied again on top of them.
+        with self._lock:
+            self._pending = []
+        columns = self._empty()
+        for row in rows:
+            self._append(columns, *self._values(row))
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._set(columns)
+            for book_id, row in pending:
+                if row is None:
+                    self._remove(book_id)
+                else:
+                    self._put(*row)
+            self.loaded = True
+            self.loaded_at = time.monotonic()
+            self.version = version
+            self._refreshing = False
+
+    def load_from_cursor(self, cursor, version=None):
+        cursor.execute(f"SELECT {', '.join(COLUMNS)} FROM books ORDER BY id")
+
+        def rows():
+            while True:
+                chunk = cursor.fetchmany(LOAD_CHUNK)
+                if not chunk:
+                    break
+                yield from chunk
+
+        self.load(rows(), version)
+
+    def load_once(self, load):
+        # Calls load() unless the snapshot is loaded; concurrent callers wait for
+        # the first one instead of loading again
+        with self._lock:
+            if not self.loaded:
+                load()
+
+    def invalidate(self):
+        # The next reader reloads the snapshot
+        with self._lock:
+            self.loaded = False
+
+    def stale(self, version):
+        return self.loaded and (version != self.version or (
+            self.max_age is not None and time.monotonic() - self.loaded_at > self.max_age))
+
+    def follow(self, previous, version):
+        # The books table went from `previous` to `version` through writes
+        # already applied here
+        with self._lock:
+            if self.version == previous:
+                self.version = version
+
+    def start_refresh(self):
+        # True for the one caller that should reload a stale snapshot
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+            return True
+
+    # Writes
+
+    def put(self, row):
+        values = self._values(row)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((values[0], values))
+            self._put(*values)
+
+    def remove(self, book_id):
+        book_id = int(book_id)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((book_id, None))
+            self._remove(book_id)
+
+    @staticmethod
+    def _values(row):
+        if isinstance(row, dict):
+            row = [row[column] for column in COLUMNS]
+        book_id, title, author, total, available = row
+        return int(book_id), title or '', author or '', int(total or 0), int(available or 0)
+
+    @staticmethod
+    def _intern(columns, author):
+        author_id = columns['author_ids'].get(author)
+        if author_id is None:
+            author_id = columns['author_ids'][sys.intern(author)] = len(columns['authors'])
+            columns['authors'].append(author)
+        return author_id
+
+    @classmethod
+    def _append(cls, columns, book_id, title, author, total, available):
+        encoded = title.encode('utf-8')
+        columns['ids'].append(book_id)
+        columns['total'].append(total)
+        columns['available'].append(available)
+        columns['author'].append(cls._intern(columns, author))
+        columns['title_start'].append(len(columns['titles']))
+        columns['title_length'].append(len(encoded))
+        columns['titles'] += encoded
+
+    def _columns(self):
+        return {
+            'ids': self._ids, 'total': self._total, 'available': self._available,
+            'author': self._author, 'title_start': self._title_start, 'title_length': self._title_length,
+            'titles': self._titles, 'authors': self._authors, 'author_ids': self._author_ids,
+            'garbage': self._garbage,
+        }
+
+    def _put(self, book_id, title, author, total, available):
+        columns = self._columns()
+        i = bisect.bisect_left(self._ids, book_id)
+        encoded = title.encode('utf-8')
+        if i < len(self._ids) and self._ids[i] == book_id:
+            self._total[i] = total
+            self._available[i] = available
+            self._author[i] = self._intern(columns, author)
+            if self._title(i) != title:
+                self._garbage += self._title_length[i]
+                self._title_start[i] = len(self._titles)
+                self._title_length[i] = len(encoded)
+                self._titles += encoded
+        else:
+            self._ids.insert(i, book_id)
+            self._total.insert(i, total)
+            self._available.insert(i, available)
+            self._author.insert(i, self._intern(columns, author))
+            self._title_start.insert(i, len(self._titles))
+            self._title_length.insert(i, len(encoded))
+            self._titles += encoded
+        self._compact_if_needed()
+
+    def _remove(self, book_id):
+        i = bisect.bisect_left(self._ids, book_id)
+        if i == len(self._ids) or self._ids[i] != book_id:
+            return
+        self._garbage += self._title_length[i]
+        for column in (self._ids, self._total, self._available, self._author,
+                       self._title_start, self._title_length):
+            del column[i]
+        self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        # Replaced and deleted titles leave their bytes behind; rewrite the
+        # title buffer once they are half of it
+        if self._garbage * 2 <= len(self._titles):
+            return
+        titles = bytearray()
+        starts = array('I')
+        for start, length in zip(self._title_start, self._title_length):
+            starts.append(len(titles))
+            titles += self._titles[start:start + length]
+        self._titles = titles
+        self._title_start = starts
+        self._garbage = 0
+
+    # Reads
+
+    def _title(self, i):
+        start = self._title_start[i]
+        return self._titles[start:start + self._title_length[i]].decode('utf-8')
+
+    def _row(self, i):
+        return {
+            'id': self._ids[i],
+            'title': self._title(i),
+            'author': self._authors[self._author[i]],
+            'total_quantity': self._total[i],
+            'available_quantity': self._available[i],
+        }
+
+    def get(self, book_id):
+        with self._lock:
+            i = bisect.bisect_left(self._ids, int(book_id))
+            if i < len(self._ids) and self._ids[i] == int(book_id):
+                return self._row(i)
+            return None
+
+    def availability(self, book_id):
+        # (total, available) or None for an unknown book
+        with self._lock:
+            i = bisect.bisect_left(self._ids, int(book_id))
+            if i < len(self._ids) and self._ids[i] == int(book_id):
+                return self._total[i], self._available[i]
+            return None
+
+    def page(self, after=None, before=None, limit=50):
+        # Same rows as app.fetch_books_page sorted by id
+        with self._lock:
+            if before is not None:
+                end = bisect.bisect_left(self._ids, before)
+                start = max(0, end - limit)
+            else:
+                start = 0 if after is None else bisect.bisect_right(self._ids, after)
+                end = min(len(self._ids), start + limit)
+            return [self._row(i) for i in range(start, end)]
+
+    def memory_usage(self):
+        # Bytes held by the snapshot, by part
+        with self._lock:
+            arrays = (self._ids, self._total, self._available, self._author,
+                      self._title_start, self._title_length)
+            usage = {
+                'columns': sum(sys.getsizeof(column) for column in arrays),
+                'titles': sys.getsizeof(self._titles),
+                'authors': (sys.getsizeof(self._authors) + sys.getsizeof(self._author_ids)
+                            + sum(sys.getsizeof(author) for author in self._authors)),
+            }
+        usage['total'] = sum(usage.values())
+        return usage
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'books': len(self),
+            'authors': len(self._authors),
+            'age': round(time.monotonic() - self.loaded_at, 1) if self.loaded else None,
+            'bytes': self.memory_usage(),
+        }
@@ -0,0 +1,288 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+import MySQLdb
+
+from rollups import record_issue, record_return
+
+
+# Issue and return of books, and the hold queue.
+#
+# Both paths run as one database transaction built from conditional updates,
+# so concurrent counters can neither oversell copies nor lose debt updates:
+#
+# - issuing decrements `available_quantity` only `WHERE available_quantity > 0`
+#   and treats "no row updated" as "no copy left";
+# - returning locks the single loan row (SELECT ... FOR UPDATE) because the
+#   charge depends on it, marks it returned only if it is still open, and adds
+#   the debt to the member only if the result stays under the debt limit.
+#
+# The borrowing rollups (rollups.py) are updated in the same transaction.
+#
+# Holds: a member can place a hold on a book with no copy available. Waiting
+# holds form a FIFO queue per book (idx_holds_queue). Whenever a copy comes
+# back (a return, or a ready hold cancelled) it is first made available and
+# then, in the same transaction, given to the oldest waiting hold if there is
+# one: the hold becomes ready and the copy is set aside for that member, so
+# the next issue of the book to them takes it. Both placing a hold and giving
+# a copy back lock the book row first, so a hold can never wait while a copy
+# sits on the shelf.
+#
+# Deadlocks and lock wait timeouts roll the transaction back and retry it.
+
+DEBT_LIMIT = 500
+MAX_RETRIES = 5
+RETRY_BACKOFF = 0.01
+
+# MySQL error codes for which the whole transaction can simply be retried
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_LOCK_DEADLOCK = 1213
+RETRYABLE_ERRORS = (ER_LOCK_WAIT_TIMEOUT, ER_LOCK_DEADLOCK)
+
+# Hold statuses; waiting and ready holds are active
+WAITING = 'waiting'
+READY = 'ready'
+FULFILLED = 'fulfilled'
+CANCELLED = 'cancelled'
+EXPIRED = 'expired'
+
+
+class CirculationError(Exception):
+    pass
+
+
+class NotFound(CirculationError):
+    pass
+
+
+class BookUnavailable(CirculationError):
+    pass
+
+
+class AlreadyReturned(CirculationError):
+    pass
+
+
+class DebtLimitExceeded(CirculationError):
+    pass
+
+
+class BookAvailable(CirculationError):
+    pass
+
+
+class HoldExists(CirculationError):
+    pass
+
+
+class HoldClosed(CirculationError):
+    pass
+
+
+def run_transaction(connection, fn, *args, retries=MAX_RETRIES):
+    # Runs fn(cursor, *args) and commits; retries on deadlock with jittered
+    # exponential backoff. Any other error rolls back and propagates.
+    attempt = 0
+    while True:
+        cursor = connection.cursor()
+        try:
+            result = fn(cursor, *args)
+            connection.commit()
+            return result
+        except MySQLdb.OperationalError as e:
+            connection.rollback()
+            if not e.args or e.args[0] not in RETRYABLE_ERRORS or attempt >= retries:
+                raise
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+        time.sleep(RETRY_BACKOFF * (2 ** attempt) * random.random())
+        attempt += 1
+
+
+def loan_charge(transaction, now=None):
+    # Returns (days rented, total charge) for an open loan
+    now = now or datetime.now()
+    days = (now - transaction['borrowed_on']).days
+    return days, days * transaction['per_day_fee']
+
+
+def _active_hold(cursor, book_id, member_id):
+    cursor.execute("SELECT id, status FROM holds WHERE book_id=%s AND member_id=%s AND status IN (%s, %s)",
+                   [book_id, member_id, WAITING, READY])
+    return cursor.fetchone()
+
+
+def _issue(cursor, book_id, member_id, per_day_fee, now):
+    cursor.execute("SELECT id FROM members WHERE id=%s", [member_id])
+    if not cursor.fetchone():
+        raise NotFound('This Member Does Not Exist')
+
+    # A ready hold is the copy set aside for this member
+    hold = _active_hold(cursor, book_id, member_id)
+    if not (hold and hold['status'] == READY and cursor.execute(
+            "UPDATE holds SET status=%s, closed_on=%s WHERE id=%s AND status=%s",
+            [FULFILLED, now, hold['id'], READY])):
+        updated = cursor.execute(
+            "UPDATE books SET available_quantity=available_quantity-1 WHERE id=%s AND available_quantity > 0",
+            [book_id])
+        if not updated:
+            cursor.execute("SELECT id FROM books WHERE id=%s", [book_id])
+            if not cursor.fetchone():
+                raise NotFound('This Book Does Not Exist')
+            raise BookUnavailable('No copies of this book are available to be rented')
+        if hold:
+            cursor.execute("UPDATE holds SET status=%s, closed_on=%s WHERE id=%s AND status=%s",
+                           [FULFILLED, now, hold['id'], WAITING])
+
+    cursor.execute("INSERT INTO transactions (book_id, member_id, per_day_fee, borrowed_on) VALUES (%s, %s, %s, %s)",
+                   [book_id, member_id, per_day_fee, now])
+    transaction_id = cursor.lastrowid
+    record_issue(cursor, book_id, member_id, now)
+    return transaction_id
+
+
+def issue_book(connection, book_id, member_id, per_day_fee, now=None):
+    # Returns the id of the new transaction
+    now = (now or datetime.now()).replace(microsecond=0)
+    return run_transaction(connection, _issue, book_id, member_id, per_day_fee, now)
+
+
+def _return(cursor, transaction_id, amount_paid, now):
+    cursor.execute("SELECT * FROM transactions WHERE id=%s FOR UPDATE", [transaction_id])
+    transaction = cursor.fetchone()
+    if not transaction:
+        raise NotFound('This Transaction Does Not Exist')
+    if transaction['returned_on'] is not None:
+        raise AlreadyReturned('This book has already been returned')
+
+    _, total_charge = loan_charge(transaction, now)
+    transaction_debt = total_charge - amount_paid
+
+    updated = cursor.execute(
+        "UPDATE members SET outstanding_debt=COALESCE(outstanding_debt, 0)+%s, "
+        "amount_spent=COALESCE(amount_spent, 0)+%s "
+        "WHERE id=%s AND COALESCE(outstanding_debt, 0)+%s < %s",
+        [transaction_debt, amount_paid, transaction['member_id'], transaction_debt, DEBT_LIMIT])
+    if not updated:
+        # MySQL also reports 0 rows when nothing changed (a free, unpaid loan)
+        cursor.execute("SELECT outstanding_debt FROM members WHERE id=%s", [transaction['member_id']])
+        member = cursor.fetchone()
+        if member and (member['outstanding_debt'] or 0) + transaction_debt >= DEBT_LIMIT:
+            raise DebtLimitExceeded(f'Outstanding Debt Cannot Exceed Rs.{DEBT_LIMIT}')
+
+    cursor.execute("UPDATE transactions SET returned_on=%s, total_charge=%s, amount_paid=%s WHERE id=%s",
+                   [now, total_charge, amount_paid, transaction_id])
+    record_return(cursor, transaction, total_charge, amount_paid, now)
+    return dict(transaction, hold=_release_copy(cursor, transaction['book_id'], now))
+
+
+def return_book(connection, transaction_id, amount_paid, now=None):
+    # Returns the transaction row as it was before the return, with `hold`
+    # set to the hold the copy was set aside for (or None)
+    return run_transaction(connection, _return, transaction_id, amount_paid, now or datetime.now())
+
+
+def _release_copy(cursor, book_id, now):
+    # Puts a copy back and hands it to the oldest waiting hold, if any;
+    # returns that hold
+    cursor.execute("UPDATE books SET available_quantity=available_quantity+1 WHERE id=%s", [book_id])
+    cursor.execute("SELECT id, member_id FROM holds WHERE book_id=%s AND status=%s ORDER BY id LIMIT 1 FOR UPDATE",
+                   [book_id, WAITING])
+    hold = cursor.fetchone()
+    if hold:
+        cursor.execute("UPDATE books SET available_quantity=available_quantity-1 WHERE id=%s", [book_id])
+        cursor.execute("UPDATE holds SET status=%s, ready_on=%s WHERE id=%s", [READY, now, hold['id']])
+    return hold
+
+
+def _place_hold(cursor, book_id, member_id, now):
+    cursor.execute("SELECT id FROM members WHERE id=%s", [member_id])
+    if not cursor.fetchone():
+        raise NotFound('This Member Does Not Exist')
+    cursor.execute("SELECT available_quantity FROM books WHERE id=%s FOR UPDATE", [book_id])
+    book = cursor.fetchone()
+    if not book:
+        raise NotFound('This Book Does Not Exist')
+    if book['available_quantity'] > 0:
+        raise BookAvailable('Copies of this book are available, issue it instead')
+    if _active_hold(cursor, book_id, member_id):
+        raise HoldExists('This member already has a hold on this book')
+
+    cursor.execute("INSERT INTO holds (book_id, member_id, status, placed_on) VALUES (%s, %s, %s, %s)",
+                   [book_id, member_id, WAITING, now])
+    hold_id = cursor.lastrowid
+    cursor.execute("SELECT COUNT(*) AS position FROM holds WHERE book_id=%s AND status=%s AND id <= %s",
+                   [book_id, WAITING, hold_id])
+    return hold_id, cursor.fetchone()['position']
+
+
+def place_hold(connection, book_id, member_id, now=None):
+    # Returns (hold id, position in the book's queue)
+    now = (now or datetime.now()).replace(microsecond=0)
+    return run_transaction(connection, _place_hold, book_id, member_id, now)
+
+
+def _close_hold(cursor, hold_id, status, now):
+    cursor.execute("SELECT * FROM holds WHERE id=%s", [hold_id])
+    hold = cursor.fetchone()
+    if not hold:
+        raise NotFound('This Hold Does Not Exist')
+    if hold['status'] not in (WAITING, READY):
+        raise HoldClosed('This hold is no longer active')
+    if hold['status'] == READY:
+        # Book row first, in the same order as returns
+        cursor.execute("SELECT id FROM books WHERE id=%s FOR UPDATE", [hold['book_id']])
+
+    updated = cursor.execute("UPDATE holds SET status=%s, closed_on=%s WHERE id=%s AND status=%s",
+                             [status, now, hold_id, hold['status']])
+    if not updated:
+        raise HoldClosed('This hold is no longer active')
+    next_hold = _release_copy(cursor, hold['book_id'], now) if hold['status'] == READY else None
+    return dict(hold, next_hold=next_hold)
+
+
+def cancel_hold(connection, hold_id, now=None):
+    # Returns the hold as it was, with `next_hold` set to the hold its
+    # set-aside copy went to (or None)
+    now = (now or datetime.now()).replace(microsecond=0)
+    return run_transaction(connection, _close_hold, hold_id, CANCELLED, now)
+
+
+def expire_holds(connection, pickup_days, now=None):
+    # Closes ready holds not picked up within pickup_days; returns how many
+    now = (now or datetime.now()).replace(microsecond=0)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id FROM holds WHERE status=%s AND ready_on < %s",
+                       [READY, now - timedelta(days=pickup_days)])
+        hold_ids = [row['id'] for row in cursor.fetchall()]
+    expired = 0
+    for hold_id in hold_ids:
+        try:
+            run_transaction(connection, _close_hold, hold_id, EXPIRED, now)
+            expired += 1
+        except HoldClosed:
+            pass
+    return expired
+
+
+def active_holds(connection, member_id=None, limit=None):
+    # Ready holds (the hold shelf) first, then the waiting queue, oldest first
+    where = "h.status IN (%s, %s)"
+    args = [WAITING, READY]
+    if member_id is not None:
+        where += " AND h.member_id=%s"
+        args.append(member_id)
+    query = ("SELECT h.*, b.title, m.name FROM holds h "
+             "JOIN books b ON b.id = h.book_id JOIN members m ON m.id = h.member_id "
+             f"WHERE {where} ORDER BY h.status = %s, h.id")
+    args.append(WAITING)
+    if limit is not None:
+        query += " LIMIT %s"
+        args.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(query, args)
+        return cursor.fetchall()
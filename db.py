@@ -0,0 +1,355 @@
+import os
+import queue
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import MySQLdb
+import MySQLdb.cursors
+from flask import g
+
+
+# Pooled MySQL connections for the app.
+#
+# `Database` is a drop-in replacement for flask_mysqldb.MySQL: `db.connection`
+# is a connection checked out of a process-wide pool for the current app
+# context and handed back when the context ends, instead of a new connection
+# per request. `db.cursor()` is the context-managed cursor every route uses;
+# it always closes the cursor and rolls back if the block raises, and takes
+# an optional cursor class (e.g. SSCursor to stream a large result).
+# `db.session()` checks out a connection of its own for work that must not
+# share the app context's transaction, or runs outside of one. `db.connect()`
+# opens a connection outside of the pool, for a background thread that keeps
+# one for itself (the job store's saver) and must not wait for the pool.
+#
+# The pool is created on first use in each process. A process forked after
+# that (a pre-forking server such as gunicorn with preload_app) starts with
+# no pool: the parent's connections are dropped without closing them, since
+# closing a socket shared with the parent would end the parent's session.
+#
+# Functions in `db.query_listeners` are called as listener(query, seconds,
+# rows) after every statement run on `db.connection`; the connection is then
+# handed out wrapped in a TimedConnection.
+#
+# Configuration is read from app.config (MYSQL_HOST, MYSQL_USER, ... as
+# before, plus MYSQL_POOL_SIZE, MYSQL_POOL_TIMEOUT, MYSQL_POOL_RECYCLE and
+# MYSQL_POOL_PING_INTERVAL).
+#
+# `AsyncDatabase` is the aiomysql counterpart used by the ASGI entry point
+# (asgi.py). aiomysql is only imported when its pool is opened, so the WSGI
+# app does not need it installed. Its size is MYSQL_ASYNC_POOL_SIZE: requests
+# waiting for a connection wait on the event loop, not on a thread.
+
+POOL_SIZE = 5
+POOL_TIMEOUT = 10
+POOL_RECYCLE = 3600
+POOL_PING_INTERVAL = 30
+ASYNC_POOL_SIZE = 20
+
+
+class PoolExhausted(MySQLdb.OperationalError):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, connect_args, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 recycle=POOL_RECYCLE, ping_interval=POOL_PING_INTERVAL):
+        self.connect_args = connect_args
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        # LIFO so the most recently used (warm) connections are reused first
+        self._idle = queue.LifoQueue()
+        self._created_on = {}
+        self._last_used = {}
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def opened(self):
+        return self._opened
+
+    def _connect(self):
+        connection = MySQLdb.connect(**self.connect_args)
+        self._created_on[id(connection)] = self._last_used[id(connection)] = time.monotonic()
+        return connection
+
+    def _discard(self, connection):
+        with self._lock:
+            self._created_on.pop(id(connection), None)
+            self._last_used.pop(id(connection), None)
+            self._opened -= 1
+        try:
+            connection.close()
+        except MySQLdb.Error:
+            pass
+
+    def _healthy(self, connection):
+        now = time.monotonic()
+        if now - self._created_on[id(connection)] > self.recycle:
+            return False
+        if now - self._last_used[id(connection)] > self.ping_interval:
+            try:
+                connection.ping()
+            except MySQLdb.Error:
+                return False
+        return True
+
+    def acquire(self):
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                # Reserve a slot under the lock, connect outside of it
+                with self._lock:
+                    can_open = self._opened < self.size
+                    if can_open:
+                        self._opened += 1
+                if can_open:
+                    try:
+                        return self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._opened -= 1
+                        raise
+                try:
+                    connection = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise PoolExhausted(f'No database connection available after {self.timeout}s')
+
+            if self._healthy(connection):
+                return connection
+            self._discard(connection)
+
+    def release(self, connection):
+        # Uncommitted work is rolled back so the next user starts clean
+        try:
+            connection.rollback()
+        except MySQLdb.Error:
+            self._discard(connection)
+            return
+        self._last_used[id(connection)] = time.monotonic()
+        self._idle.put(connection)
+
+    def close(self):
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(connection)
+
+
+class TimedCursor:
+    def __init__(self, cursor, listeners):
+        self._cursor = cursor
+        self._listeners = listeners
+
+    def _timed(self, method, query, args):
+        start = time.perf_counter()
+        try:
+            return method(query, args)
+        finally:
+            seconds = time.perf_counter() - start
+            rows = max(self._cursor.rowcount or 0, 0)
+            for listener in self._listeners:
+                listener(query, seconds, rows)
+
+    def execute(self, query, args=None):
+        return self._timed(self._cursor.execute, query, args)
+
+    def executemany(self, query, args):
+        return self._timed(self._cursor.executemany, query, args)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._cursor.close()
+
+
+class TimedConnection:
+    def __init__(self, connection, listeners):
+        self.raw = connection
+        self._listeners = listeners
+
+    def cursor(self, *args):
+        return TimedCursor(self.raw.cursor(*args), self._listeners)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class Database:
+    def __init__(self, app=None):
+        self.app = None
+        self.pool = None
+        self.query_listeners = []
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+        if app is not None:
+            self.init_app(app)
+
+    def _after_fork(self):
+        self.pool = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        app.teardown_appcontext(self.teardown)
+
+    def connect_args(self):
+        config = self.app.config
+        return {
+            'host': config['MYSQL_HOST'],
+            'user': config['MYSQL_USER'],
+            'passwd': config['MYSQL_PASSWORD'],
+            'port': config['MYSQL_PORT'],
+            'db': config['MYSQL_DB'],
+            'charset': config.get('MYSQL_CHARSET', 'utf8'),
+            'use_unicode': True,
+            'cursorclass': getattr(MySQLdb.cursors, config.get('MYSQL_CURSORCLASS', 'DictCursor')),
+        }
+
+    def create_pool(self):
+        config = self.app.config
+        return ConnectionPool(
+            self.connect_args(),
+            size=config.get('MYSQL_POOL_SIZE', POOL_SIZE),
+            timeout=config.get('MYSQL_POOL_TIMEOUT', POOL_TIMEOUT),
+            recycle=config.get('MYSQL_POOL_RECYCLE', POOL_RECYCLE),
+            ping_interval=config.get('MYSQL_POOL_PING_INTERVAL', POOL_PING_INTERVAL),
+        )
+
+    def connect(self):
+        # The caller closes the connection
+        return MySQLdb.connect(**self.connect_args())
+
+    def get_pool(self):
+        if self.pool is None:
+            with self._lock:
+                if self.pool is None:
+                    self.pool = self.create_pool()
+        return self.pool
+
+    @property
+    def connection(self):
+        if 'db_connection' not in g:
+            connection = self.get_pool().acquire()
+            if self.query_listeners:
+                connection = TimedConnection(connection, self.query_listeners)
+            g.db_connection = connection
+        return g.db_connection
+
+    @contextmanager
+    def cursor(self, cursorclass=None):
+        cursor = self.connection.cursor(*([cursorclass] if cursorclass else []))
+        try:
+            yield cursor
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def session(self):
+        pool = self.get_pool()
+        connection = pool.acquire()
+        try:
+            yield connection
+        finally:
+            pool.release(connection)
+
+    def teardown(self, exception):
+        connection = g.pop('db_connection', None)
+        if isinstance(connection, TimedConnection):
+            connection = connection.raw
+        if connection is not None:
+            self.pool.release(connection)
+
+
+class AsyncTimedCursor:
+    def __init__(self, cursor, listeners):
+        self._cursor = cursor
+        self._listeners = listeners
+
+    async def _timed(self, method, query, args):
+        start = time.perf_counter()
+        try:
+            return await method(query, args)
+        finally:
+            seconds = time.perf_counter() - start
+            rows = max(self._cursor.rowcount or 0, 0)
+            for listener in self._listeners:
+                listener(query, seconds, rows)
+
+    async def execute(self, query, args=None):
+        return await self._timed(self._cursor.execute, query, args)
+
+    async def executemany(self, query, args):
+        return await self._timed(self._cursor.executemany, query, args)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class AsyncDatabase:
+    def __init__(self, config):
+        self.config = config
+        self.pool = None
+        self.query_listeners = []
+
+    async def open(self):
+        import aiomysql
+
+        config = self.config
+        self.pool = await aiomysql.create_pool(
+            host=config['MYSQL_HOST'],
+            user=config['MYSQL_USER'],
+            password=config['MYSQL_PASSWORD'],
+            port=config['MYSQL_PORT'],
+            db=config['MYSQL_DB'],
+            charset=config.get('MYSQL_CHARSET', 'utf8'),
+            cursorclass=aiomysql.DictCursor,
+            autocommit=False,
+            minsize=1,
+            maxsize=config.get('MYSQL_ASYNC_POOL_SIZE', ASYNC_POOL_SIZE),
+            pool_recycle=config.get('MYSQL_POOL_RECYCLE', POOL_RECYCLE),
+        )
+
+    async def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
+
+    @asynccontextmanager
+    async def connection(self):
+        # Uncommitted work is rolled back when the connection goes back
+        async with self.pool.acquire() as connection:
+            try:
+                yield connection
+            finally:
+                await connection.rollback()
+
+    @asynccontextmanager
+    async def cursor(self, connection=None):
+        if connection is None:
+            async with self.connection() as connection:
+                async with self.cursor(connection) as cursor:
+                    yield cursor
+            return
+        cursor = await connection.cursor()
+        try:
+            yield AsyncTimedCursor(cursor, self.query_listeners)
+        finally:
+            await cursor.close()
@@ -0,0 +1,92 @@
+import csv
+import io
+import json
+import zlib
+
+import MySQLdb.cursors
+
+
+# Streaming table exports.
+#
+# Rows are read through an unbuffered server-side cursor (SSCursor) and
+# encoded to CSV or NDJSON one row at a time, so memory stays constant no
+# matter how large the table is. Output is handed out in ~64KB chunks,
+# optionally gzip-compressed on the fly.
+
+EXPORT_TABLES = ('books', 'members', 'transactions', 'transactions_archive')
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+FETCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_rows(connection, table):
+    # Yields the column names first, then every row as a tuple
+    if table not in EXPORT_TABLES:
+        raise ValueError(f'Unknown table: {table}')
+    cursor = connection.cursor(MySQLdb.cursors.SSCursor)
+    try:
+        cursor.execute(f"SELECT * FROM {table} ORDER BY id")
+        yield [column[0] for column in cursor.description]
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def encode_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def encode_ndjson(rows):
+    columns = next(rows, None)
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), default=str) + '\n'
+
+
+ENCODERS = {
+    'csv': encode_csv,
+    'ndjson': encode_ndjson,
+}
+
+
+def export_table(connection, table, fmt='csv', compress=False):
+    # Yields the encoded (and optionally gzipped) table in chunks of bytes
+    if fmt not in ENCODERS:
+        raise ValueError(f'Unknown format: {fmt}')
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    pending = []
+    size = 0
+    for text in ENCODERS[fmt](iter_rows(connection, table)):
+        data = text.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= CHUNK_SIZE:
+            chunk = b''.join(pending)
+            pending, size = [], 0
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+
+    chunk = b''.join(pending)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def export_filename(table, fmt, compress=False):
+    return f"{table}.{fmt}" + ('.gz' if compress else '')
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+
+# Nightly fee accrual for open loans.
+#
+# One set-based pass computes the days out, the accrued charge and the
+# overdue flag of every open transaction inside MySQL and upserts them into
+# the loan_fees summary table, walking the open loans in id ranges so no
+# single statement holds locks on the whole table. Rows of loans that were
+# returned since the previous run are removed at the end.
+
+LOAN_DAYS = 14
+CHUNK_SIZE = 50000
+
+UPSERT_FEES_SQL = (
+    "INSERT INTO loan_fees (transaction_id, member_id, book_id, days_out, accrued_charge, overdue, computed_on) "
+    "SELECT id, member_id, book_id, "
+    "TIMESTAMPDIFF(DAY, borrowed_on, %s), "
+    "TIMESTAMPDIFF(DAY, borrowed_on, %s) * per_day_fee, "
+    "TIMESTAMPDIFF(DAY, borrowed_on, %s) > %s, "
+    "%s "
+    "FROM transactions "
+    "WHERE returned_on IS NULL AND id > %s AND id <= %s "
+    "ON DUPLICATE KEY UPDATE days_out=VALUES(days_out), accrued_charge=VALUES(accrued_charge), "
+    "overdue=VALUES(overdue), computed_on=VALUES(computed_on)"
+)
+
+
+def compute_fees(connection, now=None, loan_days=LOAN_DAYS, chunk_size=CHUNK_SIZE, progress=None):
+    # Returns the number of open loans in loan_fees; progress(done, total)
+    # is called with transaction ids after every chunk.
+    now = (now or datetime.now()).replace(microsecond=0)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT MIN(id) AS first_id, MAX(id) AS last_id FROM transactions WHERE returned_on IS NULL")
+        bounds = cursor.fetchone()
+
+        if bounds['first_id'] is not None:
+            start = bounds['first_id'] - 1
+            while start < bounds['last_id']:
+                end = start + chunk_size
+                cursor.execute(UPSERT_FEES_SQL, [now, now, now, loan_days, now, start, end])
+                connection.commit()
+                if progress:
+                    progress(min(end, bounds['last_id']), bounds['last_id'])
+                start = end
+
+        cursor.execute("DELETE FROM loan_fees WHERE computed_on < %s", [now])
+        cursor.execute("SELECT COUNT(*) AS loans FROM loan_fees")
+        loans = cursor.fetchone()['loans']
+        connection.commit()
+    return loans
+
+
+def fee_summary(connection, limit=100):
+    # Library-wide totals and the members with the highest accrued charges
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) AS loans, COALESCE(SUM(overdue), 0) AS overdue, "
+            "COALESCE(SUM(accrued_charge), 0) AS accrued_charge, MAX(computed_on) AS computed_on FROM loan_fees")
+        totals = cursor.fetchone()
+        cursor.execute(
+            "SELECT member_id, COUNT(*) AS loans, SUM(overdue) AS overdue, SUM(accrued_charge) AS accrued_charge "
+            "FROM loan_fees GROUP BY member_id ORDER BY accrued_charge DESC LIMIT %s", [limit])
+        members = cursor.fetchall()
+    return totals, members
+
+
+def member_fees(connection, member_id):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT * FROM loan_fees WHERE member_id=%s ORDER BY transaction_id", [member_id])
+        return cursor.fetchall()
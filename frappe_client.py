@@ -0,0 +1,279 @@
+import asyncio
+import email.utils
+import hashlib
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+
+# Client for the frappe-library catalog API used by the book importers.
+#
+# Every page request has separate connect and read timeouts. Connection
+# errors, timeouts, 429/5xx responses and bodies that are not a JSON page
+# are retried with exponential backoff and full jitter, honouring
+# Retry-After; other 4xx responses fail at once. A page that still fails
+# raises FrappeError. Requests take a token from a TokenBucket first, which
+# is shared by all import workers of a process so concurrent imports stay
+# under one rate limit. Successful pages can be kept in a ResponseCache on
+# disk, keyed by URL and query parameters, so re-running an import reads the
+# pages it has already fetched from disk. Empty pages are not kept: the page
+# past the end of the catalog fills up as books are added, and a cached empty
+# one would end every import there until it expired. Expired entries are deleted when
+# read, and by a sweep of the directory every SWEEP_INTERVAL seconds; the
+# async client does the cache's file I/O on a thread.
+#
+# FrappeClient uses a requests.Session and AsyncFrappeClient an
+# httpx.AsyncClient (ASGI mode); both are passed in by the caller.
+# benchmarks/fake_frappe.py serves a local copy of the API and can inject
+# latency, errors and rate limiting.
+
+FRAPPE_LIBRARY_URL = 'https://frappe.io/api/method/frappe-library'
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+RETRIES = 4
+BACKOFF = 0.5
+MAX_BACKOFF = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+CACHE_TTL = 24 * 3600
+SWEEP_INTERVAL = 3600
+
+log = logging.getLogger('library.import')
+
+
+class FrappeError(Exception):
+    pass
+
+
+class RetryableError(FrappeError):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    # `rate` requests per second on average with bursts of up to `burst`;
+    # rate=None never waits
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        # Takes a token and returns how long to wait before using it
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class ResponseCache:
+    # One JSON file per response under `directory`, valid for `ttl` seconds
+    def __init__(self, directory, ttl=CACHE_TTL, sweep_interval=SWEEP_INTERVAL):
+        self.directory = directory
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.hits = 0
+        self.misses = 0
+        self.swept_at = None
+        self._lock = threading.Lock()
+
+    def path(self, url, params):
+        key = json.dumps([url, sorted((str(k), str(v)) for k, v in params.items())])
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + '.json')
+
+    def get(self, url, params):
+        path = self.path(url, params)
+        try:
+            if time.time() - os.path.getmtime(path) <= self.ttl:
+                with open(path, encoding='utf-8') as f:
+                    value = json.load(f)
+                with self._lock:
+                    self.hits += 1
+                return value
+            os.remove(path)
+        except (OSError, ValueError):
+            pass
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def sweep(self):
+        # Deletes expired entries and temporary files left by failed writes;
+        # returns how many files were removed
+        self.swept_at = time.monotonic()
+        removed = 0
+        cutoff = time.time() - self.ttl
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return 0
+        for entry in entries:
+            if not entry.name.endswith(('.json', '.tmp')):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def set(self, url, params, value):
+        # A response that cannot be written is only logged
+        if self.swept_at is None or time.monotonic() - self.swept_at > self.sweep_interval:
+            self.sweep()
+        tmp = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            os.replace(tmp, self.path(url, params))
+        except OSError:
+            log.warning('import_cache_write_failed', exc_info=True, extra={'fields': {'directory': self.directory}})
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+
+    def stats(self):
+        return {'backend': 'disk', 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
+
+
+def retry_after_seconds(value):
+    # Retry-After is either seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def page_books(status, headers, body):
+    # The books of a response body, or RetryableError / FrappeError
+    if status in RETRY_STATUSES:
+        raise RetryableError(f"HTTP {status}", retry_after_seconds(headers.get('Retry-After')))
+    if status >= 400:
+        raise FrappeError(f"HTTP {status}")
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise RetryableError("response is not JSON")
+    books = payload.get('message') if isinstance(payload, dict) else None
+    if books is None:
+        return []
+    if not isinstance(books, list) or not all(isinstance(book, dict) for book in books):
+        raise RetryableError("unexpected response shape")
+    return books
+
+
+class FrappeClient:
+    def __init__(self, session, base_url=FRAPPE_LIBRARY_URL, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, retries=RETRIES, backoff=BACKOFF, max_backoff=MAX_BACKOFF,
+                 limiter=None, cache=None):
+        self.session = session
+        self.base_url = base_url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = limiter or TokenBucket()
+        self.cache = cache
+
+    @staticmethod
+    def params(page, title=None, author=None):
+        return {'page': page, 'title': title or '', 'author': author or ''}
+
+    def delay(self, attempt, error):
+        if error.retry_after is not None:
+            return min(error.retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def failed(self, page, attempt, error):
+        # Returns how long to wait before the next attempt, or raises
+        fields = {'page': page, 'attempt': attempt + 1, 'error': str(error)}
+        if not isinstance(error, RetryableError) or attempt >= self.retries:
+            log.error('import_page_failed', extra={'fields': fields})
+            raise FrappeError(f"page {page}: {error} after {attempt + 1} attempts") from error
+        log.warning('import_page_retry', extra={'fields': fields})
+        return self.delay(attempt, error)
+
+    def fetch_page(self, page, title=None, author=None):
+        import requests
+
+        params = self.params(page, title, author)
+        if self.cache is not None:
+            books = self.cache.get(self.base_url, params)
+            if books is not None:
+                return books
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                r = self.session.get(self.base_url, params=params,
+                                     timeout=(self.connect_timeout, self.read_timeout))
+                books = page_books(r.status_code, r.headers, r.content)
+                break
+            except requests.RequestException as e:
+                error = RetryableError(f"{type(e).__name__}: {e}")
+            except FrappeError as e:
+                error = e
+            time.sleep(self.failed(page, attempt, error))
+            attempt += 1
+        if self.cache is not None and books:
+            self.cache.set(self.base_url, params, books)
+        return books
+
+
+class AsyncFrappeClient(FrappeClient):
+    # FrappeClient on an httpx.AsyncClient; the client's own timeout is
+    # replaced by connect_timeout/read_timeout
+    async def fetch_page(self, page, title=None, author=None):
+        import httpx
+
+        params = self.params(page, title, author)
+        if self.cache is not None:
+            books = await asyncio.to_thread(self.cache.get, self.base_url, params)
+            if books is not None:
+                return books
+        timeout = httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+        attempt = 0
+        while True:
+            await self.limiter.acquire_async()
+            try:
+                r = await self.session.get(self.base_url, params=params, timeout=timeout)
+                books = page_books(r.status_code, r.headers, r.content)
+                break
+            except httpx.HTTPError as e:
+                error = RetryableError(f"{type(e).__name__}: {e}")
+            except FrappeError as e:
+                error = e
+            await asyncio.sleep(self.failed(page, attempt, error))
+            attempt += 1
+        if self.cache is not None and books:
+            await asyncio.to_thread(self.cache.set, self.base_url, params, books)
+        return books
@@ -0,0 +1,52 @@
+import multiprocessing
+
+from settings import load_config
+
+
+# gunicorn settings: `gunicorn -c gunicorn.conf.py` from the repository root.
+#
+# The app is imported once in the master (preload_app) and each worker is
+# forked from it, sharing the loaded code copy-on-write; database pools and
+# job threads are created per worker on first use. Each worker serves
+# `threads` requests at a time; the default [database] pool_size covers
+# them, the job workers and the background reloads. Settings come from the [server] section of config.ini or
+# LIBRARY_SERVER_* environment variables.
+#
+# 2 * CPUs + 1 workers by default. Job progress is in the database. Set
+# [cache] redis_url to share the table versions and the record and fragment
+# caches: a write in one worker then makes the others reload their search
+# index and catalog snapshot and drop their lookup entries on their next
+# read. Without it each worker only catches up with the others' writes after
+# [cache] ttl or [search] / [catalog] max_age, and a warning is logged at
+# startup. The [import] rate limit applies per worker. A worker is not
+# recycled (max_requests, off by default) while it runs background jobs,
+# since that would end them.
+
+config = load_config()
+
+wsgi_app = 'wsgi:application'
+bind = config.get('server', 'bind', fallback='0.0.0.0:8000')
+workers = config.getint('server', 'workers', fallback=multiprocessing.cpu_count() * 2 + 1)
+worker_class = 'gthread'
+threads = config.getint('server', 'threads', fallback=4)
+preload_app = True
+timeout = config.getint('server', 'timeout', fallback=30)
+graceful_timeout = timeout
+keepalive = 5
+# Set to recycle workers now and then so slow leaks cannot grow without bound
+max_requests = config.getint('server', 'max_requests', fallback=0)
+max_requests_jitter = max_requests // 10
+
+
+def pre_request(worker, req):
+    # Postpone the max_requests recycle while this worker runs jobs
+    import app as library
+
+    if library.jobs.active():
+        worker.max_requests = max(worker.max_requests, worker.nr + 2)
+
+
+def when_ready(server):
+    if server.cfg.workers > 1 and not config.get('cache', 'redis_url', fallback=None):
+        server.log.warning("%s workers without [cache] redis_url: each worker sees the others' writes only "
+                           "after its caches expire", server.cfg.workers)
@@ -0,0 +1,390 @@
+import asyncio
+import concurrent.futures
+import functools
+import math
+import re
+from datetime import date
+
+from frappe_client import FrappeClient, AsyncFrappeClient, FrappeError, FRAPPE_LIBRARY_URL
+
+
+# Bulk importer for the frappe-library catalog API.
+#
+# Pages are prefetched concurrently by a bounded thread pool sharing one
+# pooled requests.Session, so the import is limited by network parallelism
+# rather than by one round trip at a time. Requests go through a
+# FrappeClient (frappe_client.py: timeouts, retries, rate limit, response
+# cache); a page that cannot be fetched stops the import, keeping the books
+# written so far, and is reported in ImportResult.error.
+#
+# Each page is normalized as a whole by normalize_page() before it is
+# deduplicated: records become INSERT_BOOK_SQL rows checked against the books
+# columns, and records that do not fit are rejected with their reasons
+# (ImportResult.rejected) rather than failing an executemany() batch. Each page is deduplicated against
+# the books table with a single `WHERE id IN (...)` query and new books are
+# written with executemany() in batches.
+#
+# AsyncBookImporter does the same on an event loop for the ASGI mode
+# (asgi.py): pages come from an httpx.AsyncClient and rows go through an
+# AsyncDatabase (aiomysql), so an import holds no thread while it waits.
+# requests and httpx are only imported when an import runs.
+
+IMPORT_WORKERS = 4
+INSERT_BATCH_SIZE = 500
+# Rejected records kept with their reasons; the rest are only counted
+MAX_REJECTED = 100
+
+INSERT_BOOK_SQL = (
+    "INSERT INTO books (id, title, author, average_rating, isbn, isbn13, language_code, num_pages, "
+    "ratings_count, text_reviews_count, publication_date, publisher, total_quantity, available_quantity) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE id=id"
+)
+
+
+class ImportResult:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.repeated_book_ids = []
+        # Books another writer inserted between existing_ids() and the insert
+        self.raced = 0
+        self.imported_books = []
+        self.pages_fetched = 0
+        self.error = None
+        self.rejected = []
+
+    def reject(self, rejected):
+        self.failed += len(rejected)
+        self.rejected.extend(rejected[:MAX_REJECTED - len(self.rejected)])
+
+    @property
+    def duplicates(self):
+        return len(self.repeated_book_ids) + self.raced
+
+    def inserted(self, rows, count):
+        # count is executemany's affected rows: ON DUPLICATE KEY UPDATE id=id
+        # leaves a book that is already there untouched and uncounted. Which
+        # rows those were is not known, so their batch adds no books to
+        # imported_books and the caller reloads the search index instead.
+        self.imported += count
+        if count >= len(rows):
+            self.imported_books.extend((row[0], row[1], row[2], row[11]) for row in rows)
+        else:
+            self.raced += len(rows) - count
+
+
+# Record normalization
+# The API returns every value as a string (and some keys with stray spaces,
+# e.g. '  num_pages'). Each column has a converter built once; converters
+# return the value to insert or raise ValueError with the reason.
+DATE_PATTERN = re.compile(r'\s*(\d{1,2})/(\d{1,2})/(\d{4})\s*')
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_date(text):
+    # 'M/D/YYYY' as 'YYYY-MM-DD', or None. Catalogs repeat a few thousand
+    # distinct dates, so most records are a cache hit.
+    match = DATE_PATTERN.fullmatch(text)
+    if not match:
+        return None
+    month, day, year = map(int, match.groups())
+    try:
+        return date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+def text(max_length, required=False):
+    def convert(value):
+        value = '' if value is None else str(value).strip()
+        if not value:
+            if required:
+                raise ValueError('This field is required.')
+            return None
+        if len(value) > max_length:
+            raise ValueError(f'Longer than {max_length} characters.')
+        return value
+    return convert
+
+
+def number(kind, minimum=None, maximum=None, required=False):
+    def convert(value):
+        try:
+            value = kind(value)
+        except (TypeError, ValueError):
+            if value is None or not str(value).strip():
+                if required:
+                    raise ValueError('This field is required.')
+                return None
+            raise ValueError(f'Not a valid {kind.__name__} value.')
+        if (kind is float and not math.isfinite(value)) or \
+                (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            raise ValueError('Out of range.')
+        return value
+    return convert
+
+
+def publication_date(value):
+    if value is None or value == '':
+        return None
+    parsed = parse_date(str(value))
+    if parsed is None:
+        if not str(value).strip():
+            return None
+        raise ValueError('Not a valid M/D/YYYY date.')
+    return parsed
+
+
+# (API key, books column, converter) in INSERT_BOOK_SQL order, without the quantities
+RECORD_COLUMNS = (
+    ('bookID', 'id', number(int, 1, 2 ** 31 - 1, required=True)),
+    ('title', 'title', text(255, required=True)),
+    ('authors', 'author', text(255, required=True)),
+    ('average_rating', 'average_rating', number(float, 0, 5)),
+    ('isbn', 'isbn', text(10)),
+    ('isbn13', 'isbn13', text(13)),
+    ('language_code', 'language_code', text(10)),
+    ('num_pages', 'num_pages', number(int, 0, 2 ** 31 - 1)),
+    ('ratings_count', 'ratings_count', number(int, 0, 2 ** 31 - 1)),
+    ('text_reviews_count', 'text_reviews_count', number(int, 0, 2 ** 31 - 1)),
+    ('publication_date', 'publication_date', publication_date),
+    ('publisher', 'publisher', text(255)),
+)
+
+
+@functools.lru_cache(maxsize=64)
+def record_plan(keys):
+    # [(record key, converter)] for records with these keys; a page's records
+    # share their keys, so they are matched to columns once
+    by_name = {str(key).strip(): key for key in keys}
+    return tuple((by_name.get(name, name), convert) for name, _, convert in RECORD_COLUMNS)
+
+
+def reject_reasons(book, plan):
+    errors = {}
+    for (key, convert), (_, column, _) in zip(plan, RECORD_COLUMNS):
+        try:
+            convert(book.get(key))
+        except ValueError as e:
+            errors[column] = [str(e)]
+    return errors
+
+
+def normalize_page(books, quantity):
+    # Returns (INSERT_BOOK_SQL rows, rejected records) for a page of API
+    # records; a rejected record is {'id', 'title', 'errors': {column: [reason]}}
+    rows = []
+    rejected = []
+    for book in books:
+        if not isinstance(book, dict):
+            rejected.append({'id': None, 'title': None, 'errors': {'record': ['Not an object.']}})
+            continue
+        plan = record_plan(tuple(book))
+        get = book.get
+        try:
+            row = [convert(get(key)) for key, convert in plan]
+        except ValueError:
+            rejected.append({'id': get(plan[0][0]), 'title': get(plan[1][0]),
+                             'errors': reject_reasons(book, plan)})
+            continue
+        row.append(quantity)
+        row.append(quantity)
+        rows.append(tuple(row))
+    return rows, rejected
+
+
+def collect_page(page_rows, existing, seen, rows, result, no_of_books):
+    # Adds the normalized rows of one page that are new to `rows`; returns
+    # True once no_of_books books have been collected
+    for row in page_rows:
+        book_id = str(row[0])
+        if book_id in existing or book_id in seen:
+            result.repeated_book_ids.append(row[0])
+            continue
+        rows.append(row)
+        seen.add(book_id)
+        if result.imported + len(rows) >= no_of_books:
+            return True
+    return False
+
+
+def make_session(workers=IMPORT_WORKERS):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class BookImporter:
+    # client_options are passed to FrappeClient (timeouts, retries, limiter, cache)
+    def __init__(self, connection, base_url=FRAPPE_LIBRARY_URL, workers=IMPORT_WORKERS,
+                 batch_size=INSERT_BATCH_SIZE, session=None, client_options=None):
+        self.connection = connection
+        self.base_url = base_url
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.client = FrappeClient(session or make_session(self.workers), base_url, **(client_options or {}))
+
+    def fetch_page(self, page, title=None, author=None):
+        return self.client.fetch_page(page, title, author)
+
+    def iter_pages(self, title=None, author=None):
+        # Keeps `workers` pages in flight and yields them in page order. The
+        # consumer stops the iteration by closing the generator; pages that
+        # were prefetched but not needed are cancelled.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {}
+            next_page = 1
+            current = 1
+            try:
+                while True:
+                    while len(pending) < self.workers:
+                        pending[next_page] = executor.submit(self.fetch_page, next_page, title, author)
+                        next_page += 1
+                    books = pending.pop(current).result()
+                    if not books:
+                        break
+                    yield books
+                    current += 1
+            finally:
+                for future in pending.values():
+                    future.cancel()
+
+    def existing_ids(self, cursor, ids):
+        if not ids:
+            return set()
+        placeholders = ", ".join(["%s"] * len(ids))
+        cursor.execute(f"SELECT id FROM books WHERE id IN ({placeholders})", list(ids))
+        return {str(row['id']) for row in cursor.fetchall()}
+
+    def flush(self, cursor, rows, result):
+        if not rows:
+            return
+        cursor.executemany(INSERT_BOOK_SQL, rows)
+        count = cursor.rowcount
+        self.connection.commit()
+        result.inserted(rows, count)
+        rows.clear()
+
+    def run(self, no_of_books, title=None, author=None, quantity=1, progress=None):
+        # progress(result) is called after every page
+        result = ImportResult()
+        seen = set()
+        rows = []
+        cursor = self.connection.cursor()
+        try:
+            pages = self.iter_pages(title, author)
+            try:
+                for books in pages:
+                    result.pages_fetched += 1
+                    page_rows, rejected = normalize_page(books, quantity)
+                    result.reject(rejected)
+                    existing = self.existing_ids(cursor, [str(row[0]) for row in page_rows])
+                    done = collect_page(page_rows, existing, seen, rows, result, no_of_books)
+                    if done or len(rows) >= self.batch_size:
+                        self.flush(cursor, rows, result)
+                        # Raced books leave the import short; keep going
+                        done = result.imported >= no_of_books
+                    if progress:
+                        progress(result)
+                    if done:
+                        break
+            except FrappeError as e:
+                result.error = str(e)
+            finally:
+                pages.close()
+            self.flush(cursor, rows, result)
+            if progress:
+                progress(result)
+        finally:
+            cursor.close()
+        return result
+
+
+class AsyncBookImporter:
+    def __init__(self, db, base_url=FRAPPE_LIBRARY_URL, workers=IMPORT_WORKERS,
+                 batch_size=INSERT_BATCH_SIZE, client_options=None):
+        self.db = db
+        self.base_url = base_url
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.client_options = client_options or {}
+
+    async def fetch_page(self, client, page, title=None, author=None):
+        return await client.fetch_page(page, title, author)
+
+    async def iter_pages(self, client, title=None, author=None):
+        # Same contract as BookImporter.iter_pages, with tasks for threads;
+        # close it with aclose()
+        pending = {}
+        next_page = 1
+        current = 1
+        try:
+            while True:
+                while len(pending) < self.workers:
+                    pending[next_page] = asyncio.ensure_future(
+                        self.fetch_page(client, next_page, title, author))
+                    next_page += 1
+                books = await pending.pop(current)
+                if not books:
+                    break
+                yield books
+                current += 1
+        finally:
+            for task in pending.values():
+                task.cancel()
+
+    async def existing_ids(self, cursor, ids):
+        if not ids:
+            return set()
+        placeholders = ", ".join(["%s"] * len(ids))
+        await cursor.execute(f"SELECT id FROM books WHERE id IN ({placeholders})", list(ids))
+        return {str(row['id']) for row in await cursor.fetchall()}
+
+    async def flush(self, connection, cursor, rows, result):
+        if not rows:
+            return
+        await cursor.executemany(INSERT_BOOK_SQL, rows)
+        count = cursor.rowcount
+        await connection.commit()
+        result.inserted(rows, count)
+        rows.clear()
+
+    async def run(self, no_of_books, title=None, author=None, quantity=1, progress=None):
+        import httpx
+
+        result = ImportResult()
+        seen = set()
+        rows = []
+        limits = httpx.Limits(max_connections=self.workers)
+        async with httpx.AsyncClient(limits=limits) as session, \
+                self.db.connection() as connection, self.db.cursor(connection) as cursor:
+            client = AsyncFrappeClient(session, self.base_url, **self.client_options)
+            pages = self.iter_pages(client, title, author)
+            try:
+                async for books in pages:
+                    result.pages_fetched += 1
+                    page_rows, rejected = normalize_page(books, quantity)
+                    result.reject(rejected)
+                    existing = await self.existing_ids(cursor, [str(row[0]) for row in page_rows])
+                    done = collect_page(page_rows, existing, seen, rows, result, no_of_books)
+                    if done or len(rows) >= self.batch_size:
+                        await self.flush(connection, cursor, rows, result)
+                        done = result.imported >= no_of_books
+                    if progress:
+                        progress(result)
+                    if done:
+                        break
+            except FrappeError as e:
+                result.error = str(e)
+            finally:
+                await pages.aclose()
+            await self.flush(connection, cursor, rows, result)
+            if progress:
+                progress(result)
+        return result
@@ -0,0 +1,356 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter as TallyCounter
+from datetime import datetime, timezone
+
+from flask import g, has_app_context, has_request_context, request
+
+
+# Request, query and profiling instrumentation.
+#
+# - Every request is timed into a per-endpoint latency histogram and logged as
+#   one structured (JSON) log line with its status, duration and query count.
+# - Every query run through `db.Database` is timed into a per-statement
+#   histogram (statements are the SQL text with IN (...) lists collapsed, so
+#   parameters never become labels) together with the rows it returned or
+#   changed. A statement run N_PLUS_ONE_THRESHOLD times or more within one
+#   request or job is reported as a likely N+1 query.
+# - A sample of requests (PROFILE_RATE) runs under cProfile; the profile of a
+#   sampled request slower than SLOW_REQUEST is logged and, if a directory is
+#   configured, written to a .prof file for snakeviz/pstats.
+#
+# Metrics are rendered in the Prometheus text exposition format. The
+# thresholds can be passed to the constructor or set in app.config
+# (METRICS_SLOW_REQUEST, METRICS_SLOW_QUERY, METRICS_N_PLUS_ONE_THRESHOLD,
+# METRICS_PROFILE_RATE, METRICS_PROFILE_DIR) before init_app.
+
+SLOW_REQUEST = 0.5
+SLOW_QUERY = 0.1
+N_PLUS_ONE_THRESHOLD = 10
+PROFILE_RATE = 0.0
+PROFILE_LINES = 30
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+log = logging.getLogger('library')
+
+
+# Structured logging
+
+class JSONFormatter(logging.Formatter):
+    # One JSON object per line; `extra={'fields': {...}}` adds keys, and
+    # records logged during a request carry its id, method, path and endpoint.
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        if has_request_context():
+            entry['request_id'] = g.get('request_id')
+            entry['method'] = request.method
+            entry['path'] = request.path
+            entry['endpoint'] = request.endpoint
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['error_type'] = record.exc_info[0].__name__
+            entry['error'] = str(record.exc_info[1])
+            entry['traceback'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(level='INFO'):
+    handler = logging.StreamHandler()
+    handler.setFormatter(JSONFormatter())
+    log.handlers[:] = [handler]
+    log.setLevel(level.upper() if isinstance(level, str) else level)
+    log.propagate = False
+
+
+# Metrics
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name, self.labels, labels, value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            counts = entry[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *labels):
+        entry = self._values.get(labels)
+        return entry[2] if entry else 0
+
+    def samples(self):
+        with self._lock:
+            values = {labels: ([*entry[0]], entry[1], entry[2]) for labels, entry in self._values.items()}
+        names = self.labels + ('le',)
+        for labels, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield self.name + '_bucket', names, labels + (format_value(bound),), cumulative
+            yield self.name + '_sum', self.labels, labels, total
+            yield self.name + '_count', self.labels, labels, count
+
+
+class Collector:
+    # Values read on every scrape from fn(), a {label values: value} dict
+    def __init__(self, name, help, type, labels, fn):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labels = labels
+        self.fn = fn
+
+    def samples(self):
+        for labels, value in sorted(self.fn().items()):
+            yield self.name, self.labels, labels, value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collector(self, name, help, labels, fn, type='gauge'):
+        return self.register(Collector(name, help, type, labels, fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, label_names, labels, value in metric.samples():
+                lines.append(f'{name}{format_labels(label_names, labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# Statement fingerprints
+
+IN_LIST = re.compile(r'\bIN\s*\((?:\s*%s\s*,?)+\)', re.IGNORECASE)
+WHITESPACE = re.compile(r'\s+')
+STATEMENT_MAX_LENGTH = 200
+
+
+def fingerprint(query):
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    query = WHITESPACE.sub(' ', query).strip()
+    query = IN_LIST.sub('IN (...)', query)
+    return query[:STATEMENT_MAX_LENGTH]
+
+
+class Instrumentation:
+    def __init__(self, app=None, db=None, slow_request=SLOW_REQUEST, slow_query=SLOW_QUERY,
+                 n_plus_one_threshold=N_PLUS_ONE_THRESHOLD, profile_rate=PROFILE_RATE, profile_dir=None):
+        self.slow_request = slow_request
+        self.slow_query = slow_query
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.profile_rate = profile_rate
+        self.profile_dir = profile_dir
+        # cProfile can only profile one request at a time
+        self._profile_lock = threading.Lock()
+
+        self.registry = Registry()
+        self.requests = self.registry.counter(
+            'library_http_requests_total', 'HTTP requests by endpoint and status.',
+            ('method', 'endpoint', 'status'))
+        self.request_latency = self.registry.histogram(
+            'library_http_request_duration_seconds', 'Time to produce the response, by endpoint.',
+            ('method', 'endpoint'))
+        self.query_latency = self.registry.histogram(
+            'library_db_query_duration_seconds', 'Query execution time by statement.', ('statement',))
+        self.query_rows = self.registry.counter(
+            'library_db_query_rows_total', 'Rows returned or affected by statement.', ('statement',))
+        self.request_queries = self.registry.histogram(
+            'library_db_queries_per_request', 'Queries run per request or job.', ('endpoint',), COUNT_BUCKETS)
+        self.n_plus_one = self.registry.counter(
+            'library_db_n_plus_one_total', 'Requests or jobs that repeated a statement at least '
+            'n_plus_one_threshold times.', ('endpoint', 'statement'))
+        self.profiles = self.registry.counter(
+            'library_profiled_requests_total', 'Sampled requests that were slow enough to keep a profile.',
+            ('endpoint',))
+
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+        self.slow_request = app.config.get('METRICS_SLOW_REQUEST', self.slow_request)
+        self.slow_query = app.config.get('METRICS_SLOW_QUERY', self.slow_query)
+        self.n_plus_one_threshold = app.config.get('METRICS_N_PLUS_ONE_THRESHOLD', self.n_plus_one_threshold)
+        self.profile_rate = app.config.get('METRICS_PROFILE_RATE', self.profile_rate)
+        self.profile_dir = app.config.get('METRICS_PROFILE_DIR', self.profile_dir)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        app.teardown_appcontext(self.teardown_appcontext)
+        if db is not None:
+            db.query_listeners.append(self.record_query)
+
+    def render(self):
+        return self.registry.render()
+
+    # Queries
+
+    def record_query(self, query, seconds, rows):
+        statement = fingerprint(query)
+        self.query_latency.observe(seconds, statement)
+        self.query_rows.inc(statement, amount=rows)
+        if seconds >= self.slow_query:
+            log.warning('slow_query', extra={'fields': {
+                'statement': statement, 'duration_ms': round(seconds * 1000, 2), 'rows': rows}})
+
+        # Queries of the native ASGI handlers (asgi.py) run outside of Flask
+        if not has_app_context():
+            return
+        stats = g.get('query_stats')
+        if stats is None:
+            stats = g.query_stats = {'count': 0, 'seconds': 0.0, 'statements': TallyCounter()}
+        stats['count'] += 1
+        stats['seconds'] += seconds
+        stats['statements'][statement] += 1
+
+    def finish_queries(self, endpoint):
+        # Pops the query stats of the current request or job and reports N+1s
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return 0, 0.0
+        self.request_queries.observe(stats['count'], endpoint)
+        for statement, count in stats['statements'].items():
+            if count >= self.n_plus_one_threshold:
+                self.n_plus_one.inc(endpoint, statement)
+                log.warning('n_plus_one', extra={'fields': {'statement': statement, 'count': count}})
+        return stats['count'], stats['seconds']
+
+    # Requests
+
+    def before_request(self):
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        g.request_start = time.perf_counter()
+        if self.profile_rate and random.random() < self.profile_rate and self._profile_lock.acquire(blocking=False):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def after_request(self, response):
+        g.response_status = response.status_code
+        response.headers.setdefault('X-Request-ID', g.get('request_id', ''))
+        return response
+
+    def teardown_request(self, exception):
+        start = g.pop('request_start', None)
+        if start is None:
+            return
+        duration = time.perf_counter() - start
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            self._profile_lock.release()
+
+        endpoint = request.endpoint or 'unknown'
+        status = 500 if exception is not None else g.pop('response_status', 200)
+        self.requests.inc(request.method, endpoint, str(status))
+        self.request_latency.observe(duration, request.method, endpoint)
+        queries, query_seconds = self.finish_queries(endpoint)
+
+        slow = duration >= self.slow_request
+        log.log(logging.WARNING if slow else logging.INFO, 'slow_request' if slow else 'request', extra={'fields': {
+            'status': status, 'duration_ms': round(duration * 1000, 2),
+            'queries': queries, 'query_ms': round(query_seconds * 1000, 2)}})
+        if profiler is not None and slow:
+            self.save_profile(profiler, endpoint)
+
+    def teardown_appcontext(self, exception):
+        # Jobs and CLI commands run in an app context without a request
+        if 'query_stats' in g:
+            self.finish_queries('job' if not has_request_context() else request.endpoint or 'unknown')
+
+    def save_profile(self, profiler, endpoint):
+        self.profiles.inc(endpoint)
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        fields = {'profile': output.getvalue()}
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"{endpoint}-{g.get('request_id')}.prof")
+            profiler.dump_stats(path)
+            fields['profile_path'] = path
+        log.warning('profile', extra={'fields': fields})
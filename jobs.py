@@ -0,0 +1,338 @@
+import asyncio
+import concurrent.futures
+import inspect
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+
+# Background job queue for long-running bulk work (imports and the like).
+#
+# Jobs run on a bounded thread pool inside the web process and report their
+# progress through counters that the request handlers can poll. With a
+# JobStore set, every job is also kept as a row of the jobs table
+# (migrations/0008): status changes are written at once and counters at most
+# every SAVE_INTERVAL seconds, on a thread of their own so neither the job
+# nor an event loop waits for the database. That thread writes over a
+# connection of its own rather than one of the request pool, so a busy pool
+# does not lose job state. Any process can then answer a job's progress, and
+# the row outlives the process. Running jobs are written at least every
+# HEARTBEAT_INTERVAL seconds, progress or not; a running job whose row has
+# not been written for `stale_after` seconds belongs to a process that died
+# and is reported as failed.
+#
+# In memory, only the most recent MAX_FINISHED_JOBS finished jobs are kept;
+# finished rows are deleted after KEEP_DAYS. The worker threads are started
+# by the first job, so a process can be forked before that and each forked
+# process gets a queue of its own.
+#
+# A job function may also be a coroutine function. It then runs on `loop`
+# when one is set (the ASGI server's event loop, see asgi.py), or on its own
+# event loop in a worker thread otherwise.
+
+JOB_WORKERS = 2
+MAX_FINISHED_JOBS = 200
+SAVE_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 60
+STALE_AFTER = 600
+KEEP_DAYS = 30
+
+JOB_COLUMNS = "id, kind, description, status, counters, message, error, created_on, started_on, finished_on, updated_on"
+JOB_SQL = f"SELECT {JOB_COLUMNS} FROM jobs WHERE id=%s"
+SAVE_JOB_SQL = (
+    f"INSERT INTO jobs ({JOB_COLUMNS}, worker) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE status=VALUES(status), counters=VALUES(counters), message=VALUES(message), "
+    "error=VALUES(error), started_on=VALUES(started_on), finished_on=VALUES(finished_on), "
+    "updated_on=VALUES(updated_on)"
+)
+
+log = logging.getLogger('library.jobs')
+
+
+class Job:
+    def __init__(self, kind, description=''):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.description = description
+        self.status = 'queued'
+        self.counters = {}
+        self.message = ''
+        self.error = None
+        self.created_on = datetime.now()
+        self.started_on = None
+        self.finished_on = None
+        self.on_change = None
+        self.saved_at = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, **counters):
+        with self._lock:
+            self.counters.update(counters)
+        if self.on_change is not None:
+            self.on_change(self)
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'description': self.description,
+                'status': self.status,
+                'counters': dict(self.counters),
+                'message': self.message,
+                'error': self.error,
+                'created_on': self.created_on.isoformat(),
+                'started_on': self.started_on.isoformat() if self.started_on else None,
+                'finished_on': self.finished_on.isoformat() if self.finished_on else None,
+            }
+
+    def row(self):
+        with self._lock:
+            return (self.id, self.kind, self.description[:255], self.status, json.dumps(self.counters),
+                    self.message, self.error, self.created_on, self.started_on, self.finished_on)
+
+
+class JobStore:
+    # Jobs table access. `session()` is a context manager giving a database
+    # connection of its own, for reads; `connect()` opens the connection
+    # save() keeps for the queue's saver thread. Neither shares the job's
+    # transaction, so saving a job never commits the job's work.
+    def __init__(self, session, connect, stale_after=STALE_AFTER, keep_days=KEEP_DAYS):
+        self.session = session
+        self.connect = connect
+        self.stale_after = stale_after
+        self.keep_days = keep_days
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._connection = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The parent's connection is left to the parent
+        self._connection = None
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+
+    def save(self, job):
+        # Called from one thread at a time. A failed write is tried once more
+        # on a new connection, in case the kept one was dropped by the server.
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = self.connect()
+            try:
+                self._save(self._connection, job)
+                return
+            except Exception:
+                self.close()
+                if attempt:
+                    raise
+
+    def _save(self, connection, job):
+        now = datetime.now()
+        with connection.cursor() as cursor:
+            cursor.execute(SAVE_JOB_SQL, job.row() + (now, self.worker))
+            if job.finished and self.keep_days:
+                cursor.execute("DELETE FROM jobs WHERE finished_on < %s",
+                               [now - timedelta(days=self.keep_days)])
+        connection.commit()
+
+    def close(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def get(self, job_id):
+        with self.session() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(JOB_SQL, [job_id])
+                row = cursor.fetchone()
+        return self.to_dict(row) if row else None
+
+    def to_dict(self, row):
+        # A jobs row as Job.to_dict() returns it
+        job = {
+            'id': row['id'],
+            'kind': row['kind'],
+            'description': row['description'],
+            'status': row['status'],
+            'counters': json.loads(row['counters'] or '{}'),
+            'message': row['message'] or '',
+            'error': row['error'],
+        }
+        for column in ('created_on', 'started_on', 'finished_on'):
+            job[column] = row[column].isoformat() if row[column] else None
+        if (job['status'] == 'running' and self.stale_after
+                and datetime.now() - row['updated_on'] > timedelta(seconds=self.stale_after)):
+            job['status'] = 'failed'
+            job['error'] = 'The process running this job stopped'
+        return job
+
+
+class JobQueue:
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._saver = None
+        self._saves = 0
+        self._stopping = threading.Event()
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.loop = None
+        self.store = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Threads do not survive a fork; neither do the parent's jobs
+        self._executor = None
+        self._saver = None
+        self._saves = 0
+        self._stopping = threading.Event()
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='job')
+        return self._executor.submit(fn, *args)
+
+    def submit(self, kind, fn, *args, description='', counters=None, **kwargs):
+        # fn(job, *args, **kwargs) runs in the background; its return value
+        # becomes the job message.
+        job = Job(kind, description)
+        job.update(**(counters or {}))
+        job.on_change = self._changed
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._save(job)
+        if not inspect.iscoroutinefunction(fn):
+            self._submit(self._run, job, fn, args, kwargs)
+        elif self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._run_async(job, fn, args, kwargs), self.loop)
+        else:
+            self._submit(asyncio.run, self._run_async(job, fn, args, kwargs))
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        # Job.to_dict() of a job of this process, else of the stored job;
+        # None for an unknown job
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self.store is not None:
+            return self.store.get(job_id)
+        return None
+
+    def list(self):
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def active(self):
+        # Jobs of this process that have not finished
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def _changed(self, job):
+        if time.monotonic() - job.saved_at >= SAVE_INTERVAL:
+            self._save(job)
+
+    def _save(self, job):
+        if self.store is None:
+            return
+        job.saved_at = time.monotonic()
+        with self._lock:
+            if self._saver is None:
+                self._saver = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='job-store')
+                threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True).start()
+            self._saves += 1
+        self._saver.submit(self._write, job)
+
+    def _write(self, job):
+        # A job whose row cannot be written keeps running. The saver's
+        # connection is closed once nothing is left to write.
+        try:
+            self.store.save(job)
+        except Exception:
+            log.warning('job_save_failed', exc_info=True, extra={'fields': {'job_id': job.id}})
+        with self._lock:
+            self._saves -= 1
+            idle = not self._saves and all(job.finished for job in self._jobs.values())
+        if idle:
+            self.store.close()
+
+    def _heartbeat(self):
+        # Rewrites the rows of running jobs that reported no progress for a
+        # while, so a long quiet job is not taken for one whose process died
+        while not self._stopping.wait(HEARTBEAT_INTERVAL):
+            with self._lock:
+                running = [job for job in self._jobs.values() if job.status == 'running']
+            for job in running:
+                if time.monotonic() - job.saved_at >= HEARTBEAT_INTERVAL:
+                    self._save(job)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def _run(self, job, fn, args, kwargs):
+        self._started(job)
+        try:
+            job.message = fn(job, *args, **kwargs) or ''
+            job.status = 'done'
+        except Exception as e:
+            self._failed(job, e)
+        finally:
+            self._finished(job)
+
+    async def _run_async(self, job, fn, args, kwargs):
+        self._started(job)
+        try:
+            job.message = await fn(job, *args, **kwargs) or ''
+            job.status = 'done'
+        except Exception as e:
+            self._failed(job, e)
+        finally:
+            self._finished(job)
+
+    def _started(self, job):
+        job.status = 'running'
+        job.started_on = datetime.now()
+        self._save(job)
+
+    def _finished(self, job):
+        job.finished_on = datetime.now()
+        self._save(job)
+
+    def _failed(self, job, e):
+        log.exception('job_failed', extra={'fields': {'job_id': job.id, 'kind': job.kind}})
+        job.error = str(e)
+        job.status = 'failed'
+
+    def shutdown(self, wait=True):
+        self._stopping.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+        if self._saver is not None:
+            self._saver.shutdown(wait=wait)
+            if wait:
+                self.store.close()
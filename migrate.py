@@ -0,0 +1,141 @@
+import os
+import re
+from datetime import datetime
+
+import MySQLdb
+
+
+# Versioned schema migrations.
+#
+# Each file in migrations/ is named NNNN_description.sql and holds a
+# `-- migrate:up` and a `-- migrate:down` section of ;-terminated statements.
+# Applied versions are recorded in the schema_migrations table. MySQL commits
+# DDL implicitly, so a migration that fails halfway is not rolled back: keep
+# each file to one change and fix forward (or roll back by hand) on failure.
+#
+# A database created before migrations is at version 0: 0001 only creates the
+# tables that are missing, so `flask db upgrade` brings it up to date.
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+FILENAME = re.compile(r'^(\d+)_(\w+)\.sql$')
+SECTION = re.compile(r'^--\s*migrate:(up|down)\s*$', re.MULTILINE)
+
+VERSION_TABLE_SQL = (
+    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+    "version INT NOT NULL PRIMARY KEY, "
+    "name VARCHAR(255) NOT NULL, "
+    "applied_on DATETIME NOT NULL)"
+)
+
+# MySQL error for a missing table
+ER_NO_SUCH_TABLE = 1146
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Migration:
+    def __init__(self, version, name, up, down):
+        self.version = version
+        self.name = name
+        self.up = up
+        self.down = down
+
+    def __str__(self):
+        return f"{self.version:04d}_{self.name}"
+
+
+def split_statements(sql):
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+    return [statement.strip() for statement in '\n'.join(lines).split(';') if statement.strip()]
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = FILENAME.match(filename)
+        if not match:
+            continue
+        with open(os.path.join(directory, filename), encoding='utf-8') as f:
+            parts = SECTION.split(f.read())
+        sections = dict(zip(parts[1::2], parts[2::2]))
+        if 'up' not in sections:
+            raise MigrationError(f'{filename} has no -- migrate:up section')
+        migrations.append(Migration(int(match.group(1)), match.group(2),
+                                    split_statements(sections['up']),
+                                    split_statements(sections.get('down', ''))))
+
+    for expected, migration in enumerate(migrations, 1):
+        if migration.version != expected:
+            raise MigrationError(f'Expected migration {expected:04d}, found {migration}')
+    return migrations
+
+
+def applied_versions(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(VERSION_TABLE_SQL)
+        cursor.execute("SELECT version FROM schema_migrations ORDER BY version")
+        return [row['version'] for row in cursor.fetchall()]
+
+
+def current_version(connection):
+    # Read-only: a database without schema_migrations is at version 0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT MAX(version) AS version FROM schema_migrations")
+            return cursor.fetchone()['version'] or 0
+    except MySQLdb.ProgrammingError as e:
+        if e.args and e.args[0] == ER_NO_SUCH_TABLE:
+            return 0
+        raise
+
+
+def run_statements(connection, migration, statements):
+    with connection.cursor() as cursor:
+        for statement in statements:
+            try:
+                cursor.execute(statement)
+            except MySQLdb.Error as e:
+                raise MigrationError(f'{migration} failed on: {statement}\n{e}') from e
+
+
+def upgrade(connection, migrations, target=None):
+    # Applies the pending migrations up to `target` (default: all); yields each one
+    applied = set(applied_versions(connection))
+    target = migrations[-1].version if target is None else target
+    for migration in migrations:
+        if migration.version in applied or migration.version > target:
+            continue
+        run_statements(connection, migration, migration.up)
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO schema_migrations (version, name, applied_on) VALUES (%s, %s, %s)",
+                           [migration.version, migration.name, datetime.now()])
+        connection.commit()
+        yield migration
+
+
+def downgrade(connection, migrations, target):
+    # Rolls back the applied migrations above `target`, newest first; yields each one
+    applied = set(applied_versions(connection))
+    for migration in reversed(migrations):
+        if migration.version not in applied or migration.version <= target:
+            continue
+        if not migration.down:
+            raise MigrationError(f'{migration} cannot be rolled back')
+        run_statements(connection, migration, migration.down)
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM schema_migrations WHERE version=%s", [migration.version])
+        connection.commit()
+        yield migration
+
+
+def stamp(connection, migrations, version):
+    # Records versions 1..version as applied without running them
+    applied_versions(connection)
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM schema_migrations")
+        cursor.executemany("INSERT INTO schema_migrations (version, name, applied_on) VALUES (%s, %s, %s)",
+                           [(migration.version, migration.name, datetime.now())
+                            for migration in migrations if migration.version <= version])
+    connection.commit()
@@ -0,0 +1,46 @@
+-- The books, members and transactions tables as app.py has always used them.
+-- IF NOT EXISTS, so a database created before migrations keeps its tables.
+
+-- migrate:up
+CREATE TABLE IF NOT EXISTS books (
+    id INT NOT NULL PRIMARY KEY,
+    title VARCHAR(255) NOT NULL,
+    author VARCHAR(255) NOT NULL,
+    average_rating DOUBLE,
+    isbn VARCHAR(10),
+    isbn13 VARCHAR(13),
+    language_code VARCHAR(10),
+    num_pages INT,
+    ratings_count INT,
+    text_reviews_count INT,
+    publication_date DATE,
+    publisher VARCHAR(255),
+    total_quantity INT NOT NULL DEFAULT 1,
+    available_quantity INT NOT NULL DEFAULT 1
+);
+
+CREATE TABLE IF NOT EXISTS members (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    email VARCHAR(255) NOT NULL,
+    ph_no VARCHAR(20),
+    registered_on DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    outstanding_debt DOUBLE NOT NULL DEFAULT 0,
+    amount_spent DOUBLE NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    book_id INT NOT NULL,
+    member_id INT NOT NULL,
+    per_day_fee DOUBLE NOT NULL,
+    borrowed_on DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    returned_on DATETIME NULL,
+    total_charge DOUBLE NULL,
+    amount_paid DOUBLE NULL
+);
+
+-- migrate:down
+DROP TABLE transactions;
+DROP TABLE members;
+DROP TABLE books;
@@ -0,0 +1,12 @@
+-- /books keyset pagination sorted by title or author, and the title/name
+-- prefix lookups (LIKE 'prefix%' ORDER BY label, id) behind the issue form.
+
+-- migrate:up
+CREATE INDEX idx_books_title_id ON books (title, id);
+CREATE INDEX idx_books_author_id ON books (author, id);
+CREATE INDEX idx_members_name_id ON members (name, id);
+
+-- migrate:down
+DROP INDEX idx_members_name_id ON members;
+DROP INDEX idx_books_author_id ON books;
+DROP INDEX idx_books_title_id ON books;
@@ -0,0 +1,20 @@
+-- /transactions filters. The listing is newest first with keyset pagination
+-- on id, so each filter column is paired with id.
+--
+-- Open loans (returned_on IS NULL) are read in id order by /transactions
+-- ?status=open and, in id ranges, by the fee pass, which also needs
+-- member_id, book_id, borrowed_on and per_day_fee. The returned_on index
+-- carries those columns so the fee pass is answered from the index alone.
+
+-- migrate:up
+CREATE INDEX idx_transactions_member_id ON transactions (member_id, id);
+CREATE INDEX idx_transactions_book_id ON transactions (book_id, id);
+CREATE INDEX idx_transactions_open_loans
+    ON transactions (returned_on, id, member_id, book_id, borrowed_on, per_day_fee);
+CREATE INDEX idx_transactions_borrowed_on ON transactions (borrowed_on);
+
+-- migrate:down
+DROP INDEX idx_transactions_borrowed_on ON transactions;
+DROP INDEX idx_transactions_open_loans ON transactions;
+DROP INDEX idx_transactions_book_id ON transactions;
+DROP INDEX idx_transactions_member_id ON transactions;
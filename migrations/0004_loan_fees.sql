@@ -0,0 +1,17 @@
+-- Accrued fees of open loans, rebuilt by `flask compute-fees` (fees.py).
+
+-- migrate:up
+CREATE TABLE loan_fees (
+    transaction_id INT NOT NULL PRIMARY KEY,
+    member_id INT NOT NULL,
+    book_id INT NOT NULL,
+    days_out INT NOT NULL,
+    accrued_charge DOUBLE NOT NULL,
+    overdue TINYINT(1) NOT NULL,
+    computed_on DATETIME NOT NULL,
+    KEY idx_loan_fees_member_id (member_id),
+    KEY idx_loan_fees_computed_on (computed_on)
+);
+
+-- migrate:down
+DROP TABLE loan_fees;
@@ -0,0 +1,64 @@
+-- Rollup tables behind the member and library dashboards (rollups.py),
+-- maintained by issue_book/return_book and backfilled here from the existing
+-- transactions.
+
+-- migrate:up
+CREATE TABLE member_stats (
+    member_id INT NOT NULL PRIMARY KEY,
+    active_loans INT NOT NULL DEFAULT 0,
+    lifetime_borrows INT NOT NULL DEFAULT 0,
+    total_charged DOUBLE NOT NULL DEFAULT 0,
+    total_paid DOUBLE NOT NULL DEFAULT 0,
+    last_borrowed_on DATETIME NULL
+);
+
+CREATE TABLE book_stats (
+    book_id INT NOT NULL PRIMARY KEY,
+    active_loans INT NOT NULL DEFAULT 0,
+    lifetime_borrows INT NOT NULL DEFAULT 0,
+    KEY idx_book_stats_borrows (lifetime_borrows, book_id)
+);
+
+CREATE TABLE member_book_stats (
+    member_id INT NOT NULL,
+    book_id INT NOT NULL,
+    borrows INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (member_id, book_id),
+    KEY idx_member_book_stats_borrows (member_id, borrows, book_id)
+);
+
+CREATE TABLE monthly_stats (
+    month DATE NOT NULL PRIMARY KEY,
+    loans INT NOT NULL DEFAULT 0,
+    returned INT NOT NULL DEFAULT 0,
+    charged DOUBLE NOT NULL DEFAULT 0,
+    revenue DOUBLE NOT NULL DEFAULT 0
+);
+
+INSERT INTO member_stats (member_id, active_loans, lifetime_borrows, total_charged, total_paid, last_borrowed_on)
+SELECT member_id, SUM(returned_on IS NULL), COUNT(*), COALESCE(SUM(total_charge), 0),
+       COALESCE(SUM(amount_paid), 0), MAX(borrowed_on)
+FROM transactions GROUP BY member_id;
+
+INSERT INTO book_stats (book_id, active_loans, lifetime_borrows)
+SELECT book_id, SUM(returned_on IS NULL), COUNT(*) FROM transactions GROUP BY book_id;
+
+INSERT INTO member_book_stats (member_id, book_id, borrows)
+SELECT member_id, book_id, COUNT(*) FROM transactions GROUP BY member_id, book_id;
+
+INSERT INTO monthly_stats (month, loans, returned, charged, revenue)
+SELECT month, SUM(loans), SUM(returned), SUM(charged), SUM(revenue) FROM (
+    SELECT DATE_FORMAT(borrowed_on, '%Y-%m-01') AS month, COUNT(*) AS loans, 0 AS returned,
+           0 AS charged, 0 AS revenue
+    FROM transactions GROUP BY 1
+    UNION ALL
+    SELECT DATE_FORMAT(returned_on, '%Y-%m-01'), 0, COUNT(*), COALESCE(SUM(total_charge), 0),
+           COALESCE(SUM(amount_paid), 0)
+    FROM transactions WHERE returned_on IS NOT NULL GROUP BY 1
+) AS months GROUP BY month;
+
+-- migrate:down
+DROP TABLE monthly_stats;
+DROP TABLE member_book_stats;
+DROP TABLE book_stats;
+DROP TABLE member_stats;
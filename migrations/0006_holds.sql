@@ -0,0 +1,21 @@
+-- Hold queue for books with no copy available (circulation.py). Waiting holds
+-- of a book are served oldest first through idx_holds_queue; a returned copy
+-- is set aside for the next one (status ready) instead of being made
+-- available.
+
+-- migrate:up
+CREATE TABLE holds (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    book_id INT NOT NULL,
+    member_id INT NOT NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'waiting',
+    placed_on DATETIME NOT NULL,
+    ready_on DATETIME NULL,
+    closed_on DATETIME NULL,
+    KEY idx_holds_queue (book_id, status, id),
+    KEY idx_holds_member (member_id, status, id),
+    KEY idx_holds_status (status, id)
+);
+
+-- migrate:down
+DROP TABLE holds;
@@ -0,0 +1,26 @@
+-- Returned loans moved out of transactions by `flask archive-transactions`
+-- (archive.py), so that circulation and the open-loan indexes only see recent
+-- and open loans. Rows keep their transaction id. The indexes serve the
+-- /transactions history filters, which read both tables.
+
+-- migrate:up
+CREATE TABLE transactions_archive (
+    id INT NOT NULL PRIMARY KEY,
+    book_id INT NOT NULL,
+    member_id INT NOT NULL,
+    per_day_fee DOUBLE NOT NULL,
+    borrowed_on DATETIME NOT NULL,
+    returned_on DATETIME NOT NULL,
+    total_charge DOUBLE NULL,
+    amount_paid DOUBLE NULL,
+    archived_on DATETIME NOT NULL,
+    KEY idx_transactions_archive_member_id (member_id, id),
+    KEY idx_transactions_archive_book_id (book_id, id),
+    KEY idx_transactions_archive_borrowed_on (borrowed_on)
+);
+
+-- migrate:down
+INSERT INTO transactions (id, book_id, member_id, per_day_fee, borrowed_on, returned_on, total_charge, amount_paid)
+    SELECT id, book_id, member_id, per_day_fee, borrowed_on, returned_on, total_charge, amount_paid
+    FROM transactions_archive;
+DROP TABLE transactions_archive;
@@ -0,0 +1,25 @@
+-- Background jobs (jobs.py), so that any app process can answer a job's
+-- progress and a job outlives the process that ran it. counters is the job's
+-- progress counters as JSON; updated_on tells a running job from one whose
+-- process died. Finished jobs are deleted after a while through
+-- idx_jobs_finished_on.
+
+-- migrate:up
+CREATE TABLE jobs (
+    id CHAR(32) NOT NULL PRIMARY KEY,
+    kind VARCHAR(32) NOT NULL,
+    description VARCHAR(255) NOT NULL DEFAULT '',
+    status VARCHAR(10) NOT NULL,
+    counters TEXT NOT NULL,
+    message TEXT NULL,
+    error TEXT NULL,
+    created_on DATETIME NOT NULL,
+    started_on DATETIME NULL,
+    finished_on DATETIME NULL,
+    updated_on DATETIME NOT NULL,
+    worker VARCHAR(255) NOT NULL DEFAULT '',
+    KEY idx_jobs_finished_on (finished_on)
+);
+
+-- migrate:down
+DROP TABLE jobs;
@@ -0,0 +1,125 @@
+from archive import HISTORY_SQL
+
+
+# Borrowing statistics kept as rollup tables.
+#
+# issue_book and return_book update the rollups with single-row upserts in the
+# same transaction as the loan itself (see circulation.py), so the dashboards
+# read a handful of primary-key or index-range rows instead of aggregating the
+# transactions table:
+#
+# - member_stats: active loans, lifetime borrows, charges and payments per member
+# - book_stats: active loans and lifetime borrows per book
+# - member_book_stats: how often each member borrowed each book
+# - monthly_stats: loans, returns, charges and revenue (amount paid) per month
+#
+# rebuild_rollups() recomputes everything from transactions and
+# transactions_archive, for use after loading transactions behind the app's
+# back (e.g. benchmarks/seed.py).
+
+TOP_BOOKS = 10
+DASHBOARD_MONTHS = 12
+
+MEMBER_ISSUE_SQL = (
+    "INSERT INTO member_stats (member_id, active_loans, lifetime_borrows, total_charged, total_paid, last_borrowed_on) "
+    "VALUES (%s, 1, 1, 0, 0, %s) "
+    "ON DUPLICATE KEY UPDATE active_loans=active_loans+1, lifetime_borrows=lifetime_borrows+1, "
+    "last_borrowed_on=VALUES(last_borrowed_on)"
+)
+BOOK_ISSUE_SQL = (
+    "INSERT INTO book_stats (book_id, active_loans, lifetime_borrows) VALUES (%s, 1, 1) "
+    "ON DUPLICATE KEY UPDATE active_loans=active_loans+1, lifetime_borrows=lifetime_borrows+1"
+)
+MEMBER_BOOK_ISSUE_SQL = (
+    "INSERT INTO member_book_stats (member_id, book_id, borrows) VALUES (%s, %s, 1) "
+    "ON DUPLICATE KEY UPDATE borrows=borrows+1"
+)
+MONTH_ISSUE_SQL = (
+    "INSERT INTO monthly_stats (month, loans, returned, charged, revenue) VALUES (%s, 1, 0, 0, 0) "
+    "ON DUPLICATE KEY UPDATE loans=loans+1"
+)
+MEMBER_RETURN_SQL = (
+    "UPDATE member_stats SET active_loans=active_loans-1, total_charged=total_charged+%s, "
+    "total_paid=total_paid+%s WHERE member_id=%s"
+)
+BOOK_RETURN_SQL = "UPDATE book_stats SET active_loans=active_loans-1 WHERE book_id=%s"
+MONTH_RETURN_SQL = (
+    "INSERT INTO monthly_stats (month, loans, returned, charged, revenue) VALUES (%s, 0, 1, %s, %s) "
+    "ON DUPLICATE KEY UPDATE returned=returned+1, charged=charged+VALUES(charged), revenue=revenue+VALUES(revenue)"
+)
+
+REBUILD_SQL = [
+    "DELETE FROM member_stats",
+    "DELETE FROM book_stats",
+    "DELETE FROM member_book_stats",
+    "DELETE FROM monthly_stats",
+    "INSERT INTO member_stats (member_id, active_loans, lifetime_borrows, total_charged, total_paid, last_borrowed_on) "
+    "SELECT member_id, SUM(returned_on IS NULL), COUNT(*), COALESCE(SUM(total_charge), 0), "
+    f"COALESCE(SUM(amount_paid), 0), MAX(borrowed_on) FROM {HISTORY_SQL} AS t GROUP BY member_id",
+    "INSERT INTO book_stats (book_id, active_loans, lifetime_borrows) "
+    f"SELECT book_id, SUM(returned_on IS NULL), COUNT(*) FROM {HISTORY_SQL} AS t GROUP BY book_id",
+    "INSERT INTO member_book_stats (member_id, book_id, borrows) "
+    f"SELECT member_id, book_id, COUNT(*) FROM {HISTORY_SQL} AS t GROUP BY member_id, book_id",
+    "INSERT INTO monthly_stats (month, loans, returned, charged, revenue) "
+    "SELECT month, SUM(loans), SUM(returned), SUM(charged), SUM(revenue) FROM ("
+    "SELECT DATE_FORMAT(borrowed_on, '%Y-%m-01') AS month, COUNT(*) AS loans, 0 AS returned, "
+    f"0 AS charged, 0 AS revenue FROM {HISTORY_SQL} AS t GROUP BY 1 "
+    "UNION ALL "
+    "SELECT DATE_FORMAT(returned_on, '%Y-%m-01'), 0, COUNT(*), COALESCE(SUM(total_charge), 0), "
+    f"COALESCE(SUM(amount_paid), 0) FROM {HISTORY_SQL} AS t WHERE returned_on IS NOT NULL GROUP BY 1"
+    ") AS months GROUP BY month",
+]
+
+
+def month_of(when):
+    return when.date().replace(day=1)
+
+
+def record_issue(cursor, book_id, member_id, now):
+    cursor.execute(MEMBER_ISSUE_SQL, [member_id, now])
+    cursor.execute(BOOK_ISSUE_SQL, [book_id])
+    cursor.execute(MEMBER_BOOK_ISSUE_SQL, [member_id, book_id])
+    cursor.execute(MONTH_ISSUE_SQL, [month_of(now)])
+
+
+def record_return(cursor, transaction, total_charge, amount_paid, now):
+    cursor.execute(MEMBER_RETURN_SQL, [total_charge, amount_paid, transaction['member_id']])
+    cursor.execute(BOOK_RETURN_SQL, [transaction['book_id']])
+    cursor.execute(MONTH_RETURN_SQL, [month_of(now), total_charge, amount_paid])
+
+
+def member_stats(connection, member_id, top=TOP_BOOKS):
+    # Returns (stats row or None, the member's most borrowed books)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT * FROM member_stats WHERE member_id=%s", [member_id])
+        stats = cursor.fetchone()
+        cursor.execute(
+            "SELECT s.book_id, s.borrows, b.title, b.author FROM member_book_stats s "
+            "JOIN books b ON b.id = s.book_id "
+            "WHERE s.member_id=%s ORDER BY s.borrows DESC, s.book_id DESC LIMIT %s", [member_id, top])
+        books = cursor.fetchall()
+    return stats, books
+
+
+def library_stats(connection, months=DASHBOARD_MONTHS, top=TOP_BOOKS):
+    # Returns (totals, the last `months` months newest first, most borrowed books)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COALESCE(SUM(loans), 0) AS loans, COALESCE(SUM(returned), 0) AS returned, "
+            "COALESCE(SUM(charged), 0) AS charged, COALESCE(SUM(revenue), 0) AS revenue FROM monthly_stats")
+        totals = cursor.fetchone()
+        totals['active_loans'] = totals['loans'] - totals['returned']
+        cursor.execute("SELECT * FROM monthly_stats ORDER BY month DESC LIMIT %s", [months])
+        by_month = cursor.fetchall()
+        cursor.execute(
+            "SELECT s.book_id, s.lifetime_borrows, s.active_loans, b.title, b.author FROM book_stats s "
+            "JOIN books b ON b.id = s.book_id ORDER BY s.lifetime_borrows DESC, s.book_id DESC LIMIT %s", [top])
+        books = cursor.fetchall()
+    return totals, by_month, books
+
+
+def rebuild_rollups(connection):
+    with connection.cursor() as cursor:
+        for statement in REBUILD_SQL:
+            cursor.execute(statement)
+    connection.commit()
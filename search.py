@@ -0,0 +1,266 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+import time
+
+
+# In-process inverted index over the books catalog.
+#
+# Every book is tokenized on title, author and publisher. Each field keeps a
+# posting list per token (token -> {book_id: term frequency}) and a sorted
+# vocabulary used for prefix matching, so a query never touches the books
+# table. The index is built from any DB-API cursor (MySQL in the app, SQLite
+# works too) and then kept current by the write routes calling add()/remove().
+# Writes of other processes are picked up by a reload: stale() tells when the
+# books table version the index was loaded at has changed or `max_age` has
+# passed, and a reload builds the new index aside and swaps it in.
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+FIELDS = ('title', 'author', 'publisher')
+FIELD_WEIGHTS = {'title': 3.0, 'author': 2.0, 'publisher': 1.0}
+
+# Prefix matches score lower than exact token matches
+PREFIX_WEIGHT = 0.6
+# Shorter prefixes would expand to a large part of the vocabulary
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_EXPANSION = 64
+
+LOAD_CHUNK = 5000
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return [token.lower() for token in TOKEN_RE.findall(str(text))]
+
+
+class SearchIndex:
+    def __init__(self, fields=FIELDS, max_age=None):
+        self.fields = tuple(fields)
+        self.max_age = max_age
+        self.loaded = False
+        self.loaded_at = None
+        self.version = None
+        self._lock = threading.RLock()
+        self._refreshing = False
+        self._pending = None
+        self._clear()
+
+    def _clear(self):
+        self._postings = {field: {} for field in self.fields}
+        self._vocabulary = {field: [] for field in self.fields}
+        self._documents = {}
+
+    def __len__(self):
+        return len(self._documents)
+
+    def load(self, rows, version=None):
+        # rows are (id, title, author, publisher) tuples or dicts with those
+        # keys. Searches keep using the current index while the new one is
+        # built; writes made meanwhile are applied again on top of it.
+        with self._lock:
+            self._pending = []
+        # The vocabularies are sorted once at the end rather than kept sorted
+        # token by token
+        index = SearchIndex(self.fields)
+        for row in rows:
+            index._add(row, sort=False)
+        for field in index.fields:
+            index._vocabulary[field] = sorted(index._postings[field])
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._postings, self._vocabulary, self._documents = index._postings, index._vocabulary, index._documents
+            for book_id, row in pending:
+                if row is None:
+                    self._remove(book_id)
+                else:
+                    self._add(row)
+            self.loaded = True
+            self.loaded_at = time.monotonic()
+            self.version = version
+            self._refreshing = False
+
+    def load_from_cursor(self, cursor, version=None):
+        cursor.execute("SELECT id, " + ", ".join(self.fields) + " FROM books")
+
+        def rows():
+            while True:
+                chunk = cursor.fetchmany(LOAD_CHUNK)
+                if not chunk:
+                    break
+                yield from chunk
+
+        self.load(rows(), version)
+
+    def load_once(self, load):
+        # Calls load() unless the index is loaded; concurrent callers wait for
+        # the first one instead of loading again
+        with self._lock:
+            if not self.loaded:
+                load()
+
+    def invalidate(self):
+        # The next reader reloads the index
+        with self._lock:
+            self.loaded = False
+
+    def expire(self):
+        # The next reader reloads the index in the background
+        with self._lock:
+            self.version = None
+
+    def stale(self, version):
+        # True once the books table is at another version than the index was
+        # loaded at, or the index is older than max_age
+        return self.loaded and (version != self.version or (
+            self.max_age is not None and time.monotonic() - self.loaded_at > self.max_age))
+
+    def follow(self, previous, version):
+        # The books table went from `previous` to `version` through writes
+        # already applied here
+        with self._lock:
+            if self.version == previous:
+                self.version = version
+
+    def start_refresh(self):
+        # True for the one caller that should reload a stale index
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+            return True
+
+    def add(self, book):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self._row_to_document(book)[0], book))
+            self._add(book)
+
+    def remove(self, book_id):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((int(book_id), None))
+            self._remove(int(book_id))
+
+    def _row_to_document(self, row):
+        if isinstance(row, dict):
+            return int(row['id']), {field: row.get(field) for field in self.fields}
+        book_id, *values = row
+        return int(book_id), dict(zip(self.fields, values))
+
+    def _add(self, row, sort=True):
+        book_id, values = self._row_to_document(row)
+        if book_id in self._documents:
+            self._remove(book_id)
+
+        tokens = {}
+        for field in self.fields:
+            counts = {}
+            for token in tokenize(values.get(field)):
+                counts[token] = counts.get(token, 0) + 1
+            postings = self._postings[field]
+            for token, count in counts.items():
+                posting = postings.get(token)
+                if posting is None:
+                    posting = postings[token] = {}
+                    if sort:
+                        bisect.insort(self._vocabulary[field], token)
+                posting[book_id] = count
+            tokens[field] = tuple(counts)
+        self._documents[book_id] = tokens
+
+    def _remove(self, book_id):
+        tokens = self._documents.pop(book_id, None)
+        if tokens is None:
+            return
+        for field, field_tokens in tokens.items():
+            postings = self._postings[field]
+            vocabulary = self._vocabulary[field]
+            for token in field_tokens:
+                posting = postings.get(token)
+                if posting is None:
+                    continue
+                posting.pop(book_id, None)
+                if not posting:
+                    del postings[token]
+                    i = bisect.bisect_left(vocabulary, token)
+                    if i < len(vocabulary) and vocabulary[i] == token:
+                        del vocabulary[i]
+
+    def _expand(self, field, token):
+        # Yields (term, weight) for the exact token and the terms it prefixes
+        vocabulary = self._vocabulary[field]
+        if token in self._postings[field]:
+            yield token, 1.0
+        if len(token) < MIN_PREFIX_LENGTH:
+            return
+        i = bisect.bisect_right(vocabulary, token)
+        expanded = 0
+        while i < len(vocabulary) and expanded < MAX_PREFIX_EXPANSION:
+            term = vocabulary[i]
+            if not term.startswith(token):
+                break
+            yield term, PREFIX_WEIGHT
+            i += 1
+            expanded += 1
+
+    def _match(self, query, fields):
+        # Every query token has to match (in any of the fields); the score is
+        # a field-weighted tf-idf summed over the tokens. Tokens are resolved
+        # rarest first so later ones only probe the surviving candidates.
+        total = len(self._documents) or 1
+        plans = []
+        for token in dict.fromkeys(tokenize(query)):
+            terms = []
+            for field in fields:
+                field_weight = FIELD_WEIGHTS.get(field, 1.0)
+                for term, term_weight in self._expand(field, token):
+                    posting = self._postings[field][term]
+                    idf = math.log(1 + total / len(posting))
+                    terms.append((posting, field_weight * term_weight * idf))
+            if not terms:
+                return {}
+            plans.append((sum(len(posting) for posting, _ in terms), terms))
+        plans.sort(key=lambda plan: plan[0])
+
+        scores = None
+        for _, terms in plans:
+            if scores is None:
+                scores = {}
+                for posting, weight in terms:
+                    for book_id, count in posting.items():
+                        score = weight * (1 + math.log(count))
+                        if score > scores.get(book_id, 0):
+                            scores[book_id] = score
+            else:
+                matched = {}
+                for book_id, score in scores.items():
+                    best = 0
+                    for posting, weight in terms:
+                        count = posting.get(book_id)
+                        if count:
+                            best = max(best, weight * (1 + math.log(count)))
+                    if best:
+                        matched[book_id] = score + best
+                scores = matched
+            if not scores:
+                break
+        return scores or {}
+
+    def search(self, query, fields=None, offset=0, limit=20):
+        return self.search_any([(query, fields)], offset, limit)
+
+    def search_any(self, clauses, offset=0, limit=20):
+        # clauses is a list of (query, fields); a book matching any clause is
+        # returned and the scores of the clauses it matches are added up.
+        # Returns (total number of matches, [(book_id, score), ...]).
+        with self._lock:
+            scores = {}
+            for query, fields in clauses:
+                for book_id, score in self._match(query, fields or self.fields).items():
+                    scores[book_id] = scores.get(book_id, 0) + score
+        ranked = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        return len(scores), ranked[offset:]
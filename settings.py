@@ -0,0 +1,31 @@
+import configparser
+import os
+
+
+# Configuration for the app and the command-line tools.
+#
+# Settings are read from an ini file (config.ini in the working directory,
+# or the file named by $LIBRARY_CONFIG) and any key can be set or overridden
+# from the environment as LIBRARY_<SECTION>_<KEY>, e.g. LIBRARY_DATABASE_HOST
+# or LIBRARY_DATABASE_POOL_SIZE, so containers can run without a file.
+
+CONFIG_FILE = 'config.ini'
+ENV_PREFIX = 'LIBRARY_'
+CONFIG_FILE_VARIABLE = 'LIBRARY_CONFIG'
+
+
+def load_config(path=None, environ=None):
+    environ = os.environ if environ is None else environ
+    config = configparser.ConfigParser()
+    config.read(path or environ.get(CONFIG_FILE_VARIABLE, CONFIG_FILE))
+    for name, value in environ.items():
+        if not name.startswith(ENV_PREFIX) or name == CONFIG_FILE_VARIABLE:
+            continue
+        section, _, key = name[len(ENV_PREFIX):].lower().partition('_')
+        if not key:
+            continue
+        if not config.has_section(section):
+            config.add_section(section)
+        # Escaped so a literal % (e.g. in a password) survives interpolation
+        config.set(section, key, value.replace('%', '%%'))
+    return config
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+
+# The modules live at the repository root and the fake frappe API in
+# benchmarks/; run the tests from anywhere with `python -m pytest tests`.
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+from fake_frappe import start_server
+
+
+class Draws:
+    # Stands in for the fake server's random source, so a test decides which
+    # requests get a fault: 0.0 draws the first configured fault, 0.99 none
+    def __init__(self, *values):
+        self.values = list(values)
+
+    def random(self):
+        return self.values.pop(0) if self.values else 0.99
+
+
+@pytest.fixture
+def frappe_server():
+    # start(**options) starts benchmarks/fake_frappe.py and returns
+    # (base_url, state); draws=[...] fixes which requests get a fault
+    servers = []
+
+    def start(draws=(), **options):
+        server, base_url = start_server(**options)
+        servers.append(server)
+        state = server.RequestHandlerClass.state
+        state['rng'] = Draws(*draws)
+        return base_url, state
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+# An in-memory SQLite books table behind the MySQLdb connection interface,
+# translating %s placeholders and the importer's ON DUPLICATE KEY UPDATE
+
+BOOK_COLUMNS = ('id', 'title', 'author', 'average_rating', 'isbn', 'isbn13', 'language_code', 'num_pages',
+                'ratings_count', 'text_reviews_count', 'publication_date', 'publisher', 'total_quantity',
+                'available_quantity')
+
+
+class SQLiteCursor:
+    # The part of a MySQLdb DictCursor the importer and the bulk loader use
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    @staticmethod
+    def sql(query):
+        return query.replace('%s', '?').replace('ON DUPLICATE KEY UPDATE id=id', 'ON CONFLICT DO NOTHING')
+
+    def execute(self, query, args=()):
+        self.cursor.execute(self.sql(query), list(args))
+
+    def executemany(self, query, rows):
+        self.cursor.executemany(self.sql(query), rows)
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def fetchall(self):
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def close(self):
+        self.cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SQLiteConnection:
+    def __init__(self):
+        self.db = sqlite3.connect(':memory:', check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute(f"CREATE TABLE books (id INTEGER PRIMARY KEY, {', '.join(BOOK_COLUMNS[1:])})")
+
+    def cursor(self):
+        return SQLiteCursor(self.db.cursor())
+
+    def commit(self):
+        self.db.commit()
+
+    def add_book(self, book_id, title='Existing'):
+        self.db.execute("INSERT INTO books (id, title) VALUES (?, ?)", (book_id, title))
+        self.db.commit()
+
+    def ids(self):
+        return [row['id'] for row in self.db.execute("SELECT id FROM books ORDER BY id")]
+
+
+@pytest.fixture
+def books_db():
+    return SQLiteConnection()
@@ -0,0 +1,148 @@
+import io
+import json
+
+import pytest
+from wtforms import Form, validators, StringField, FloatField, IntegerField, DateField
+
+import bulk_load
+from bulk_load import BulkLoader, ErrorFile, iter_json_array, read_records
+
+
+# bulk_load's JSON array reader, and BulkLoader writing to an in-memory
+# SQLite books table (books_db)
+
+class Book(Form):
+    # app.AddBook's fields and rules; app.py needs a MySQL driver to import
+    id = StringField('Book ID', [validators.Length(min=1, max=11),
+                                 validators.Regexp(r'^\d+$', message='Book ID must be a number')])
+    title = StringField('Title', [validators.Length(min=2, max=255)])
+    author = StringField('Author', [validators.Length(min=2, max=255)])
+    language_code = StringField('Language', [validators.Length(min=1, max=10)])
+    total_quantity = IntegerField('Total Number of Books', [validators.NumberRange(min=1, max=100)])
+    isbn = StringField('ISBN', [validators.Length(min=10, max=10)])
+    isbn13 = StringField('ISBN13', [validators.Length(min=13, max=13)])
+    average_rating = FloatField('Average Rating', [validators.NumberRange(min=0, max=5)])
+    num_pages = IntegerField('Number of Pages', [validators.NumberRange(min=1)])
+    ratings_count = IntegerField('Number of Ratings', [validators.NumberRange(min=0)])
+    text_reviews_count = IntegerField('Number of Text Reviews', [validators.NumberRange(min=0)])
+    publisher = StringField('Publisher Name ', [validators.Length(min=2, max=255)])
+    publication_date = DateField('Publication Date', [validators.InputRequired()])
+
+
+def book(book_id, **values):
+    record = {'id': str(book_id), 'title': f'Book {book_id}', 'author': 'Some Author', 'language_code': 'eng',
+              'total_quantity': '2', 'isbn': '0439785960', 'isbn13': '9780439785969', 'average_rating': '4.5',
+              'num_pages': '300', 'ratings_count': '10', 'text_reviews_count': '1', 'publisher': 'Publisher',
+              'publication_date': '2006-09-16'}
+    record.update(values)
+    return record
+
+
+def read(text):
+    return list(iter_json_array(io.StringIO(text)))
+
+
+@pytest.fixture
+def small_reads(monkeypatch):
+    # Records and strings split across reads
+    monkeypatch.setattr(bulk_load, 'JSON_READ_SIZE', 7)
+
+
+@pytest.mark.parametrize('read_size', [bulk_load.JSON_READ_SIZE, 7])
+def test_iter_json_array(read_size, monkeypatch):
+    monkeypatch.setattr(bulk_load, 'JSON_READ_SIZE', read_size)
+    records = [
+        {'id': 1, 'title': 'Brackets [in] a {string}', 'tags': ['a', ['b', {'c': None}]]},
+        {'id': 2, 'title': 'Quote \" and ]}, escaped', 'series': {'name': 'Nested', 'parts': [1, 2, 3]}},
+        {'id': 3, 'title': 'Ünïcödé', 'empty': [], 'nothing': {}},
+    ]
+    assert read(json.dumps(records)) == records
+    assert read('\n  [\n' + ',\n'.join(json.dumps(record) for record in records) + '\n]\n') == records
+
+
+@pytest.mark.parametrize('text', ['[]', '  [ ]  ', '[\n]\n'])
+def test_iter_json_array_empty(text, small_reads):
+    assert read(text) == []
+
+
+@pytest.mark.parametrize('text', ['[{"id": 1}', '[{"id": 1}, {"id": 2', '[{"title": "]"', '[{"id": 1},'])
+def test_iter_json_array_truncated(text, small_reads):
+    with pytest.raises(json.JSONDecodeError):
+        read(text)
+
+
+@pytest.mark.parametrize('text', ['', '   ', '{"id": 1}', 'null'])
+def test_iter_json_array_not_an_array(text):
+    with pytest.raises(ValueError, match='Expected a JSON array'):
+        read(text)
+
+
+def test_iter_json_array_stops_at_the_end_of_the_array():
+    f = io.StringIO('[{"id": 1}] trailing')
+    assert list(iter_json_array(f)) == [{'id': 1}]
+
+
+def test_read_records(tmp_path):
+    records = [book(1), book(2, title='Title, with "quotes"')]
+    (tmp_path / 'books.json').write_text(json.dumps(records), encoding='utf-8')
+    (tmp_path / 'books.jsonl').write_text('\n'.join(json.dumps(record) for record in records) + '\n\n',
+                                          encoding='utf-8')
+    with open(tmp_path / 'books.csv', 'w', encoding='utf-8', newline='') as f:
+        f.write(','.join(records[0]) + '\r\n')
+        for record in records:
+            f.write(','.join('"' + value.replace('"', '""') + '"' for value in record.values()) + '\r\n')
+    for name in ('books.json', 'books.jsonl', 'books.csv'):
+        assert [record for _, record in read_records(str(tmp_path / name))] == records
+    assert [number for number, _ in read_records(str(tmp_path / 'books.csv'))] == [2, 3]
+    (tmp_path / 'books.xml').write_text('<books/>', encoding='utf-8')
+    with pytest.raises(ValueError, match='Unsupported file type'):
+        list(read_records(str(tmp_path / 'books.xml')))
+
+
+def test_loads_books(books_db):
+    loaded = []
+    progress = []
+    loader = BulkLoader(books_db, Book, batch_size=2)
+    result = loader.run(enumerate([book(1), book(2), book(3)], 1), progress=lambda result: progress.append(
+        result.loaded), loaded=loaded.extend)
+    assert (result.read, result.loaded, result.rejected, result.errors) == (3, 3, 0, [])
+    assert books_db.ids() == [1, 2, 3]
+    assert loaded == [(1, 'Book 1', 'Some Author', 'Publisher'), (2, 'Book 2', 'Some Author', 'Publisher'),
+                      (3, 'Book 3', 'Some Author', 'Publisher')]
+    # Once per chunk
+    assert progress == [2, 3]
+    row = books_db.db.execute("SELECT * FROM books WHERE id=2").fetchone()
+    assert (row['total_quantity'], row['available_quantity'], row['num_pages']) == (2, 2, 300)
+
+
+def test_rejects_invalid_and_duplicate_rows(books_db, tmp_path):
+    books_db.add_book(5)
+    records = [book(1), book(2, id='abc'), book(3, average_rating='9'), book(5), book('0001'),
+               book(4, title='')]
+    path = tmp_path / 'errors.csv'
+    with ErrorFile(str(path)) as errors:
+        result = BulkLoader(books_db, Book, batch_size=2).run(enumerate(records, 1), errors=errors)
+    assert (result.read, result.loaded, result.rejected) == (6, 1, 5)
+    assert books_db.ids() == [1, 5]
+    # Invalid rows are rejected as they are read, duplicates when their
+    # chunk is written
+    assert [(error['row'], list(error['errors'])) for error in result.errors] == [
+        (2, ['id']), (3, ['average_rating']), (4, ['id']), (6, ['title']), (5, ['id'])]
+    # '0001' is book 1 again
+    assert result.errors[-1]['id'] == 1
+    lines = path.read_text(encoding='utf-8').splitlines()
+    assert lines[0] == 'row,id,field,error'
+    assert lines[-1] == '5,1,id,Book with that ID already exists'
+    assert len(lines) == 6
+
+
+def test_keeps_the_first_errors_only(books_db, monkeypatch):
+    monkeypatch.setattr(bulk_load, 'MAX_ERRORS', 3)
+    result = BulkLoader(books_db, Book).run(enumerate([book(n, title='') for n in range(1, 11)], 1))
+    assert (result.rejected, len(result.errors)) == (10, 3)
+
+
+def test_dry_run(books_db):
+    result = BulkLoader(books_db, Book, dry_run=True).run(enumerate([book(1), book(1)], 1))
+    assert (result.loaded, result.rejected) == (1, 1)
+    assert books_db.ids() == []
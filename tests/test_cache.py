@@ -0,0 +1,171 @@
+import pytest
+
+import cache
+from cache import LRUCache, TableVersions
+
+
+# cache.LRUCache and TableVersions on a fake clock, and the ETag handling of
+# app.conditional() built on them
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, 'time', clock)
+    return clock
+
+
+def test_lru_eviction(clock):
+    lru = LRUCache(maxsize=3)
+    for key in 'abc':
+        lru.set(key, key.upper())
+    assert lru.get('a') == 'A'
+    lru.set('d', 'D')
+    # b was the least recently used once a was read
+    assert lru.get('b') is None
+    assert [lru.get(key) for key in 'acd'] == ['A', 'C', 'D']
+    lru.set('c', 'C2')
+    lru.set('e', 'E')
+    assert lru.get('a') is None
+    assert [lru.get(key) for key in 'cde'] == ['C2', 'D', 'E']
+    assert len(lru) == 3
+
+
+def test_lru_ttl(clock):
+    lru = LRUCache(ttl=60)
+    lru.set('a', 1)
+    clock.now += 30
+    lru.set('b', 2)
+    clock.now += 30
+    assert lru.get('a', 'expired') == 1
+    clock.now += 0.1
+    assert lru.get('a', 'expired') == 'expired'
+    assert lru.get('b') == 2
+    assert len(lru) == 1
+    # Setting a key again restarts its time to live
+    clock.now += 20
+    lru.set('b', 3)
+    clock.now += 50
+    assert lru.get('b') == 3
+
+
+def test_lru_without_ttl(clock):
+    lru = LRUCache(maxsize=2, ttl=None)
+    lru.set('a', 1)
+    clock.now += 10 ** 9
+    assert lru.get('a') == 1
+    lru.set('b', 2)
+    lru.set('c', 3)
+    assert lru.get('a') is None
+
+
+def test_lru_stats(clock):
+    lru = LRUCache(maxsize=10, ttl=5)
+    lru.set('a', 1)
+    lru.get('a')
+    lru.get('b')
+    clock.now += 6
+    lru.get('a')
+    lru.delete('missing')
+    assert lru.stats() == {'backend': 'memory', 'size': 0, 'maxsize': 10, 'ttl': 5, 'hits': 1, 'misses': 2}
+
+
+def test_table_versions():
+    versions = TableVersions(LRUCache(ttl=None))
+    books = versions.get('books')
+    assert versions.get('books') == books
+    members = versions.get('members')
+    assert versions.key(['books', 'members']) == f'{books}-{members}'
+
+    bumped = versions.bump('books')
+    assert set(bumped) == {'books'}
+    assert bumped['books'] == versions.get('books') != books
+    assert versions.get('members') == members
+    both = versions.bump('books', 'members')
+    assert versions.key(['books', 'members']) == f"{both['books']}-{both['members']}"
+
+
+def test_lost_table_version_is_replaced(clock):
+    versions = TableVersions(LRUCache(ttl=60))
+    books = versions.get('books')
+    clock.now += 61
+    assert versions.get('books') != books
+
+
+# app.conditional() needs the app's MySQL driver to import, not a database:
+# the schema check is off and the view never queries
+
+@pytest.fixture
+def client(monkeypatch):
+    pytest.importorskip('MySQLdb')
+    for key, value in (('DATABASE_HOST', 'localhost'), ('DATABASE_USER', 'library'),
+                       ('DATABASE_PASSWORD', ''), ('DATABASE_PORT', '3306'), ('DATABASE_DB', 'library'),
+                       ('DATABASE_SCHEMA_CHECK', 'off'), ('APP_SECRET_KEY', 'test')):
+        monkeypatch.setenv('LIBRARY_' + key, value)
+    monkeypatch.setenv('LIBRARY_CONFIG', '/nonexistent/config.ini')
+    import app as library
+
+    library.create_app()
+    if 'conditional_test' not in library.app.view_functions:
+        calls = []
+
+        def view():
+            calls.append(1)
+            return 'rendered'
+
+        library.app.add_url_rule('/conditional-test', 'conditional_test', library.conditional('books')(view))
+        library.app.view_calls = calls
+    library.app.view_calls.clear()
+    monkeypatch.setitem(library.app.config, 'PAGE_CACHE', True)
+    client = library.app.test_client()
+    client.library = library
+    return client
+
+
+def test_etag(client):
+    response = client.get('/conditional-test')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-cache'
+    etag = response.headers['ETag']
+
+    response = client.get('/conditional-test', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.data == b''
+    assert len(client.library.app.view_calls) == 1
+
+
+def test_etag_changes_with_the_tables(client):
+    etag = client.get('/conditional-test').headers['ETag']
+    client.library.changed('members')
+    assert client.get('/conditional-test', headers={'If-None-Match': etag}).status_code == 304
+    client.library.changed('books')
+    response = client.get('/conditional-test', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_etag_depends_on_the_query(client):
+    etag = client.get('/conditional-test?page=1').headers['ETag']
+    assert client.get('/conditional-test?page=2', headers={'If-None-Match': etag}).status_code == 200
+    assert client.get('/conditional-test?page=1', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_no_etag_with_flashed_messages_or_page_cache_off(client):
+    etag = client.get('/conditional-test').headers['ETag']
+    with client.session_transaction() as session:
+        session['_flashes'] = [('success', 'Book Added')]
+    response = client.get('/conditional-test', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+    client.library.app.config['PAGE_CACHE'] = False
+    response = client.get('/conditional-test', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
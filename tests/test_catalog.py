@@ -0,0 +1,126 @@
+import sqlite3
+
+import pytest
+
+from catalog import CatalogSnapshot
+
+
+# catalog.CatalogSnapshot loaded from an in-memory SQLite books table
+
+BOOKS = [
+    (1, 'The River Between', 'Ngugi wa Thiongo', 3, 1),
+    (2, 'A River Runs Through It', 'Norman Maclean', 2, 2),
+    (4, 'Harry Potter and the Chamber of Secrets', 'J.K. Rowling', 5, 0),
+    (5, 'Harry Potter and the Prisoner of Azkaban', 'J.K. Rowling', 1, 1),
+    (7, 'Cien años de soledad', 'Gabriel García Márquez', 2, 1),
+]
+
+
+@pytest.fixture
+def catalog():
+    connection = sqlite3.connect(':memory:')
+    connection.execute("CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT, author TEXT, "
+                       "total_quantity INTEGER, available_quantity INTEGER)")
+    # Inserted out of order; the snapshot reads them sorted by id
+    connection.executemany("INSERT INTO books VALUES (?, ?, ?, ?, ?)", reversed(BOOKS))
+    catalog = CatalogSnapshot()
+    catalog.load_from_cursor(connection.cursor(), version='v1')
+    connection.close()
+    return catalog
+
+
+def ids(rows):
+    return [row['id'] for row in rows]
+
+
+def test_load_from_cursor(catalog):
+    assert catalog.loaded
+    assert catalog.version == 'v1'
+    assert len(catalog) == len(BOOKS)
+    assert catalog.get(7) == {'id': 7, 'title': 'Cien años de soledad', 'author': 'Gabriel García Márquez',
+                              'total_quantity': 2, 'available_quantity': 1}
+    assert catalog.get(3) is None
+    assert catalog.availability(4) == (5, 0)
+    # Authors are stored once
+    assert catalog.stats()['authors'] == 4
+
+
+def test_load_dict_rows():
+    catalog = CatalogSnapshot()
+    catalog.load([{'id': 1, 'title': None, 'author': None, 'total_quantity': None, 'available_quantity': None}])
+    assert catalog.get(1) == {'id': 1, 'title': '', 'author': '', 'total_quantity': 0, 'available_quantity': 0}
+
+
+def test_page(catalog):
+    assert ids(catalog.page(limit=2)) == [1, 2]
+    assert ids(catalog.page(after=2, limit=2)) == [4, 5]
+    assert ids(catalog.page(after=5, limit=2)) == [7]
+    assert catalog.page(after=7) == []
+    assert ids(catalog.page(before=5, limit=2)) == [2, 4]
+    assert ids(catalog.page(before=2, limit=2)) == [1]
+    # Ids that are not in the snapshot still position the page
+    assert ids(catalog.page(after=3, limit=1)) == [4]
+    assert ids(catalog.page(before=6, limit=1)) == [5]
+
+
+def test_put_new_book(catalog):
+    catalog.put((3, 'Dune', 'Frank Herbert', 1, 1))
+    assert ids(catalog.page()) == [1, 2, 3, 4, 5, 7]
+    assert catalog.get(3)['title'] == 'Dune'
+    catalog.put((9, 'Emma', 'Jane Austen', 1, 0))
+    assert ids(catalog.page())[-1] == 9
+
+
+def test_put_replaces_a_book(catalog):
+    catalog.put({'id': 4, 'title': 'Harry Potter 2', 'author': 'Rowling', 'total_quantity': 6,
+                 'available_quantity': 2})
+    assert len(catalog) == len(BOOKS)
+    assert catalog.get(4) == {'id': 4, 'title': 'Harry Potter 2', 'author': 'Rowling', 'total_quantity': 6,
+                              'available_quantity': 2}
+    assert catalog.get(5)['title'] == 'Harry Potter and the Prisoner of Azkaban'
+
+
+def test_remove(catalog):
+    catalog.remove(4)
+    catalog.remove('5')
+    catalog.remove(6)
+    assert ids(catalog.page()) == [1, 2, 7]
+    assert catalog.get(4) is None
+    assert catalog.availability(5) is None
+
+
+def test_titles_survive_compaction(catalog):
+    # Replacing titles leaves garbage behind until the buffer is rewritten
+    for n in range(20):
+        catalog.put((1, f'Title {n}', 'Author', 1, 1))
+    assert len(catalog._titles) < 2 * sum(len(row['title'].encode()) for row in catalog.page())
+    assert [row['title'] for row in catalog.page(limit=3)] == ['Title 19', 'A River Runs Through It',
+                                                               'Harry Potter and the Chamber of Secrets']
+    assert catalog.get(7)['title'] == 'Cien años de soledad'
+
+
+def test_stale(catalog):
+    assert not catalog.stale('v1')
+    assert catalog.stale('v2')
+    catalog.follow('v1', 'v2')
+    assert not catalog.stale('v2')
+    catalog.follow('v1', 'v3')
+    assert catalog.version == 'v2'
+    catalog.max_age = 0
+    assert catalog.stale('v2')
+    catalog.invalidate()
+    assert not catalog.stale('v3')
+
+
+def test_writes_during_load_are_applied_again(catalog):
+    def rows():
+        yield BOOKS[0]
+        # Written while the rows are read; the rows themselves predate it
+        catalog.put((2, 'Renamed', 'Norman Maclean', 2, 1))
+        catalog.remove(5)
+        yield from BOOKS[1:]
+
+    catalog.load(rows(), version='v2')
+    assert catalog.get(2)['title'] == 'Renamed'
+    assert catalog.get(5) is None
+    assert len(catalog) == len(BOOKS) - 1
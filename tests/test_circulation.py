@@ -0,0 +1,326 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+MySQLdb = pytest.importorskip('MySQLdb')
+
+import circulation
+import rollups
+from circulation import (run_transaction, issue_book, cancel_hold, _issue, _close_hold, _release_copy,
+                         NotFound, BookUnavailable, HoldClosed, WAITING, READY, FULFILLED, CANCELLED, EXPIRED)
+
+
+# circulation's transaction retries, issue path and hold state transitions,
+# run against a stub connection whose cursor answers the statements
+# circulation.py uses from a few dicts
+
+NOW = datetime(2024, 3, 1, 10, 0)
+ROLLUP_STATEMENTS = (rollups.MEMBER_ISSUE_SQL, rollups.BOOK_ISSUE_SQL, rollups.MEMBER_BOOK_ISSUE_SQL,
+                     rollups.MONTH_ISSUE_SQL, rollups.MEMBER_RETURN_SQL, rollups.BOOK_RETURN_SQL,
+                     rollups.MONTH_RETURN_SQL)
+
+
+class Cursor:
+    def __init__(self, library):
+        self.library = library
+        self.rows = []
+        self.lastrowid = None
+
+    def execute(self, query, args=()):
+        if self.library.before_execute:
+            self.library.before_execute(query, args)
+        rowcount, self.rows = self.library.answer(query, list(args))
+        if query.startswith('INSERT'):
+            self.lastrowid = rowcount
+            rowcount = 1
+        return rowcount
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def close(self):
+        pass
+
+
+class Library:
+    def __init__(self, members=(1, 2, 3), books=None, holds=()):
+        self.members = set(members)
+        # book id -> available copies
+        self.books = dict(books or {})
+        self.holds = {hold['id']: dict(hold) for hold in holds}
+        self.transactions = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.before_execute = None
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def answer(self, query, args):
+        # (rowcount, rows), or (lastrowid, rows) for an INSERT
+        if query in ROLLUP_STATEMENTS:
+            return 1, []
+        if query == "SELECT id FROM members WHERE id=%s":
+            return 0, [{'id': args[0]}] if args[0] in self.members else []
+        if query in ("SELECT id FROM books WHERE id=%s", "SELECT id FROM books WHERE id=%s FOR UPDATE"):
+            return 0, [{'id': args[0]}] if args[0] in self.books else []
+        if query == ("UPDATE books SET available_quantity=available_quantity-1 "
+                     "WHERE id=%s AND available_quantity > 0"):
+            if self.books.get(args[0], 0) > 0:
+                self.books[args[0]] -= 1
+                return 1, []
+            return 0, []
+        if query == "UPDATE books SET available_quantity=available_quantity+1 WHERE id=%s":
+            self.books[args[0]] += 1
+            return 1, []
+        if query == "UPDATE books SET available_quantity=available_quantity-1 WHERE id=%s":
+            self.books[args[0]] -= 1
+            return 1, []
+        if query == "SELECT id, status FROM holds WHERE book_id=%s AND member_id=%s AND status IN (%s, %s)":
+            return 0, [{'id': hold['id'], 'status': hold['status']} for hold in self.holds.values()
+                       if (hold['book_id'], hold['member_id']) == tuple(args[:2]) and hold['status'] in args[2:]]
+        if query == "SELECT id, member_id FROM holds WHERE book_id=%s AND status=%s ORDER BY id LIMIT 1 FOR UPDATE":
+            waiting = sorted(hold['id'] for hold in self.holds.values() if [hold['book_id'], hold['status']] == args)
+            return 0, [{'id': hold_id, 'member_id': self.holds[hold_id]['member_id']} for hold_id in waiting[:1]]
+        if query == "SELECT * FROM holds WHERE id=%s":
+            return 0, [dict(self.holds[args[0]])] if args[0] in self.holds else []
+        if query == "UPDATE holds SET status=%s, closed_on=%s WHERE id=%s AND status=%s":
+            status, closed_on, hold_id, current = args
+            hold = self.holds.get(hold_id)
+            if not hold or hold['status'] != current:
+                return 0, []
+            hold.update(status=status, closed_on=closed_on)
+            return 1, []
+        if query == "UPDATE holds SET status=%s, ready_on=%s WHERE id=%s":
+            self.holds[args[2]].update(status=args[0], ready_on=args[1])
+            return 1, []
+        if query.startswith("INSERT INTO transactions "):
+            self.transactions.append(args)
+            return len(self.transactions), []
+        raise AssertionError(f'Unexpected statement: {query}')
+
+    def statuses(self):
+        return {hold_id: hold['status'] for hold_id, hold in self.holds.items()}
+
+
+def hold(hold_id, book_id, member_id, status):
+    return {'id': hold_id, 'book_id': book_id, 'member_id': member_id, 'status': status,
+            'ready_on': None, 'closed_on': None}
+
+
+# run_transaction
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # Backoff delays, with the jitter at its maximum
+    sleeps = []
+    monkeypatch.setattr(circulation, 'time', SimpleNamespace(sleep=sleeps.append))
+    monkeypatch.setattr(circulation, 'random', SimpleNamespace(random=lambda: 1.0))
+    return sleeps
+
+
+def failing(errors, result='done'):
+    # fn failing with each of `errors` in turn, then returning `result`
+    errors = list(errors)
+    calls = []
+
+    def fn(cursor, *args):
+        calls.append(args)
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    fn.calls = calls
+    return fn
+
+
+def deadlock():
+    return MySQLdb.OperationalError(circulation.ER_LOCK_DEADLOCK, 'Deadlock found when trying to get lock')
+
+
+def lock_wait_timeout():
+    return MySQLdb.OperationalError(circulation.ER_LOCK_WAIT_TIMEOUT, 'Lock wait timeout exceeded')
+
+
+def test_run_transaction_commits():
+    library = Library()
+    fn = failing([])
+    assert run_transaction(library, fn, 1, 2) == 'done'
+    assert fn.calls == [(1, 2)]
+    assert (library.commits, library.rollbacks) == (1, 0)
+
+
+def test_run_transaction_retries_deadlocks(sleeps):
+    library = Library()
+    fn = failing([deadlock(), lock_wait_timeout(), deadlock()])
+    assert run_transaction(library, fn) == 'done'
+    assert len(fn.calls) == 4
+    assert (library.commits, library.rollbacks) == (1, 3)
+    assert sleeps == [circulation.RETRY_BACKOFF * 2 ** attempt for attempt in range(3)]
+
+
+def test_run_transaction_gives_up(sleeps):
+    library = Library()
+    fn = failing([deadlock()] * 10)
+    with pytest.raises(MySQLdb.OperationalError):
+        run_transaction(library, fn, retries=2)
+    assert len(fn.calls) == 3
+    assert (library.commits, library.rollbacks) == (0, 3)
+    assert len(sleeps) == 2
+
+
+@pytest.mark.parametrize('error', [
+    MySQLdb.OperationalError(2006, 'MySQL server has gone away'),
+    MySQLdb.OperationalError(),
+    BookUnavailable('No copies'),
+    ValueError('bug'),
+])
+def test_run_transaction_does_not_retry_other_errors(error, sleeps):
+    library = Library()
+    fn = failing([error])
+    with pytest.raises(type(error)):
+        run_transaction(library, fn)
+    assert len(fn.calls) == 1
+    assert (library.commits, library.rollbacks) == (0, 1)
+    assert sleeps == []
+
+
+# Issuing
+
+def test_issue_takes_an_available_copy():
+    library = Library(books={10: 2})
+    assert issue_book(library, 10, 1, 5, now=NOW) == 1
+    assert library.books[10] == 1
+    assert library.transactions == [[10, 1, 5, NOW]]
+    assert library.commits == 1
+
+
+def test_issue_fulfils_a_ready_hold_with_its_set_aside_copy():
+    library = Library(books={10: 0}, holds=[hold(7, 10, 1, READY)])
+    _issue(library.cursor(), 10, 1, 5, NOW)
+    assert library.statuses() == {7: FULFILLED}
+    assert library.holds[7]['closed_on'] == NOW
+    # The copy was already taken off the shelf for the hold
+    assert library.books[10] == 0
+
+
+def test_issue_fulfils_a_waiting_hold_from_the_shelf():
+    library = Library(books={10: 1}, holds=[hold(7, 10, 1, WAITING), hold(8, 10, 2, WAITING)])
+    _issue(library.cursor(), 10, 1, 5, NOW)
+    assert library.statuses() == {7: FULFILLED, 8: WAITING}
+    assert library.books[10] == 0
+
+
+def test_issue_leaves_other_members_holds():
+    library = Library(books={10: 0}, holds=[hold(7, 10, 2, READY)])
+    with pytest.raises(BookUnavailable):
+        _issue(library.cursor(), 10, 1, 5, NOW)
+    assert library.statuses() == {7: READY}
+    assert library.transactions == []
+
+
+def test_issue_takes_a_shelf_copy_when_the_ready_hold_just_closed():
+    # The hold expires between reading it and fulfilling it
+    library = Library(books={10: 1}, holds=[hold(7, 10, 1, READY)])
+
+    def expire(query, args):
+        if query.startswith("UPDATE holds") and library.holds[7]['status'] == READY:
+            library.holds[7]['status'] = EXPIRED
+
+    library.before_execute = expire
+    _issue(library.cursor(), 10, 1, 5, NOW)
+    assert library.statuses() == {7: EXPIRED}
+    assert library.books[10] == 0
+    assert len(library.transactions) == 1
+
+
+@pytest.mark.parametrize('book_id, member_id, error, message', [
+    (10, 9, NotFound, 'This Member Does Not Exist'),
+    (11, 1, NotFound, 'This Book Does Not Exist'),
+    (10, 1, BookUnavailable, 'No copies of this book are available to be rented'),
+])
+def test_issue_errors(book_id, member_id, error, message):
+    library = Library(books={10: 0})
+    with pytest.raises(error, match=message):
+        issue_book(library, book_id, member_id, 5, now=NOW)
+    assert (library.commits, library.rollbacks) == (0, 1)
+
+
+# Giving copies back and closing holds
+
+def test_release_copy_without_holds():
+    library = Library(books={10: 0}, holds=[hold(7, 10, 1, READY), hold(8, 11, 1, WAITING)])
+    assert _release_copy(library.cursor(), 10, NOW) is None
+    assert library.books[10] == 1
+    assert library.statuses() == {7: READY, 8: WAITING}
+
+
+def test_release_copy_to_the_oldest_waiting_hold():
+    library = Library(books={10: 0}, holds=[hold(9, 10, 3, WAITING), hold(8, 10, 2, WAITING),
+                                            hold(7, 10, 1, CANCELLED)])
+    assert _release_copy(library.cursor(), 10, NOW) == {'id': 8, 'member_id': 2}
+    assert library.statuses() == {9: WAITING, 8: READY, 7: CANCELLED}
+    assert library.holds[8]['ready_on'] == NOW
+    # Set aside for the hold, not on the shelf
+    assert library.books[10] == 0
+
+
+def test_cancel_waiting_hold():
+    library = Library(books={10: 0}, holds=[hold(7, 10, 1, WAITING), hold(8, 10, 2, WAITING)])
+    closed = cancel_hold(library, 7, now=NOW)
+    assert (closed['status'], closed['next_hold']) == (WAITING, None)
+    assert library.statuses() == {7: CANCELLED, 8: WAITING}
+    assert library.holds[7]['closed_on'] == NOW
+    assert library.books[10] == 0
+    assert library.commits == 1
+
+
+def test_cancel_ready_hold_passes_the_copy_on():
+    library = Library(books={10: 0}, holds=[hold(7, 10, 1, READY), hold(8, 10, 2, WAITING)])
+    closed = cancel_hold(library, 7, now=NOW)
+    assert closed['next_hold'] == {'id': 8, 'member_id': 2}
+    assert library.statuses() == {7: CANCELLED, 8: READY}
+    assert library.books[10] == 0
+
+
+def test_expire_ready_hold_puts_the_copy_back():
+    library = Library(books={10: 0}, holds=[hold(7, 10, 1, READY)])
+    closed = _close_hold(library.cursor(), 7, EXPIRED, NOW)
+    assert closed['next_hold'] is None
+    assert library.statuses() == {7: EXPIRED}
+    assert library.books[10] == 1
+
+
+@pytest.mark.parametrize('status', [FULFILLED, CANCELLED, EXPIRED])
+def test_close_inactive_hold(status):
+    library = Library(books={10: 0}, holds=[hold(7, 10, 1, status)])
+    with pytest.raises(HoldClosed):
+        _close_hold(library.cursor(), 7, CANCELLED, NOW)
+    assert library.statuses() == {7: status}
+
+
+def test_close_hold_closed_concurrently():
+    library = Library(books={10: 0}, holds=[hold(7, 10, 1, READY), hold(8, 10, 2, WAITING)])
+
+    def fulfil(query, args):
+        if query.startswith("UPDATE holds SET status=%s, closed_on=%s"):
+            library.holds[7]['status'] = FULFILLED
+
+    library.before_execute = fulfil
+    with pytest.raises(HoldClosed):
+        _close_hold(library.cursor(), 7, CANCELLED, NOW)
+    # Its copy went with the issue, nothing is passed on
+    assert library.statuses() == {7: FULFILLED, 8: WAITING}
+    assert library.books[10] == 0
+
+
+def test_close_missing_hold():
+    with pytest.raises(NotFound):
+        _close_hold(Library().cursor(), 7, CANCELLED, NOW)
@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+
+import pytest
+import requests
+
+from frappe_client import FrappeClient, FrappeError, ResponseCache, RetryableError, retry_after_seconds
+
+
+# frappe_client.FrappeClient against benchmarks/fake_frappe.py
+
+def make_client(base_url, **options):
+    options.setdefault('backoff', 0.01)
+    options.setdefault('max_backoff', 0.05)
+    return FrappeClient(requests.Session(), base_url, **options)
+
+
+def test_fetch_page(frappe_server):
+    base_url, state = frappe_server(books=30)
+    client = make_client(base_url)
+    assert [book['bookID'] for book in client.fetch_page(2)] == [str(n) for n in range(21, 31)]
+    assert client.fetch_page(3) == []
+    assert state['requests'] == 2
+
+
+def test_retries_503(frappe_server):
+    base_url, state = frappe_server(books=30, error_rate=0.5, draws=[0.0, 0.0])
+    books = make_client(base_url).fetch_page(1)
+    assert len(books) == 20
+    assert state['requests'] == 3
+
+
+def test_gives_up_after_retries(frappe_server):
+    base_url, state = frappe_server(books=30, error_rate=1.0)
+    with pytest.raises(FrappeError, match='HTTP 503 after 3 attempts'):
+        make_client(base_url, retries=2).fetch_page(1)
+    assert state['requests'] == 3
+
+
+def test_retries_non_json_body(frappe_server):
+    base_url, state = frappe_server(books=30, garbage_rate=0.5, draws=[0.0])
+    assert len(make_client(base_url).fetch_page(1)) == 20
+    assert state['requests'] == 2
+
+
+def test_honours_retry_after_on_429(frappe_server):
+    # One request per second: the second page is answered 429 with
+    # Retry-After: 1 and fetched again once the window has passed
+    base_url, state = frappe_server(books=60, rate_limit=1)
+    client = make_client(base_url, max_backoff=30)
+    client.fetch_page(1)
+    start = time.monotonic()
+    assert len(client.fetch_page(2)) == 20
+    assert time.monotonic() - start >= 0.9
+    assert state['requests'] == 3
+
+
+def test_retry_after_is_capped_by_max_backoff():
+    client = make_client('http://unused', max_backoff=2)
+    assert client.delay(0, RetryableError('HTTP 429', retry_after=1)) == 1
+    assert client.delay(0, RetryableError('HTTP 429', retry_after=120)) == 2
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds('3') == 3.0
+    assert retry_after_seconds('Thu, 01 Jan 1970 00:00:00 GMT') == 0.0
+    assert retry_after_seconds('soon') is None
+    assert retry_after_seconds(None) is None
+
+
+def test_read_timeout_on_a_stalled_page(frappe_server):
+    base_url, state = frappe_server(books=30, stall_rate=0.5, stall=3, draws=[0.0])
+    start = time.monotonic()
+    books = make_client(base_url, read_timeout=0.2).fetch_page(1)
+    assert len(books) == 20
+    assert state['requests'] == 2
+    assert time.monotonic() - start < 2
+
+
+def test_stalled_page_fails_without_retries(frappe_server):
+    base_url, _ = frappe_server(books=30, stall_rate=1.0, stall=3)
+    with pytest.raises(FrappeError, match='Timeout'):
+        make_client(base_url, read_timeout=0.2, retries=0).fetch_page(1)
+
+
+def test_other_4xx_fails_at_once(frappe_server):
+    base_url, state = frappe_server(books=30)
+    with pytest.raises(FrappeError, match='HTTP 404'):
+        make_client(base_url.replace('frappe-library', 'missing')).fetch_page(1)
+    assert state['requests'] == 0
+
+
+def test_response_cache_serves_a_rerun(frappe_server, tmp_path):
+    base_url, state = frappe_server(books=30)
+    first = make_client(base_url, cache=ResponseCache(str(tmp_path)))
+    books = first.fetch_page(1, title='river')
+    assert first.fetch_page(1, title='river') == books
+    assert first.cache.hits == 1
+
+    # A new client on the same directory, as a re-run of the import
+    rerun = make_client(base_url, cache=ResponseCache(str(tmp_path)))
+    assert rerun.fetch_page(1, title='river') == books
+    assert rerun.cache.hits == 1
+    assert state['requests'] == 1
+
+    # Other query parameters are another entry
+    rerun.fetch_page(1, title='night')
+    assert state['requests'] == 2
+
+
+def test_response_cache_skips_empty_pages(frappe_server, tmp_path):
+    # The page past the end is fetched again, in case books were added
+    base_url, state = frappe_server(books=30)
+    client = make_client(base_url, cache=ResponseCache(str(tmp_path)))
+    assert client.fetch_page(3) == []
+    assert client.fetch_page(3) == []
+    assert state['requests'] == 2
+    assert client.cache.hits == 0
+    assert os.listdir(tmp_path) == []
+
+
+def test_response_cache_counts_from_threads(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.set('url', {'page': 1}, [{'bookID': '1'}])
+
+    def read(page):
+        for _ in range(200):
+            cache.get('url', {'page': page})
+
+    threads = [threading.Thread(target=read, args=(page,)) for page in (1, 2) * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (cache.hits, cache.misses) == (800, 800)
+
+
+def test_response_cache_drops_expired_entries(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl=0)
+    cache.set('url', {'page': 1}, [])
+    path = cache.path('url', {'page': 1})
+    time.sleep(0.01)
+    assert cache.get('url', {'page': 1}) is None
+    assert not os.path.exists(path)
@@ -0,0 +1,179 @@
+from importer import BookImporter, normalize_page, parse_date
+
+
+# importer.BookImporter against benchmarks/fake_frappe.py, writing to an
+# in-memory SQLite books table (books_db)
+
+def make_importer(connection, base_url, **options):
+    client_options = {'backoff': 0.01, 'max_backoff': 0.05}
+    client_options.update(options)
+    return BookImporter(connection, base_url, workers=3, batch_size=15, client_options=client_options)
+
+
+def test_imports_books(frappe_server, books_db):
+    base_url, _ = frappe_server(books=100)
+    result = make_importer(books_db, base_url).run(30, quantity=2)
+    assert result.imported == 30
+    assert result.duplicates == 0
+    assert result.failed == 0
+    assert books_db.ids() == list(range(1, 31))
+    assert [book[0] for book in result.imported_books] == list(range(1, 31))
+    row = books_db.db.execute("SELECT * FROM books WHERE id=1").fetchone()
+    assert (row['total_quantity'], row['available_quantity']) == (2, 2)
+
+
+def test_counts_duplicates(frappe_server, books_db):
+    base_url, _ = frappe_server(books=100)
+    for book_id in (2, 3, 25):
+        books_db.add_book(book_id)
+    result = make_importer(books_db, base_url).run(30)
+    assert result.imported == 30
+    assert result.duplicates == 3
+    assert sorted(result.repeated_book_ids) == [2, 3, 25]
+    assert len(books_db.ids()) == 33
+
+
+def test_runs_out_of_books(frappe_server, books_db):
+    base_url, _ = frappe_server(books=25)
+    result = make_importer(books_db, base_url).run(100)
+    assert result.imported == 25
+    assert result.pages_fetched == 2
+    assert result.error is None
+
+
+def test_book_inserted_by_another_writer(frappe_server, books_db):
+    # Book 4 appears after existing_ids() has looked: the insert leaves it
+    # alone and it is counted as a duplicate, not as imported
+    base_url, _ = frappe_server(books=100)
+
+    class RacingImporter(BookImporter):
+        def existing_ids(self, cursor, ids):
+            found = super().existing_ids(cursor, ids)
+            if '4' in ids:
+                books_db.add_book(4, 'Raced')
+            return found
+
+    importer = RacingImporter(books_db, base_url, workers=3, batch_size=15)
+    result = importer.run(10)
+    assert result.imported == 10
+    assert result.raced == 1
+    assert result.duplicates == 1
+    assert 4 not in [book[0] for book in result.imported_books]
+    assert books_db.db.execute("SELECT title FROM books WHERE id=4").fetchone()['title'] == 'Raced'
+    assert len(books_db.ids()) == 11
+
+
+def test_retries_failed_pages(frappe_server, books_db):
+    base_url, state = frappe_server(books=100, error_rate=0.3, garbage_rate=0.3, draws=[0.0, 0.4, 0.0])
+    result = make_importer(books_db, base_url).run(40)
+    assert result.imported == 40
+    assert result.error is None
+    assert state['requests'] > result.pages_fetched
+
+
+def test_stops_on_a_page_that_keeps_failing(frappe_server, books_db):
+    base_url, _ = frappe_server(books=100, error_rate=1.0)
+    result = make_importer(books_db, base_url, retries=1).run(40)
+    assert result.imported == 0
+    assert 'HTTP 503' in result.error
+    assert books_db.ids() == []
+
+
+def test_progress(frappe_server, books_db):
+    base_url, _ = frappe_server(books=100)
+    seen = []
+    make_importer(books_db, base_url).run(45, progress=lambda result: seen.append(result.imported))
+    assert seen[-1] == 45
+    assert seen == sorted(seen)
+
+
+# normalize_page() and parse_date() on records as the API returns them
+
+RECORD = {
+    'bookID': '1',
+    'title': 'Harry Potter and the Half-Blood Prince (Harry Potter  #6)',
+    'authors': 'J.K. Rowling/Mary GrandPré',
+    'average_rating': '4.57',
+    'isbn': '0439785960',
+    'isbn13': '9780439785969',
+    'language_code': 'eng',
+    '  num_pages': '652',
+    'ratings_count': '2095690',
+    'text_reviews_count': '27591',
+    'publication_date': '9/16/2006',
+    'publisher': 'Scholastic Inc.',
+}
+
+
+def record(**values):
+    book = dict(RECORD)
+    book.update(values)
+    return book
+
+
+def test_parse_date():
+    assert parse_date('9/16/2006') == '2006-09-16'
+    assert parse_date(' 1/1/2000 ') == '2000-01-01'
+    assert parse_date('2006-09-16') is None
+    assert parse_date('16/9/2006') is None
+    assert parse_date('2/30/2006') is None
+    assert parse_date('') is None
+
+
+def test_normalize_page():
+    rows, rejected = normalize_page([RECORD, record(bookID='2', average_rating='', publication_date='',
+                                                    isbn=' ')], 3)
+    assert rejected == []
+    assert rows == [
+        (1, 'Harry Potter and the Half-Blood Prince (Harry Potter  #6)', 'J.K. Rowling/Mary GrandPré', 4.57,
+         '0439785960', '9780439785969', 'eng', 652, 2095690, 27591, '2006-09-16', 'Scholastic Inc.', 3, 3),
+        (2, 'Harry Potter and the Half-Blood Prince (Harry Potter  #6)', 'J.K. Rowling/Mary GrandPré', None,
+         None, '9780439785969', 'eng', 652, 2095690, 27591, None, 'Scholastic Inc.', 3, 3),
+    ]
+
+
+def test_normalize_page_reads_keys_with_stray_spaces():
+    book = record()
+    del book['  num_pages']
+    book['num_pages'] = '100'
+    (row,), _ = normalize_page([book], 1)
+    assert row[7] == 100
+    book = record()
+    del book['  num_pages']
+    (row,), _ = normalize_page([book], 1)
+    assert row[7] is None
+
+
+def test_normalize_page_rejects():
+    records = [
+        record(bookID='10', publication_date='2006-09-16'),
+        record(bookID='11', publication_date='2/30/2006'),
+        record(bookID='12', average_rating='6'),
+        record(bookID='13', average_rating='nan'),
+        record(bookID='14', average_rating='inf'),
+        record(bookID='15', **{'  num_pages': 'many'}),
+        record(bookID='16', title='  '),
+        record(bookID='17', isbn='04397859601'),
+        record(bookID='x'),
+        'not a record',
+    ]
+    rows, rejected = normalize_page(records, 1)
+    assert rows == []
+    assert rejected == [
+        {'id': '10', 'title': RECORD['title'], 'errors': {'publication_date': ['Not a valid M/D/YYYY date.']}},
+        {'id': '11', 'title': RECORD['title'], 'errors': {'publication_date': ['Not a valid M/D/YYYY date.']}},
+        {'id': '12', 'title': RECORD['title'], 'errors': {'average_rating': ['Out of range.']}},
+        {'id': '13', 'title': RECORD['title'], 'errors': {'average_rating': ['Out of range.']}},
+        {'id': '14', 'title': RECORD['title'], 'errors': {'average_rating': ['Out of range.']}},
+        {'id': '15', 'title': RECORD['title'], 'errors': {'num_pages': ['Not a valid int value.']}},
+        {'id': '16', 'title': '  ', 'errors': {'title': ['This field is required.']}},
+        {'id': '17', 'title': RECORD['title'], 'errors': {'isbn': ['Longer than 10 characters.']}},
+        {'id': 'x', 'title': RECORD['title'], 'errors': {'id': ['Not a valid int value.']}},
+        {'id': None, 'title': None, 'errors': {'record': ['Not an object.']}},
+    ]
+
+
+def test_normalize_page_reports_every_reason():
+    _, (rejected,) = normalize_page([record(bookID='0', authors='', ratings_count='-1')], 1)
+    assert rejected['errors'] == {'id': ['Out of range.'], 'author': ['This field is required.'],
+                                  'ratings_count': ['Out of range.']}
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+import jobs
+from jobs import JobQueue, JobStore
+
+
+# jobs.JobQueue saving to a JobStore over stub connections that record the
+# statements they run
+
+class Cursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, args=None):
+        if self.connection.broken:
+            raise ConnectionError('server has gone away')
+        self.connection.statements.append((query, args))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class Connection:
+    def __init__(self, statements):
+        self.statements = statements
+        self.broken = False
+        self.closed = False
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def store():
+    statements = []
+    connections = []
+
+    def connect():
+        connections.append(Connection(statements))
+        return connections[-1]
+
+    store = JobStore(None, connect)
+    store.statements = statements
+    store.connections = connections
+    return store
+
+
+def saved_statuses(store, job_id):
+    return [args[3] for query, args in store.statements if query == jobs.SAVE_JOB_SQL and args[0] == job_id]
+
+
+def test_saves_keep_one_connection(store):
+    queue = JobQueue()
+    queue.store = store
+    job = queue.submit('test', lambda job: 'ok')
+    queue.shutdown()
+    assert saved_statuses(store, job.id)[-1] == 'done'
+    assert len(store.connections) == 1
+    # Closed once no job is left
+    assert store.connections[0].closed
+
+
+def test_save_retries_on_a_new_connection(store):
+    job = jobs.Job('test')
+    store.save(job)
+    store.connections[0].broken = True
+    store.save(job)
+    assert len(store.connections) == 2
+    assert store.connections[0].closed
+    assert len(saved_statuses(store, job.id)) == 2
+
+
+def test_heartbeat_saves_a_quiet_job(store, monkeypatch):
+    monkeypatch.setattr(jobs, 'HEARTBEAT_INTERVAL', 0.05)
+    release = threading.Event()
+    queue = JobQueue()
+    queue.store = store
+    job = queue.submit('test', lambda job: release.wait(5))
+    time.sleep(0.5)
+    release.set()
+    queue.shutdown()
+    statuses = saved_statuses(store, job.id)
+    # queued, running, then heartbeats while it reported nothing
+    assert statuses.count('running') > 3
+    assert statuses[-1] == 'done'
@@ -0,0 +1,154 @@
+import sqlite3
+
+import pytest
+
+from search import SearchIndex
+
+
+# search.SearchIndex loaded from an in-memory SQLite books table
+
+BOOKS = [
+    (1, 'The River Between', 'Ngugi wa Thiongo', 'Heinemann'),
+    (2, 'A River Runs Through It', 'Norman Maclean', 'University of Chicago Press'),
+    (3, 'Riverside Stories', 'Anne River', 'Penguin'),
+    (4, 'Harry Potter and the Chamber of Secrets', 'J.K. Rowling', 'Scholastic'),
+    (5, 'Harry Potter and the Prisoner of Azkaban', 'J.K. Rowling', 'Scholastic'),
+]
+
+
+@pytest.fixture
+def index():
+    connection = sqlite3.connect(':memory:')
+    connection.execute("CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT, author TEXT, publisher TEXT)")
+    connection.executemany("INSERT INTO books VALUES (?, ?, ?, ?)", BOOKS)
+    index = SearchIndex()
+    index.load_from_cursor(connection.cursor(), version='v1')
+    connection.close()
+    return index
+
+
+def ids(ranked):
+    return [book_id for book_id, _ in ranked]
+
+
+def test_load_from_cursor(index):
+    assert index.loaded
+    assert index.version == 'v1'
+    assert len(index) == len(BOOKS)
+    total, ranked = index.search('potter')
+    assert total == 2
+    assert sorted(ids(ranked)) == [4, 5]
+
+
+def test_every_query_token_has_to_match(index):
+    total, ranked = index.search('harry azkaban')
+    assert (total, ids(ranked)) == (1, [5])
+    assert index.search('harry dune') == (0, [])
+
+
+def test_prefix_match(index):
+    total, ranked = index.search('azka')
+    assert ids(ranked) == [5]
+    # Tokens shorter than MIN_PREFIX_LENGTH only match exactly
+    assert index.search('a', fields=['author'])[0] == 0
+
+
+def test_exact_match_ranks_above_prefix_match(index):
+    _, ranked = index.search('river', fields=['title'])
+    # "riverside" is only a prefix match
+    assert ids(ranked)[-1] == 3
+    assert set(ids(ranked)) == {1, 2, 3}
+
+
+def test_title_ranks_above_author(index):
+    _, ranked = index.search('river')
+    scores = dict(ranked)
+    # Book 3 matches "river" exactly in the author only, books 1 and 2 in the title
+    assert scores[1] > scores[3]
+    assert scores[2] > scores[3]
+
+
+def test_fields(index):
+    assert ids(index.search('river', fields=['author'])[1]) == [3]
+    assert index.search('rowling', fields=['title'])[0] == 0
+
+
+def test_pagination(index):
+    total, first = index.search('river', limit=2)
+    _, rest = index.search('river', offset=2, limit=2)
+    assert total == 3
+    assert len(first) == 2
+    assert ids(first) + ids(rest) == ids(index.search('river')[1])
+
+
+def test_search_any_adds_up_clauses(index):
+    total, ranked = index.search_any([('rowling', ['author']), ('secrets', ['title'])])
+    assert total == 2
+    assert ids(ranked)[0] == 4
+
+
+def test_add(index):
+    index.add({'id': 6, 'title': 'Riverboat Gambler', 'author': 'Someone', 'publisher': 'Penguin'})
+    assert 6 in ids(index.search('riverb')[1])
+    assert index.search('gambler')[0] == 1
+
+
+def test_add_replaces_a_book(index):
+    index.add((4, 'Harry Potter and the Goblet of Fire', 'J.K. Rowling', 'Scholastic'))
+    assert index.search('secrets')[0] == 0
+    assert ids(index.search('goblet')[1]) == [4]
+    assert len(index) == len(BOOKS)
+
+
+def test_remove(index):
+    index.remove(5)
+    assert index.search('azkaban') == (0, [])
+    # The last book with a token takes it out of the prefix vocabulary too
+    assert index.search('azk') == (0, [])
+    assert ids(index.search('potter')[1]) == [4]
+
+
+def test_stale(index):
+    assert not index.stale('v1')
+    assert index.stale('v2')
+    index.follow('v1', 'v2')
+    assert not index.stale('v2')
+    index.expire()
+    assert index.stale('v2')
+
+
+def test_writes_during_load_are_applied_again(index):
+    rows = iter([(1, 'Old Title', 'A', 'P')])
+
+    def reading():
+        # A write that lands while the new index is being read
+        yield next(rows)
+        index.add((7, 'Late Arrival', 'B', 'P'))
+        index.remove(1)
+
+    index.load(reading(), version='v2')
+    assert index.search('late')[0] == 1
+    assert index.search('old')[0] == 0
+
+
+def test_load_matches_adding_one_by_one(index):
+    added = SearchIndex()
+    for book in BOOKS:
+        added.add(book)
+    assert index._vocabulary == added._vocabulary
+    assert index._postings == added._postings
+    assert all(vocabulary == sorted(vocabulary) for vocabulary in index._vocabulary.values())
+
+
+def test_load_once():
+    index = SearchIndex()
+    calls = []
+
+    def load():
+        calls.append(1)
+        index.load(BOOKS)
+
+    index.load_once(load)
+    index.load_once(load)
+    assert calls == [1]
+    assert len(index) == len(BOOKS)
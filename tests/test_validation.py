@@ -0,0 +1,80 @@
+import pytest
+
+import validation
+from validation import EmailChecker, check_email
+
+
+# validation.check_email() rules, and EmailChecker's MX results with the DNS
+# lookup replaced
+
+@pytest.mark.parametrize('email', [
+    'reader@example.org',
+    'first.last+library@mail.example.co.uk',
+    "o'brien@library.ie",
+    'reader@sub-domain.library.org',
+    'reader@bücher.de',
+    'reader@пример.рф',
+    'reader@xn--bcher-kva.de',
+])
+def test_accepted(email):
+    assert check_email(email) is None
+
+
+@pytest.mark.parametrize('email, error', [
+    ('', "Email address must contain a single @"),
+    ('reader.example.org', "Email address must contain a single @"),
+    ('a@b@example.org', "Email address must contain a single @"),
+    ('@example.org', "Invalid email address"),
+    ('first..last@example.org', "Invalid email address"),
+    ('.reader@example.org', "Invalid email address"),
+    ('jürgen@example.org', "Invalid email address"),
+    ('读者@example.org', "Invalid email address"),
+    ('x' * 65 + '@example.org', "Invalid email address"),
+    ('x@localhost', "Invalid email domain localhost"),
+    ('reader@example', "Invalid email domain example"),
+    ('reader@-library.org', "Invalid email domain -library.org"),
+    ('reader@library..org', "Invalid email domain library..org"),
+    ('reader@library.org2', "Invalid email domain library.org2"),
+    ('reader@192.168.0.1', "Invalid email domain 192.168.0.1"),
+    ('reader@library.test', "library.test is a reserved domain"),
+    ('reader@mail.example', "mail.example is a reserved domain"),
+    ('reader@printer.local', "printer.local is a reserved domain"),
+    ('reader@host.localhost', "host.localhost is a reserved domain"),
+    ('reader@nowhere.invalid', "nowhere.invalid is a reserved domain"),
+])
+def test_rejected(email, error):
+    assert check_email(email) == error
+
+
+def test_length_limits():
+    domain = '.'.join(['a' * 63] * 3) + '.org'
+    assert check_email('r@' + domain) is None
+    assert check_email('r@' + 'a' * 64 + '.org') == f"Invalid email domain {'a' * 64}.org"
+    assert check_email('x' * 64 + '@' + 'a' * 186 + '.org') == "Email address is too long"
+
+
+def test_checker_verifies_domains_in_the_background(monkeypatch):
+    lookups = []
+
+    def domain_accepts_mail(domain, timeout):
+        lookups.append(domain)
+        return domain != 'nomail.org'
+
+    monkeypatch.setattr(validation, 'domain_accepts_mail', domain_accepts_mail)
+    checker = EmailChecker(verify_mx=True, workers=1)
+    # Unknown domains are accepted while they are looked up
+    assert checker.check('a@nomail.org') is None
+    assert checker.check('a@Bücher.de') is None
+    checker._executor.shutdown(wait=True)
+    assert lookups == ['nomail.org', 'xn--bcher-kva.de']
+    assert checker.check('b@nomail.org') == "nomail.org does not accept email"
+    assert checker.check('b@bücher.de') is None
+    # Malformed addresses are refused without a lookup
+    assert checker.check('b@nomail') == "Invalid email domain nomail"
+    assert len(lookups) == 2
+
+
+def test_checker_without_mx_verification(monkeypatch):
+    monkeypatch.setattr(validation, 'domain_accepts_mail', lambda domain, timeout: pytest.fail('looked up'))
+    checker = EmailChecker()
+    assert checker.check('a@nomail.org') is None
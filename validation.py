@@ -0,0 +1,148 @@
+import concurrent.futures
+import logging
+import os
+import re
+import socket
+import threading
+
+from cache import LRUCache
+
+
+# Member email validation.
+#
+# check_email() is a purely offline check: RFC 5321 lengths, a dot-atom local
+# part and a domain of valid DNS labels under an alphabetic (or IDNA) top
+# level domain, excluding the reserved names that can never receive mail
+# (RFC 2606/6761). It is the rule for both adding and editing a member.
+#
+# EmailChecker adds optional MX verification without making a request wait
+# on DNS: a request only consults a TTL cache of domain results. A domain
+# that is not in the cache is accepted and looked up on a background thread,
+# so later submissions for a domain found to take no mail are refused. MX
+# records are resolved with dnspython when it is installed, otherwise the
+# domain's address records are used (the implicit MX of RFC 5321). Members
+# saved before their domain was found to take no mail are logged.
+
+MAX_EMAIL_LENGTH = 254
+MAX_LOCAL_LENGTH = 64
+MAX_DOMAIN_LENGTH = 253
+
+LOCAL_PART = re.compile(r"^[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*$")
+DOMAIN_LABEL = re.compile(r'^[A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?$')
+TOP_LEVEL_DOMAIN = re.compile(r'^([A-Za-z]{2,63}|xn--[A-Za-z0-9-]{1,59})$')
+RESERVED_DOMAINS = ('example', 'invalid', 'localhost', 'local', 'test')
+
+DNS_TIMEOUT = 3.0
+DNS_WORKERS = 2
+DOMAIN_CACHE_SIZE = 10000
+DOMAIN_CACHE_TTL = 24 * 3600
+
+log = logging.getLogger('library.validation')
+
+
+def check_email(email):
+    # Returns an error message, or None for a well-formed address
+    if not email or email.count('@') != 1:
+        return "Email address must contain a single @"
+    if len(email) > MAX_EMAIL_LENGTH:
+        return "Email address is too long"
+    local, domain = email.split('@')
+    if not local or len(local) > MAX_LOCAL_LENGTH or not LOCAL_PART.match(local):
+        return "Invalid email address"
+    try:
+        domain = domain.encode('idna').decode('ascii')
+    except UnicodeError:
+        return f"Invalid email domain {domain}"
+    labels = domain.lower().split('.')
+    if len(domain) > MAX_DOMAIN_LENGTH or len(labels) < 2 \
+            or not all(DOMAIN_LABEL.match(label) for label in labels) \
+            or not TOP_LEVEL_DOMAIN.match(labels[-1]):
+        return f"Invalid email domain {domain}"
+    if labels[-1] in RESERVED_DOMAINS:
+        return f"{domain} is a reserved domain"
+    return None
+
+
+def email_domain(email):
+    return email.rsplit('@', 1)[1].encode('idna').decode('ascii').lower()
+
+
+def domain_accepts_mail(domain, timeout=DNS_TIMEOUT):
+    # True or False, or None when DNS gave no answer either way
+    try:
+        import dns.exception
+        import dns.resolver
+    except ImportError:
+        dns = None
+
+    if dns is not None:
+        try:
+            answers = dns.resolver.resolve(domain, 'MX', lifetime=timeout)
+            # A "null MX" (RFC 7505) declares that the domain takes no mail
+            return any(str(answer.exchange) != '.' for answer in answers)
+        except dns.resolver.NXDOMAIN:
+            return False
+        except dns.resolver.NoAnswer:
+            pass
+        except dns.exception.DNSException:
+            return None
+
+    try:
+        socket.getaddrinfo(domain, 25, proto=socket.IPPROTO_TCP)
+        return True
+    except socket.gaierror as e:
+        if e.errno == socket.EAI_NONAME:
+            return False
+        return None
+
+
+class EmailChecker:
+    def __init__(self, verify_mx=False, ttl=DOMAIN_CACHE_TTL, timeout=DNS_TIMEOUT, workers=DNS_WORKERS):
+        self.verify_mx = verify_mx
+        self.timeout = timeout
+        self.workers = workers
+        self.domains = LRUCache(maxsize=DOMAIN_CACHE_SIZE, ttl=ttl)
+        self._pending = set()
+        self._executor = None
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._pending = set()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def check(self, email):
+        error = check_email(email)
+        if error or not self.verify_mx:
+            return error
+        domain = email_domain(email)
+        accepts_mail = self.domains.get(domain)
+        if accepts_mail is None:
+            self.verify_later(domain)
+        elif not accepts_mail:
+            return f"{domain} does not accept email"
+        return None
+
+    def verify_later(self, domain):
+        with self._lock:
+            if domain in self._pending:
+                return
+            self._pending.add(domain)
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='dns')
+        self._executor.submit(self.verify, domain)
+
+    def verify(self, domain):
+        try:
+            accepts_mail = domain_accepts_mail(domain, self.timeout)
+            # Lookups that failed either way are retried by the next check
+            if accepts_mail is not None:
+                self.domains.set(domain, accepts_mail)
+            if accepts_mail is False:
+                log.warning('email_domain_rejected', extra={'fields': {'domain': domain}})
+        finally:
+            with self._lock:
+                self._pending.discard(domain)
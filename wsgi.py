@@ -0,0 +1,10 @@
+from app import create_app
+
+
+# WSGI entry point for production servers and the `flask` CLI, which finds
+# this module before app.py:
+#
+#   gunicorn -c gunicorn.conf.py
+#   flask db upgrade
+
+app = application = create_app()